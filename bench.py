@@ -0,0 +1,435 @@
+"""DeskGo 无界面基准测试。
+
+    python bench.py                          # 跑全部基准，JSON 输出到标准输出
+    python bench.py -o baseline.json         # 保存为基线
+    python bench.py --compare baseline.json  # 与基线比较，有回退时退出码为 1
+    python bench.py --real-tk                # 用真实 Tk（例如在 Xvfb 下）
+    python bench.py --trace session.dgt      # 附加重放录制的轨迹
+
+默认装一个最小的 tkinter 替身，不需要显示器；after 定时器只记账不执行，
+基准直接调用被测函数，需要"下一帧"时手动触发对应的合并回调。
+"""
+import sys
+import os
+import io
+import gc
+import json
+import time
+import types
+import random
+import argparse
+import platform
+import statistics
+import contextlib
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# --------------- 1. Tk 替身 ---------------
+def install_stub_tk():
+    """注册一个不连显示器的 tkinter 模块，只实现 deskgo 用到的接口"""
+    tk = types.ModuleType("tkinter")
+    tk.TkVersion = 8.6
+
+    class TclError(Exception):
+        pass
+
+    class Widget:
+        _ids = 0
+
+        def __init__(self, master=None, **kw):
+            self.master = master
+            self._kw = kw
+
+        def _after(self, *args):
+            Widget._ids += 1
+            return f"after#{Widget._ids}"
+
+        after = after_idle = _after
+
+        def after_cancel(self, job):
+            pass
+
+        def config(self, *args, **kw):
+            if args:
+                return ("bg", "", "", "", "white")
+            self._kw.update(kw)
+        configure = config
+
+        def bind(self, *args, **kw):
+            pass
+        bind_all = bind
+
+        def pack(self, **kw):
+            pass
+
+        def create_image(self, *args, **kw):
+            return 1
+
+        def coords(self, *args):
+            pass
+
+        def itemconfig(self, *args, **kw):
+            pass
+
+        def winfo_screenwidth(self):
+            return 1920
+
+        def winfo_screenheight(self):
+            return 1080
+
+        def winfo_pointerxy(self):
+            return 960, 540
+
+        def overrideredirect(self, flag):
+            pass
+
+        def attributes(self, *args):
+            pass
+        wm_attributes = attributes
+
+        def geometry(self, spec=None):
+            pass
+
+        def withdraw(self):
+            pass
+
+        def destroy(self):
+            pass
+
+        def quit(self):
+            pass
+
+        def report_callback_exception(self, *exc):
+            import traceback
+            traceback.print_exception(*exc)
+
+    class PhotoImage:
+        """只保存 PIL 图像，像素内存和真实 PhotoImage 同量级"""
+
+        def __init__(self, image=None, **kw):
+            self.image = image
+
+        def width(self):
+            return self.image.size[0]
+
+        def height(self):
+            return self.image.size[1]
+
+    tk.TclError = TclError
+    tk.Tk = tk.Toplevel = tk.Label = tk.Canvas = tk.Menu = Widget
+    tk.PhotoImage = PhotoImage
+    messagebox = types.ModuleType("tkinter.messagebox")
+    messagebox.showerror = messagebox.showinfo = lambda *args, **kw: None
+    tk.messagebox = messagebox
+    sys.modules["tkinter"] = tk
+    sys.modules["tkinter.messagebox"] = messagebox
+    return PhotoImage
+
+
+# --------------- 2. 工具函数 ---------------
+def rss_bytes():
+    """当前常驻内存；没有 /proc 的平台返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def bench_cache_dir():
+    """每个基准用例一个临时缓存目录（精灵缓存、角色清单、预览图），用完即删：
+    不写用户的缓存目录，"disk" 计时也不受之前残留的缓存影响。
+    后台线程可能还在往里写，删不干净时忽略"""
+    return tempfile.TemporaryDirectory(prefix="deskgo-bench-", ignore_cleanup_errors=True)
+
+
+def new_world(deskgo, tk, cache_dir):
+    """config.json 的设置，但磁盘缓存放进 cache_dir；素材同步完整解码，
+    冷加载计时覆盖整段 GIF，而不只是渐进解码的第一帧"""
+    raw = deskgo.Config.read_raw()
+    deskgo.Config.mount_packs(raw)
+    settings = dict(deskgo.Config.merge_settings(raw), sprite_cache=True, sprite_cache_dir=cache_dir)
+    world = deskgo.PetWorld(tk.Tk(), asset_workers=0, settings=settings)
+    # 不在后台解码、扫描目录或生成预览图，避免干扰计时
+    world.asset_loader.preload = lambda *a, **kw: None
+    world.rescan_characters = lambda: None
+    world.thumbnails.request = lambda *a, **kw: None
+    return world, world.add_pet()
+
+
+def metric(value, unit, better="lower"):
+    """better 为 None 表示仅供参考（噪声大），比较时不判定回退"""
+    return {"value": round(value, 3), "unit": unit, "better": better}
+
+
+def timed(fn, repeat):
+    """返回 fn 多次运行的中位数耗时（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+# --------------- 3. 基准 ---------------
+def bench_load(deskgo, world, pet, repeat):
+    """每个 GIF 的 load_animation 延迟（冷解码 / 磁盘缓存 / 帧缓存命中），每个角色的内存"""
+    results = {}
+    disk_cache = world.sprite_cache
+    for name, state_map in world.characters.items():
+        paths = [p for p in dict.fromkeys(state_map.values()) if os.path.exists(p)]
+        for gif_path in paths:
+            label = os.path.relpath(gif_path, deskgo.Config.ASSETS_DIR).replace(os.sep, "/")
+
+            def cold():
+                world.frame_cache.discard_path(gif_path)
+                pet.load_animation(gif_path)
+            world.sprite_cache = None
+            results[f"load_animation.cold.{label}"] = metric(timed(cold, repeat), "ms")
+            if disk_cache is not None:
+                world.sprite_cache = disk_cache
+                cold()      # 先写入磁盘缓存
+                results[f"load_animation.disk.{label}"] = metric(timed(cold, repeat), "ms")
+            results[f"load_animation.warm.{label}"] = metric(
+                timed(lambda: pet.load_animation(gif_path), repeat), "ms")
+
+        # 内存：清空帧缓存后冷解码该角色全部 GIF（磁盘缓存的 mmap 页不摸不计入 RSS）
+        world.sprite_cache = None
+        world.frame_cache.clear()
+        pet.animation_frames = []
+        gc.collect()
+        before = rss_bytes()
+        for gif_path in paths:
+            pet.load_animation(gif_path)
+        photo = sum(world.frame_cache.get(deskgo.FrameCache.make_key(p, world.config.SPRITE_SCALE)).nbytes
+                    for p in paths)
+        results[f"memory.photo.{name}"] = metric(photo / 1048576, "MB")
+        if before is not None:
+            # 分配器会复用前一个角色释放的内存，RSS 增量只作参考
+            results[f"memory.rss_delta.{name}"] = metric((rss_bytes() - before) / 1048576, "MB", None)
+        world.sprite_cache = disk_cache
+    world.frame_cache.clear()
+    return results
+
+
+def _setup_motion(deskgo, pet, state):
+    """把宠物放到一段尽量长的运动起点"""
+    am, geom = pet.action_manager, pet.geometry
+    far_x, far_y = geom.screen_w - geom.w, geom.screen_h - geom.h
+    if state is deskgo.PetState.MOVING:
+        geom.move_to(0, 0)
+        pet.set_state(state)
+        am.target_pos = (far_x, far_y)
+        am.trajectory = None
+    elif state is deskgo.PetState.FALLING:
+        geom.move_to(far_x // 2, far_y // 2)
+        am.start_fall(0)
+    else:
+        geom.move_to(0, 0)
+        pet.pointer.x, pet.pointer.y = geom.screen_w, geom.screen_h
+        am.follow_mouse()
+
+
+def bench_ticks(deskgo, pet, ticks):
+    """ActionManager.update 单帧耗时；一段运动结束后在计时外重新布置"""
+    results = {}
+    for state in (deskgo.PetState.MOVING, deskgo.PetState.FALLING, deskgo.PetState.FOLLOWING_MOUSE):
+        done = 0
+        elapsed = 0.0
+        while done < ticks:
+            _setup_motion(deskgo, pet, state)
+            update = pet.action_manager.update
+            n = 0
+            t0 = time.perf_counter()
+            while pet.state is state and done + n < ticks:
+                update()
+                n += 1
+            elapsed += time.perf_counter() - t0
+            done += n
+        pet.set_state(deskgo.PetState.IDLE)
+        results[f"tick.update.{state.value}"] = metric(elapsed / ticks * 1e6, "us")
+    return results
+
+
+def bench_events(deskgo, world, pet, events):
+    """合成事件洪泛下的处理吞吐（每 16 个事件模拟一帧）"""
+    results = {}
+    rng = random.Random(0)
+    points = [(rng.randrange(1920), rng.randrange(1080)) for _ in range(events)]
+    motion = [types.SimpleNamespace(x_root=x, y_root=y) for x, y in points]
+
+    t0 = time.perf_counter()
+    for x, y in points:
+        pet._on_mouse_move(x, y)
+    results["events.on_mouse_move"] = metric(events / (time.perf_counter() - t0), "ops/s", "higher")
+
+    # 全局 <Motion> 洪泛：PointerTracker 合并后再分发给宠物
+    pointer = world.pointer
+    t0 = time.perf_counter()
+    for i, event in enumerate(motion, 1):
+        pointer.on_motion(event)
+        if i % 16 == 0:
+            pointer._flush()
+    results["events.pointer_motion"] = metric(events / (time.perf_counter() - t0), "ops/s", "higher")
+
+    pet._on_drag_start(motion[0])
+    t0 = time.perf_counter()
+    for i, event in enumerate(motion, 1):
+        pet._on_drag_motion(event)
+        if i % 16 == 0:
+            pet.drag.flush()
+    results["events.on_drag_motion"] = metric(events / (time.perf_counter() - t0), "ops/s", "higher")
+    pet._on_drag_release(motion[-1])
+    pet.set_state(deskgo.PetState.IDLE)
+    return results
+
+
+def bench_render(deskgo, world, pet, ticks):
+    """label / canvas 两种渲染器：换一帧的耗时，以及加载全部角色后的图像对象数和像素内存"""
+    results = {}
+    paths = [p for state_map in world.characters.values()
+             for p in dict.fromkeys(state_map.values()) if os.path.exists(p)]
+    paths = list(dict.fromkeys(paths))
+    # 换帧耗时用帧数最多的 GIF
+    busiest = max(paths, key=lambda p: len(deskgo.load_gif_frames(p, world.config.SPRITE_SCALE)))
+    for renderer in ("label", "canvas"):
+        world.config.RENDERER = renderer
+        world.apply_renderer()
+        images, pixels = set(), 0
+        for gif_path in paths:
+            pet.load_animation(gif_path)
+            for image in pet.animation.images():
+                if id(image) not in images:
+                    images.add(id(image))
+                    pixels += image.width() * image.height()
+        results[f"render.images.{renderer}"] = metric(len(images), "count")
+        results[f"render.image_mb.{renderer}"] = metric(pixels * 4 / 1048576, "MB")
+        pet.load_animation(busiest)
+        advance = pet._advance_frame
+        t0 = time.perf_counter()
+        for _ in range(ticks):
+            # 每次正好到期一帧
+            pet._animating = True
+            pet._next_frame_at = 0.0
+            advance(0.0)
+        results[f"render.advance_frame.{renderer}"] = metric((time.perf_counter() - t0) / ticks * 1e6, "us")
+    world.config.RENDERER = world.config.settings["renderer"]
+    world.apply_renderer()
+    world.frame_cache.clear()
+    return results
+
+
+def bench_replay(deskgo, tk, paths, repeat):
+    """把录制的轨迹当作工作负载：重放整段会话的耗时（每次都新建 PetWorld）"""
+    results = {}
+    for path in paths:
+        label = os.path.splitext(os.path.basename(path))[0]
+        runs = []
+        for _ in range(repeat):
+            with bench_cache_dir() as cache_dir:
+                info = deskgo.replay_trace(path, tk.Tk(), {"sprite_cache": True, "sprite_cache_dir": cache_dir})
+            if info["error"] or info["diverged_at"] is not None:
+                raise SystemExit(f"⚠️ 轨迹回放不一致: {path}")
+            runs.append(info["elapsed_s"] * 1000)
+        results[f"replay.{label}"] = metric(statistics.median(runs), "ms")
+    return results
+
+
+# --------------- 4. 基线比较 ---------------
+def compare(current, baseline, threshold):
+    """返回回退的指标列表，并打印对比表"""
+    regressions = []
+    for name, cur in sorted(current["results"].items()):
+        base = baseline.get("results", {}).get(name)
+        if base is None or not base["value"]:
+            continue
+        change = cur["value"] / base["value"] - 1
+        if cur["better"] is None:
+            worse = False
+        elif cur["better"] == "lower":
+            worse = change > threshold
+        else:
+            worse = change < -threshold
+        mark = "⚠️" if worse else "  "
+        print(f"{mark} {name:<48} {base['value']:>12.3f} -> {cur['value']:>12.3f} {cur['unit']:<6} ({change:+.0%})")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+# --------------- 5. 入口 ---------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DeskGo 无界面基准测试")
+    parser.add_argument("--real-tk", action="store_true", help="使用真实 Tk（需要显示器或 Xvfb）")
+    parser.add_argument("--only", nargs="+", choices=["load", "tick", "events", "render"],
+                        help="只运行指定的基准")
+    parser.add_argument("--repeat", type=int, default=5, help="load_animation 每项重复次数（取中位数）")
+    parser.add_argument("--ticks", type=int, default=5000, help="每种运动状态测量的帧数")
+    parser.add_argument("--events", type=int, default=20000, help="合成事件数")
+    parser.add_argument("--trace", nargs="+", default=[], metavar="FILE",
+                        help="额外把 deskgo.py --record 录制的轨迹作为工作负载重放计时")
+    parser.add_argument("-o", "--output", help="把结果 JSON 写入文件")
+    parser.add_argument("--compare", metavar="BASELINE", help="与基线 JSON 比较")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="比基线差多少（比例）算回退，默认 0.2")
+    args = parser.parse_args(argv)
+
+    photo_cls = None if args.real_tk else install_stub_tk()
+    os.chdir(HERE)              # 资源路径相对于仓库根目录
+    sys.path.insert(0, HERE)
+    import tkinter as tk
+    import deskgo
+    if photo_cls is not None:
+        deskgo.ImageTk.PhotoImage = photo_cls
+    deskgo._import_numpy()      # 预先导入，避免后台线程干扰计时
+
+    only = set(args.only or ("load", "tick", "events", "render"))
+    results = {}
+    cases = {
+        "load": lambda world, pet: bench_load(deskgo, world, pet, args.repeat),
+        "tick": lambda world, pet: bench_ticks(deskgo, pet, args.ticks),
+        "events": lambda world, pet: bench_events(deskgo, world, pet, args.events),
+        "render": lambda world, pet: bench_render(deskgo, world, pet, args.ticks),
+    }
+    with contextlib.redirect_stdout(io.StringIO()):   # 屏蔽状态切换时的打印
+        for name, run in cases.items():
+            if name not in only:
+                continue
+            with bench_cache_dir() as cache_dir:
+                world, pet = new_world(deskgo, tk, cache_dir)
+                results.update(run(world, pet))
+        if args.trace:
+            results.update(bench_replay(deskgo, tk, args.trace, args.repeat))
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": getattr(deskgo.np, "__version__", None),
+            "tk": "real" if args.real_tk else "stub",
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"⚠️ {len(regressions)} 项指标比基线差 {args.threshold:.0%} 以上")
+            return 1
+        print("✅ 没有发现回退")
+    elif not args.output:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,60 @@
+import time
 import tkinter as tk
-from tkinter import Menu, messagebox, simpledialog, filedialog
+from tkinter import Menu, messagebox
 import random
 import os
 import sys
 import glob
 from PIL import Image, ImageTk, ImageSequence
+np = None   # NumPy 可选，首帧显示后在后台线程导入，见 _import_numpy
 from enum import Enum
 import math
+import queue
+import threading
+import heapq
+import mmap
+import struct
+import zlib
+import io
+import re
+import hashlib
+import types
+from collections import OrderedDict, Counter, deque
+import bisect
+import contextlib
+import functools
+import json
+import operator
+import tempfile
+
+# 用于统计首帧耗时。在导入之后取值，减去进程已用的 CPU 时间回推到进程启动（导入基本都是 CPU 时间）
+_START_TIME = time.perf_counter() - time.process_time()
+_STARTUP_MARKS = [("进程启动", _START_TIME)]   # --profile-startup 的分阶段时间点
+
+
+def _startup_mark(phase):
+    """记录启动阶段的结束时间（只是追加一个元组，不开 --profile-startup 时也几乎无开销）"""
+    _STARTUP_MARKS.append((phase, time.perf_counter()))
+
+
+_startup_mark("导入模块")
+
+
+def _import_numpy():
+    """NumPy 导入要 0.1 s 左右，不放在首帧之前；没有安装时轨迹退回纯 Python 列表"""
+    global np
+    try:
+        import numpy
+    except ImportError:
+        return
+    np = numpy
 
 # --------------- 1. 配置中心 ---------------
-import json   # 新增
 class Config:
     ASSETS_DIR = "images"
     CONFIG_FILE = "config.json"
+    # 速度类设置沿用老版本"每 30 ms 一帧"的单位，编译时换算成每秒，与实际帧率无关
+    REFERENCE_FRAME_S = 0.03
 
     # 默认值（如果 config.json 缺失或不全）
     DEFAULTS = {
@@ -27,93 +69,2645 @@ class Config:
         'mouse_idle_time_before_action': 30000,
         'mouse_follow_speed': 5,
         'begin_fall_velocity': 200,
-        'fall_zoom_size': 150
+        'fall_zoom_size': 150,
+        'max_fall_speed': 20,           # 掉落速度上限
+        'sprite_scale': 1.0,            # GIF 缩放倍率
+        'frame_cache_entries': 32,      # 帧缓存最多保留的 GIF 数
+        'frame_cache_mb': 128,          # 帧缓存字节上限 (MB)
+        'memory_budget_mb': 0,          # 已解码帧（缓存 + 正在显示）的总预算 (MB)，0 表示不限制
+        'max_motion_fps': 33,           # 运动循环的最高帧率
+        'renderer': 'label',            # label：每帧一个 PhotoImage；canvas：整段动画一张图集
+        'pointer_poll_ms': 0,           # >0 时低频轮询指针，检测窗口外的鼠标移动
+        'sprite_cache': True,           # 把解码后的帧缓存到磁盘，加快下次启动
+        'sprite_cache_dir': '',         # 为空时使用用户缓存目录
+        'asset_packs': [],              # 资源包（相对 images/），后面的覆盖前面的，散文件再覆盖所有包
+        'hot_reload_ms': 2000,          # 检查 config.json / GIF 是否被修改的间隔，0 关闭热更新
+        'metrics_port': 0,              # >0 时在 127.0.0.1 上提供 JSON 运行指标
+        'metrics_file': '',             # 非空时定期把运行指标写入该文件
+        'metrics_interval_ms': 5000     # 指标快照的刷新间隔
     }
 
-    def __init__(self):
-        self.settings = self._load_settings()
+    # settings 编译成扁平的槽位属性：热路径上只是一次属性读取，不再经过 property + 字典
+    __slots__ = ('settings', 'DEFAULT_ANIMATION_SPEED', 'DEFAULT_MOVEMENT_SPEED',
+                 'ACTION_INTERVAL_MIN', 'ACTION_INTERVAL_MAX', 'DRAG_THRESHOLD', 'GRAVITY',
+                 'EDGE_SNAP_MARGIN', 'SNAP_SPEED_THRESHOLD', 'MOUSE_IDLE_TIME_BEFORE_ACTION',
+                 'MOUSE_FOLLOW_SPEED', 'begin_fall_velocity', 'fall_zoom_size', 'MAX_FALL_SPEED', 'SPRITE_SCALE',
+                 'MOTION_INTERVAL_MS', 'RENDERER', 'POINTER_POLL_MS', 'SPRITE_CACHE_DIR',
+                 'FRAME_CACHE_ENTRIES', 'FRAME_CACHE_BYTES', 'MEMORY_BUDGET_BYTES', 'HOT_RELOAD_MS',
+                 'METRICS_PORT', 'METRICS_FILE', 'METRICS_INTERVAL_MS')
 
-    def _load_settings(self):
-        """从 config.json 加载 settings 配置"""
-        config_path = os.path.join(self.ASSETS_DIR, self.CONFIG_FILE)
-        if not os.path.exists(config_path):
-            print(f"⚠️ 配置文件未找到: {config_path}，使用默认值")
-            return self.DEFAULTS.copy()
+    def __init__(self, settings=None):
+        self.apply(self.DEFAULTS.copy() if settings is None else settings)
 
+    @classmethod
+    def load(cls):
+        """只解析一次 config.json，返回 (Config, {角色名: {状态: gif路径}})"""
+        config, characters, _ = cls.load_with_index()
+        return config, characters
+
+    @classmethod
+    def load_with_index(cls, settings=None):
+        """同 load，另外返回角色索引；角色表是 config.json 与目录自动发现的合并结果。
+        给出 settings 时用它整体代替 config.json 的设置（角色清单也放进它指定的缓存目录）"""
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            settings = data.get("settings", {})
-            # 合并默认值，确保所有键都存在
-            merged = self.DEFAULTS.copy()
-            merged.update({k: v for k, v in settings.items() if k in self.DEFAULTS})
-            return merged
+            raw = cls.read_raw()
         except Exception as e:
             print(f"⚠️ 读取配置失败: {e}，使用默认值")
-            return self.DEFAULTS.copy()
+            raw = None
+        else:
+            if raw is None:
+                print(f"⚠️ 配置文件未找到: {cls.config_path()}，使用默认值")
+        cls.mount_packs(raw)
+        config = cls(cls.merge_settings(raw) if settings is None else settings)
+        explicit = cls.parse_characters(raw)
+        index = CharacterIndex(cls.ASSETS_DIR, config.SPRITE_CACHE_DIR)
+        if not index.load() and not explicit:
+            index.revalidate()      # 第一次运行且配置里没有角色：只能当场扫描
+        return config, index.merge(explicit), index
 
-    # --- 属性代理访问 ---
-    @property
-    def DEFAULT_ANIMATION_SPEED(self):
-        return self.settings['animation_speed']
+    @classmethod
+    def config_path(cls):
+        return os.path.join(cls.ASSETS_DIR, cls.CONFIG_FILE)
+
+    @classmethod
+    def read_raw(cls):
+        """读取并解析 config.json；文件不存在返回 None，解析失败抛出异常"""
+        path = cls.config_path()
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    @classmethod
+    def mount_packs(cls, raw):
+        """按 config.json 的 asset_packs 挂载资源包"""
+        packs = (raw or {}).get("settings", {}).get("asset_packs", [])
+        ASSET_FS.mount([os.path.join(cls.ASSETS_DIR, p) for p in packs])
+
+    @classmethod
+    def merge_settings(cls, raw):
+        """合并默认值、资源包里的设置和 config.json，确保所有键都存在"""
+        merged = cls.DEFAULTS.copy()
+        merged.update({k: v for k, v in ASSET_FS.settings().items() if k in cls.DEFAULTS})
+        settings = (raw or {}).get("settings", {})
+        merged.update({k: v for k, v in settings.items() if k in cls.DEFAULTS})
+        return merged
+
+    @classmethod
+    def validate(cls, settings):
+        """按默认值的类型检查设置（数值可以是 int 或 float），不合法时抛出 ValueError"""
+        if not isinstance(settings, dict):
+            raise ValueError("settings 不是一个对象")
+        bad = []
+        for key, value in settings.items():
+            default = cls.DEFAULTS.get(key)
+            if default is None:
+                continue
+            if isinstance(default, bool) or not isinstance(default, (int, float)):
+                ok = isinstance(value, type(default))
+            else:
+                ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if not ok:
+                bad.append(f"{key}={value!r}")
+        if bad:
+            raise ValueError("设置类型不对: " + ", ".join(bad))
+
+    def replace_with(self, other):
+        """原地换成 other 编译好的全部设置（各处持有的是同一个 Config 对象）"""
+        for name in self.__slots__:
+            setattr(self, name, getattr(other, name))
+
+    def apply(self, settings):
+        """把 settings 字典编译成属性"""
+        s = self.settings = settings
+        per_s = 1 / self.REFERENCE_FRAME_S
+        self.DEFAULT_ANIMATION_SPEED = s['animation_speed']
+        # 速度（像素/秒）和加速度（像素/秒²）
+        self.DEFAULT_MOVEMENT_SPEED = s['movement_speed'] * per_s
+        self.ACTION_INTERVAL_MIN = s['action_interval_min']
+        self.ACTION_INTERVAL_MAX = s['action_interval_max']
+        self.DRAG_THRESHOLD = s['drag_threshold']
+        self.GRAVITY = s['gravity'] * per_s * per_s
+        self.EDGE_SNAP_MARGIN = s['edge_snap_margin']
+        self.SNAP_SPEED_THRESHOLD = s['snap_speed_threshold'] * per_s
+        self.MOUSE_IDLE_TIME_BEFORE_ACTION = s['mouse_idle_time_before_action']
+        self.MOUSE_FOLLOW_SPEED = s['mouse_follow_speed'] * per_s
+        self.begin_fall_velocity = s['begin_fall_velocity'] * per_s
+        self.fall_zoom_size = s['fall_zoom_size']
+        self.MAX_FALL_SPEED = s['max_fall_speed'] * per_s
+        self.SPRITE_SCALE = s['sprite_scale']
+        self.MOTION_INTERVAL_MS = max(1, round(1000 / max(1, s['max_motion_fps'])))
+        self.RENDERER = s['renderer'] if s['renderer'] in ('label', 'canvas') else 'label'
+        self.POINTER_POLL_MS = s['pointer_poll_ms']
+        self.SPRITE_CACHE_DIR = self._sprite_cache_dir(s)
+        self.FRAME_CACHE_ENTRIES = s['frame_cache_entries']
+        self.MEMORY_BUDGET_BYTES = int(s['memory_budget_mb'] * 1024 * 1024)
+        self.FRAME_CACHE_BYTES = int(s['frame_cache_mb'] * 1024 * 1024)
+        if self.MEMORY_BUDGET_BYTES:
+            # 缓存本身不超过总预算，预加载也就不会把预算占满
+            self.FRAME_CACHE_BYTES = min(self.FRAME_CACHE_BYTES, self.MEMORY_BUDGET_BYTES)
+        self.HOT_RELOAD_MS = s['hot_reload_ms']
+        self.METRICS_PORT = s['metrics_port']
+        self.METRICS_FILE = s['metrics_file']
+        self.METRICS_INTERVAL_MS = max(100, s['metrics_interval_ms'])
+
+    @staticmethod
+    def _sprite_cache_dir(s):
+        """磁盘精灵缓存目录；关闭时返回 None"""
+        if not s['sprite_cache']:
+            return None
+        if s['sprite_cache_dir']:
+            return s['sprite_cache_dir']
+        base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+            or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(base, 'deskgo')
+
+    @classmethod
+    def parse_characters(cls, raw):
+        """返回 dict: {角色名: {状态: gif路径}}"""
+        chars = {}
+        for char, state_map in (raw or {}).get("characters", {}).items():
+            chars[char] = {st.lower(): os.path.join(cls.ASSETS_DIR, gif)
+                           for st, gif in state_map.items()}
+        return chars
+
+    @classmethod
+    def load_characters(cls):
+        """返回 dict: {角色名: {状态: gif路径}}（含资源包和自动发现的角色）"""
+        return cls.load()[1]
+
+# --- 1.1 帧缓存 (Frame Cache) ---
+class Animation:
+    """一个 GIF 解码后的帧及其元数据（帧可以是 PIL 图像或 PhotoImage）。
+
+    frames 只保存去重后的帧，播放顺序由 sequence（frames 的下标）给出；
+    size 是裁掉透明边后的尺寸，offset 是裁剪区域在原画布中的左上角。
+    图集形式（canvas 渲染器）时 atlas 是整段动画的一张 PhotoImage，
+    frames 是各帧在图集里的左上角坐标。
+    """
+    __slots__ = ('frames', 'size', 'loop', 'durations', 'sequence', 'offset', 'full_size', 'atlas')
+
+    def __init__(self, frames, size, loop=0, durations=None, sequence=None, offset=(0, 0), full_size=None,
+                 atlas=None):
+        self.frames = frames
+        self.atlas = atlas
+        self.size = size
+        self.loop = loop          # GIF 的循环次数，0 表示无限循环
+        self.sequence = sequence if sequence is not None else list(range(len(frames)))
+        self.durations = durations if durations is not None else [0] * len(self.sequence)   # 每个播放位置的毫秒数
+        self.offset = offset
+        self.full_size = full_size or size
 
     @property
-    def DEFAULT_MOVEMENT_SPEED(self):
-        return self.settings['movement_speed']
+    def nbytes(self):
+        w, h = self.size
+        return w * h * 4 * len(self.frames)   # 按 RGBA 估算
 
     @property
-    def ACTION_INTERVAL_MIN(self):
-        return self.settings['action_interval_min']
+    def raw_nbytes(self):
+        """不去重、不裁剪时的字节数（用于对比）"""
+        w, h = self.full_size
+        return w * h * 4 * len(self.sequence)
+
+    def with_frames(self, frames, atlas=None):
+        return Animation(frames, self.size, self.loop, self.durations, self.sequence, self.offset,
+                         self.full_size, atlas)
+
+    def images(self):
+        """这段动画占用的图像对象"""
+        return [self.atlas] if self.atlas is not None else self.frames
+
+    def __len__(self):
+        return len(self.frames)
+
+
+class FrameCache:
+    """已解码帧的 LRU 缓存，键为 (gif路径, mtime, 缩放)。
+
+    同一个 GIF 被多个状态共用（idle/moving/falling 常指向同一文件），
+    命中时切换状态只需一次字典查找，不再重新解码。
+    """
+
+    def __init__(self, max_entries=32, max_bytes=128 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> Animation
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(gif_path, scale=1.0):
+        """文件被修改后 mtime 变化，旧条目自然失效"""
+        return (os.path.abspath(gif_path), ASSET_FS.getmtime(gif_path), scale)
+
+    def get(self, key):
+        """返回 Animation，未命中返回 None"""
+        anim = self._entries.get(key)
+        if anim is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return anim
+
+    def put(self, key, anim):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.nbytes
+        self._entries[key] = anim
+        self.total_bytes += anim.nbytes
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        # 最近使用的条目即使单独超限也保留，避免当前动画被清空
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self.total_bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self.total_bytes -= self._entries.pop(key).nbytes
+            self.evictions += 1
+
+    def has_room(self, nbytes):
+        """后台预加载用：放入后是否会挤掉已有条目"""
+        return (len(self._entries) < self.max_entries
+                and self.total_bytes + nbytes <= self.max_bytes)
+
+    def resize(self, max_entries, max_bytes):
+        """热更新上限，多出的条目立刻淘汰"""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def discard_path(self, gif_path):
+        """丢弃某个文件的所有旧条目（任意 mtime / 缩放），返回丢弃数"""
+        path = os.path.abspath(gif_path)
+        stale = [key for key in self._entries if key[0] == path]
+        for key in stale:
+            self.total_bytes -= self._entries.pop(key).nbytes
+        return len(stale)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def animations(self):
+        return list(self._entries.values())
+
+    def items(self):
+        """[(键, Animation)]，从最久未用到最近使用"""
+        return list(self._entries.items())
+
+    def discard(self, key):
+        anim = self._entries.pop(key, None)
+        if anim is not None:
+            self.total_bytes -= anim.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+# --- 1.1.1 内存预算 (Memory Budget) ---
+def thin_animation(anim, step):
+    """每 step 个播放位置只保留第一帧：序列长度和时长不变，节奏不变，不同画面约减为 1/step"""
+    sequence = [anim.sequence[i - i % step] for i in range(len(anim.sequence))]
+    used = sorted(set(sequence))
+    remap = {old: new for new, old in enumerate(used)}
+    return Animation([anim.frames[i] for i in used], anim.size, anim.loop, anim.durations,
+                     [remap[i] for i in sequence], anim.offset, anim.full_size)
+
+
+class MemoryGovernor:
+    """已解码帧的总账：帧缓存里的条目加上正在显示的动画（即使已被挤出缓存）。
+
+    memory_budget_mb 为 0 时只记账不干预。超出预算时先按使用次数从少到多、
+    再按最久未用淘汰不在屏幕上的条目；仍然超出时给最少用到的动画抽帧
+    （每次不同画面减半，最多 MAX_THIN_STEP 倍），显示中的宠物原地换上抽帧后的版本。
+    图集形式（canvas 渲染器）的动画是一整张图，抽帧省不了内存，只参与淘汰。
+    """
+    MAX_THIN_STEP = 8
+
+    def __init__(self, world):
+        self.world = world
+        self.uses = Counter()          # (角色, 状态) -> load_animation 次数
+        self.path_uses = Counter()     # GIF 绝对路径 -> 次数
+        self.thinned = {}              # GIF 绝对路径 -> (抽帧步长, 抽帧后 Animation 的 id)
+        self.evictions = 0
+        self._enforcing = False
 
     @property
-    def ACTION_INTERVAL_MAX(self):
-        return self.settings['action_interval_max']
+    def budget(self):
+        return self.world.config.MEMORY_BUDGET_BYTES
+
+    def note_use(self, pet, gif_path):
+        self.uses[(pet.character_names[pet.current_char_idx], pet.state.value)] += 1
+        self.path_uses[os.path.abspath(gif_path)] += 1
+
+    def _resident(self):
+        """[(缓存键或 None, GIF 绝对路径, Animation, 是否在显示)]，同一份帧只算一次"""
+        shown = {id(pet.animation) for pet in self.world.pets}
+        seen = set()
+        resident = []
+        for key, anim in self.world.frame_cache.items():
+            seen.add(id(anim))
+            resident.append((key, key[0], anim, id(anim) in shown))
+        for pet in self.world.pets:
+            anim = pet.animation
+            if id(anim) not in seen and pet.current_gif_path:
+                seen.add(id(anim))
+                resident.append((None, os.path.abspath(pet.current_gif_path), anim, True))
+        return resident
+
+    def total_bytes(self):
+        return sum(anim.nbytes for _, _, anim, _ in self._resident())
+
+    def has_room(self, nbytes):
+        """后台预加载用：放入后是否仍在帧缓存上限和总预算之内"""
+        if not self.world.frame_cache.has_room(nbytes):
+            return False
+        return not self.budget or self.total_bytes() + nbytes <= self.budget
+
+    def enforce(self):
+        """超出预算时淘汰、抽帧，直到回到预算内或无可再省"""
+        budget = self.budget
+        if not budget or self._enforcing:
+            return
+        resident = self._resident()
+        total = sum(anim.nbytes for _, _, anim, _ in resident)
+        if total <= budget:
+            return
+        self._enforcing = True
+        try:
+            cache = self.world.frame_cache
+            # resident 里缓存条目按最久未用在前，稳定排序后同样次数的先淘汰最久未用的
+            cold = sorted((r for r in resident if r[0] is not None and not r[3]),
+                          key=lambda r: self.path_uses[r[1]])
+            for key, _, anim, _ in cold:
+                if total <= budget:
+                    return
+                cache.discard(key)
+                total -= anim.nbytes
+                self.evictions += 1
+            # 仍然超出：从最少用到的动画开始抽帧，一轮不够再来一轮
+            while total > budget:
+                candidates = sorted((r for r in self._resident() if self._thinnable(r[1], r[2])),
+                                    key=lambda r: self.path_uses[r[1]])
+                if not candidates:
+                    return
+                for key, path, anim, _ in candidates:
+                    step = self._step(path, anim) * 2
+                    thin = thin_animation(anim, step)
+                    self.thinned[path] = (step, id(thin))
+                    total -= anim.nbytes - thin.nbytes
+                    self._replace(key, anim, thin)
+                    if total <= budget:
+                        return
+        finally:
+            self._enforcing = False
+
+    def _step(self, path, anim):
+        """anim 当前的抽帧步长；重新解码出的完整帧是 1"""
+        step, anim_id = self.thinned.get(path, (1, None))
+        return step if anim_id == id(anim) else 1
+
+    def _thinnable(self, path, anim):
+        return (anim.atlas is None and len(anim.frames) > 1
+                and self._step(path, anim) * 2 <= self.MAX_THIN_STEP)
+
+    def _replace(self, key, old, new):
+        if key is not None and key in self.world.frame_cache:
+            self.world.frame_cache.put(key, new)
+        for pet in self.world.pets:
+            if pet.animation is old:
+                pet.swap_frames(new)
+
+    def footprint(self, detail=True):
+        """当前占用：总字节、预算、淘汰和抽帧数；detail 时再按角色给出总数（共用的 GIF 只算一次）
+        和各状态的字节数"""
+        by_path = {}
+        thinned = 0
+        for _, path, anim, _ in self._resident():
+            by_path[path] = by_path.get(path, 0) + anim.nbytes
+            thinned += self._step(path, anim) > 1
+        report = {'bytes': sum(by_path.values()), 'budget': self.budget, 'evictions': self.evictions,
+                  'thinned': thinned}
+        if detail:
+            characters = report['characters'] = {}
+            for name, state_map in self.world.characters.items():
+                states = {}
+                paths = set()
+                for state, gif_path in state_map.items():
+                    path = os.path.abspath(gif_path)
+                    if path in by_path:
+                        states[state] = by_path[path]
+                        paths.add(path)
+                if states:
+                    characters[name] = {'bytes': sum(by_path[p] for p in paths), 'states': states}
+        return report
+
+# --- 1.2 后台资源加载 (Asset Loader) ---
+def iter_gif_frames(gif_path, scale=1.0):
+    """逐帧解码的生成器：先产出 (loop, (w, h))，之后每帧产出 (RGBA 图像, 毫秒数)。
+    提前 close() 时关闭文件"""
+    with ASSET_FS.open(gif_path) as f, Image.open(f) as pil_image:
+        # 没有 NETSCAPE 扩展的 GIF 也按无限循环处理，与以往行为一致
+        loop = pil_image.info.get('loop', 0) or 0
+        w, h = pil_image.size
+        if scale != 1.0:
+            w, h = max(1, round(w * scale)), max(1, round(h * scale))
+        yield loop, (w, h)
+        for frame in ImageSequence.Iterator(pil_image):
+            rgba = frame.copy().convert('RGBA')
+            if rgba.size != (w, h):
+                rgba = rgba.resize((w, h), Image.LANCZOS)
+            yield rgba, int(frame.info.get('duration', 0) or 0)
+
+
+class FramePacker:
+    """逐帧收集解码结果：边收边按内容去重、累计非透明像素的包围盒，最后裁边组装成 Animation。
+    每帧的开销都摊在 add() 里，build() 只剩裁剪"""
+
+    def __init__(self, loop, full_size):
+        self.loop = loop
+        self.full_size = full_size
+        self.frames = []
+        self.sequence = []
+        self.durations = []
+        self._seen = {}          # 帧内容哈希 -> frames 下标
+        self._union = None       # 所有帧非透明像素包围盒的并集
+
+    def add(self, rgba, duration_ms):
+        """收下一帧，返回它在去重后的帧列表里的下标"""
+        # 连续的"停顿帧"内容完全相同，只保存一份
+        digest = hashlib.blake2b(rgba.tobytes(), digest_size=16).digest()
+        index = self._seen.get(digest)
+        if index is None:
+            index = self._seen[digest] = len(self.frames)
+            self.frames.append(rgba)
+            box = rgba.getchannel('A').getbbox()
+            if box is not None:
+                union = self._union
+                self._union = box if union is None else (min(union[0], box[0]), min(union[1], box[1]),
+                                                         max(union[2], box[2]), max(union[3], box[3]))
+        self.sequence.append(index)
+        self.durations.append(duration_ms)
+        return index
+
+    def build(self):
+        """裁到包围盒并集后返回 Animation"""
+        w, h = self.full_size
+        frames, bbox = self.frames, self._union
+        if bbox is None or bbox == (0, 0, w, h):
+            bbox = (0, 0, w, h)
+        else:
+            frames = [frame.crop(bbox) for frame in frames]
+        size = (bbox[2] - bbox[0], bbox[3] - bbox[1])
+        return Animation(frames, size, self.loop, self.durations, self.sequence, (bbox[0], bbox[1]),
+                         self.full_size)
+
+
+def decode_gif_frames(gif_path, scale=1.0):
+    """纯 PIL 解码（可在工作线程中运行），返回帧为 RGBA 图像、已去重裁边的 Animation"""
+    frames = iter_gif_frames(gif_path, scale)
+    packer = FramePacker(*next(frames))
+    for rgba, duration_ms in frames:
+        packer.add(rgba, duration_ms)
+    return packer.build()
+
+
+def load_gif_frames(gif_path, scale=1.0, disk_cache=None):
+    """优先从磁盘精灵缓存映射帧，未命中再解码并写回缓存"""
+    if disk_cache is not None:
+        anim = disk_cache.load(gif_path, scale)
+        if anim is not None:
+            return anim
+    anim = decode_gif_frames(gif_path, scale)
+    if disk_cache is not None:
+        disk_cache.store(gif_path, scale, anim)
+    return anim
+
+
+ATLAS_MAX_SIDE = 16384   # 图集边长上限（部分平台的位图尺寸限制是 32767）
+
+
+def _atlas_grid(n, w, h):
+    """选空格最少、其次最接近正方形的网格列数"""
+    best = None
+    for cols in range(1, n + 1):
+        rows = math.ceil(n / cols)
+        if cols * w > ATLAS_MAX_SIDE and cols > 1:
+            break
+        score = (cols * rows - n, abs(cols * w - rows * h))
+        if best is None or score < best[0]:
+            best = (score, cols)
+    return best[1]
+
+
+def make_atlas(frames):
+    """把同尺寸的帧按网格拼成一张图，返回 (图集, [(x, y), ...])"""
+    w, h = frames[0].size
+    cols = _atlas_grid(len(frames), w, h)
+    rows = math.ceil(len(frames) / cols)
+    atlas = Image.new("RGBA", (cols * w, rows * h), (0, 0, 0, 0))
+    cells = []
+    for i, frame in enumerate(frames):
+        cell = ((i % cols) * w, (i // cols) * h)
+        atlas.paste(frame, cell)
+        cells.append(cell)
+    return atlas, cells
+
+
+def tk_animation(anim, atlas=False):
+    """把 RGBA 帧的 Animation 转成 Tk 可显示的形式：每帧一个 PhotoImage，或一张图集"""
+    if not atlas or not anim.frames:
+        return anim.with_frames([ImageTk.PhotoImage(f) for f in anim.frames])
+    image, cells = make_atlas(anim.frames)
+    return anim.with_frames(cells, ImageTk.PhotoImage(image))
+
+
+def memory_report(characters, scale=1.0, disk_cache=None):
+    """逐角色统计帧内存：返回 {角色: (去重裁边前字节数, 之后字节数)}"""
+    report = {}
+    for name, state_map in characters.items():
+        before = after = 0
+        for gif_path in dict.fromkeys(state_map.values()):
+            if not ASSET_FS.exists(gif_path):
+                continue
+            anim = load_gif_frames(gif_path, scale, disk_cache)
+            before += anim.raw_nbytes
+            after += anim.nbytes
+        report[name] = (before, after)
+    return report
+
+
+class AssetLoader:
+    """在线程池里预解码所有角色的 GIF，Tk 线程只负责分片创建 PhotoImage。
+
+    - 工作线程：PIL 解码 → 结果队列
+    - Tk 线程：有任务时轮询结果队列，并用 after_idle 分片把 RGBA 帧转成 PhotoImage，
+      转换完成后放入 FrameCache
+    """
+    POLL_MS = 15          # 有未完成任务时检查结果队列的间隔
+    SLICE_BUDGET = 0.008  # 每个 after_idle 分片最多占用 Tk 线程的时间（秒）
+    PRELOAD_CHARACTERS = 16   # 后台预解码的角色数上限
+
+    def __init__(self, master, frame_cache, scale=1.0, workers=2, disk_cache=None, atlas=False):
+        self.master = master
+        self.frame_cache = frame_cache
+        self.has_room = frame_cache.has_room  # 预加载结果能否放入；PetWorld 换成按总内存预算判断
+        self.scale = scale
+        self.atlas = atlas                   # True 时转换成图集（canvas 渲染器）
+        self.disk_cache = disk_cache
+        self.characters = {}
+        self._jobs = queue.PriorityQueue()   # (优先级, 序号, gif_path)
+        self._results = queue.Queue()        # (gif_path, key, Animation, error)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._queued = {}                    # gif_path -> 当前最高优先级
+        self._in_flight = set()              # 已派发或正在转换的 gif_path
+        self._convert = deque()              # [gif_path, key, Animation(RGBA), photos]
+        self._callbacks = {}                 # gif_path -> [callback]
+        self._streams = {}                   # gif_path -> 进行中的 ProgressiveDecode
+        self._poll_job = None
+        self._slice_job = None
+        self.errors = {}
+        self.workers = workers               # 0 表示在 Tk 线程同步解码（回放用，结果确定）
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    # ---- 对外 API ----
+    def preload(self, characters, current=None):
+        """按可能的使用顺序排队：当前角色优先，其余按配置顺序从当前角色之后开始。
+        角色成百上千时只预解码前 PRELOAD_CHARACTERS 个，其余在切换时按需解码"""
+        self.characters = characters
+        names = list(characters)
+        if current in names:
+            i = names.index(current)
+            names = names[i:] + names[:i]
+        for rank, name in enumerate(names[:self.PRELOAD_CHARACTERS]):
+            for gif_path in self._paths_of(name):
+                self.request(gif_path, priority=rank * 10 + 10)
+
+    def request(self, gif_path, priority=0, callback=None):
+        """请求解码某个 GIF；priority 越小越先处理，重复请求只会提升优先级"""
+        if callback is not None:
+            if self._is_cached(gif_path):
+                callback()
+                return
+            self._callbacks.setdefault(gif_path, []).append(callback)
+        if self._is_cached(gif_path):
+            return
+        with self._lock:
+            if gif_path in self._in_flight:
+                return
+            best = self._queued.get(gif_path)
+            if best is not None and best <= priority:
+                return
+            if self.workers:
+                self._queued[gif_path] = priority
+                self._seq += 1
+                self._jobs.put((priority, self._seq, gif_path))
+        if not self.workers:
+            self._load_now(gif_path)
+            return
+        self._ensure_polling()
+
+    def request_character(self, char_name):
+        """把某个角色的全部 GIF 提到队首（idle 最先）"""
+        for i, gif_path in enumerate(self._paths_of(char_name, PetState.IDLE.value)
+                                     + self._paths_of(char_name)):
+            self.request(gif_path, priority=i)
+
+    def is_ready(self, char_name, state=None):
+        """角色（或其某个状态）的帧是否已在缓存中；解码失败或无资源的视为已结束"""
+        return all(self._settled(p) for p in self._paths_of(char_name, state))
+
+    def when_ready(self, char_name, state, callback):
+        """帧就绪后在 Tk 线程调用 callback（已就绪则立即调用）"""
+        paths = self._paths_of(char_name, state)
+        remaining = [p for p in paths if not self._settled(p)]
+        if not remaining:
+            callback()
+            return
+        pending = set(remaining)
+
+        def on_one(path):
+            pending.discard(path)
+            if not pending:
+                callback()
+        for p in remaining:
+            self.request(p, priority=0, callback=lambda p=p: on_one(p))
+
+    def stream(self, gif_path, on_frames=None, on_done=None):
+        """在 Tk 线程里渐进解码一个 GIF（缓存未命中时的兜底）：返回 ProgressiveDecode，
+        它的 partial 里已有第 0 帧，之后每追加一批帧调用 on_frames，成品放入帧缓存后调用 on_done。
+        同一 GIF 已在渐进解码时共用那一次；工作线程正在解码它时返回 None，由调用方 request() 等结果"""
+        decode = self._streams.get(gif_path)
+        if decode is None:
+            with self._lock:
+                if gif_path in self._in_flight:
+                    return None
+            decode = ProgressiveDecode(self.master, gif_path, self.scale, None,
+                                       lambda packer: self._complete(decode, packer),
+                                       lambda: self._abandon(gif_path, queued))
+            decode.start()
+            self._streams[gif_path] = decode
+            with self._lock:
+                queued = self._queued.pop(gif_path, None)   # 排队中的预加载由这次解码代劳
+                self._in_flight.add(gif_path)
+        if on_frames is not None:
+            decode.on_frames.append(on_frames)
+        if on_done is not None:
+            self._callbacks.setdefault(gif_path, []).append(on_done)
+        return decode
+
+    def release(self, decode, on_frames=None, on_done=None):
+        """某个调用方不再需要这次渐进解码；没有任何人在等时才真正取消"""
+        if on_frames in decode.on_frames:
+            decode.on_frames.remove(on_frames)
+        callbacks = self._callbacks.get(decode.gif_path, [])
+        if on_done in callbacks:
+            callbacks.remove(on_done)
+        if not callbacks:
+            self._callbacks.pop(decode.gif_path, None)
+            if not decode.on_frames:
+                decode.cancel()
+
+    def invalidate(self, gif_path):
+        """文件被修改：丢掉旧帧和旧的失败记录，下一次请求会重新解码"""
+        self.errors.pop(gif_path, None)
+        self.frame_cache.discard_path(gif_path)
+
+    def progress(self, char_name):
+        """返回 (已就绪 GIF 数, 总数)"""
+        paths = self._paths_of(char_name)
+        return sum(1 for p in paths if self._is_cached(p)), len(paths)
 
     @property
-    def DRAG_THRESHOLD(self):
-        return self.settings['drag_threshold']
+    def pending(self):
+        with self._lock:
+            return len(self._queued) + len(self._in_flight)
+
+    # ---- 内部实现 ----
+    def _paths_of(self, char_name, state=None):
+        state_map = self.characters.get(char_name, {})
+        if state is not None:
+            path = state_map.get(state)
+            return [path] if path and ASSET_FS.exists(path) else []
+        # 保持配置顺序去重：idle 通常排第一
+        return [p for p in dict.fromkeys(state_map.values()) if ASSET_FS.exists(p)]
+
+    def _settled(self, gif_path):
+        return gif_path in self.errors or self._is_cached(gif_path)
+
+    def _is_cached(self, gif_path):
+        try:
+            return FrameCache.make_key(gif_path, self.scale) in self.frame_cache
+        except OSError:
+            return False
+
+    def _worker(self):
+        while True:
+            priority, _, gif_path = self._jobs.get()
+            with self._lock:
+                # 同一路径可能因提升优先级入队多次，只处理一次
+                if self._queued.get(gif_path) != priority:
+                    continue
+                del self._queued[gif_path]
+                self._in_flight.add(gif_path)
+            try:
+                key = FrameCache.make_key(gif_path, self.scale)
+                anim = load_gif_frames(gif_path, self.scale, self.disk_cache)
+                self._results.put((gif_path, key, anim, None))
+            except Exception as e:
+                self._results.put((gif_path, None, None, e))
+
+    def _load_now(self, gif_path):
+        try:
+            key = FrameCache.make_key(gif_path, self.scale)
+            anim = load_gif_frames(gif_path, self.scale, self.disk_cache)
+        except Exception as e:
+            self.errors[gif_path] = e
+            for cb in self._callbacks.pop(gif_path, []):
+                cb()
+            return
+        self._finish(gif_path, key, tk_animation(anim, self.atlas))
+
+    def _complete(self, decode, packer):
+        """渐进解码完成：partial 只是解码期间的占位（不裁边）。裁边和写磁盘缓存放到后台线程，
+        裁好的帧和工作线程的结果一样由 _poll 接手、分片转换后放入帧缓存，再通知等待者换上"""
+        gif_path = decode.gif_path
+        del self._streams[gif_path]
+        self._ensure_polling()
+        threading.Thread(target=self._pack, args=(gif_path, decode.key, packer), daemon=True).start()
+
+    def _pack(self, gif_path, key, packer):
+        try:
+            anim = packer.build()
+            if self.disk_cache is not None:
+                self.disk_cache.store(gif_path, self.scale, anim)
+        except Exception as e:
+            self._results.put((gif_path, None, None, e))
+        else:
+            self._results.put((gif_path, key, anim, None))
+
+    def _abandon(self, gif_path, queued):
+        """渐进解码被取消：有人在等或原本排着队的 GIF 转交工作线程"""
+        self._streams.pop(gif_path, None)
+        with self._lock:
+            self._in_flight.discard(gif_path)
+        if gif_path in self._callbacks:
+            self.request(gif_path, priority=0)
+        elif queued is not None:
+            self.request(gif_path, priority=queued)
+
+    def _ensure_polling(self):
+        if self._poll_job is None:
+            self._poll_job = self.master.after(self.POLL_MS, self._poll)
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                gif_path, key, anim, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if error is not None:
+                self.errors[gif_path] = error
+                print(f"⚠️ 预加载失败: {gif_path}: {error}")
+                with self._lock:
+                    self._in_flight.discard(gif_path)
+                # 仍然通知等待者，由同步加载路径去报告错误
+                for cb in self._callbacks.pop(gif_path, []):
+                    cb()
+                continue
+            self._convert.append([gif_path, key, anim, []])
+        if self._convert and self._slice_job is None:
+            self._slice_job = self.master.after_idle(self._convert_slice)
+        if self.pending:
+            self._ensure_polling()
+
+    def _convert_slice(self):
+        """在一个时间片内尽量多地创建 PhotoImage，剩下的留给下一个 idle"""
+        self._slice_job = None
+        deadline = time.perf_counter() + self.SLICE_BUDGET
+        while self._convert and time.perf_counter() < deadline:
+            gif_path, key, anim, photos = self._convert[0]
+            if self.atlas:
+                # 图集只有一张图，整段动画一次转换
+                self._convert.popleft()
+                self._finish(gif_path, key, tk_animation(anim, True))
+                continue
+            photos.append(ImageTk.PhotoImage(anim.frames[len(photos)]))
+            if len(photos) == len(anim):
+                self._convert.popleft()
+                self._finish(gif_path, key, anim.with_frames(photos))
+        if self._convert:
+            self._slice_job = self.master.after_idle(self._convert_slice)
+
+    def _finish(self, gif_path, key, anim):
+        callbacks = self._callbacks.pop(gif_path, [])
+        # 有人在等的 GIF 一定放入；纯预加载只在缓存有空位时放入，避免挤掉正在用的帧
+        if callbacks or self.has_room(anim.nbytes):
+            self.frame_cache.put(key, anim)
+        with self._lock:
+            self._in_flight.discard(gif_path)
+        for cb in callbacks:
+            cb()
+
+
+class ProgressiveDecode:
+    """在 Tk 线程里逐帧解码一个 GIF，第一帧解出来就能显示。
+
+    start() 同步解码第 0 帧，partial 是只含这一帧的 Animation（原画布大小、按无限循环处理）；
+    其余帧由 after_idle 分片解码，每片不超过 SLICE_BUDGET，边解边去重，新帧原地追加到
+    partial 后依次调用 on_frames 里的回调。全部解完后把收齐 RGBA 帧的 FramePacker 交给
+    on_done；cancel() 随时放弃、关闭文件并调用 on_cancel()。
+    """
+    SLICE_BUDGET = AssetLoader.SLICE_BUDGET
+
+    def __init__(self, master, gif_path, scale=1.0, on_frames=None, on_done=None, on_cancel=None):
+        self.master = master
+        self.gif_path = gif_path
+        self.scale = scale
+        self.key = FrameCache.make_key(gif_path, scale)
+        self.on_frames = list(on_frames or ())
+        self.on_done = on_done
+        self.on_cancel = on_cancel
+        self.partial = None
+        self.done = False
+        self._frames = None       # iter_gif_frames 生成器
+        self._packer = None
+        self._job = None
+
+    def start(self):
+        frames = iter_gif_frames(self.gif_path, self.scale)
+        try:
+            loop, full_size = next(frames)
+            first, duration_ms = next(frames)
+        except BaseException:
+            frames.close()
+            raise
+        self._frames = frames
+        self._packer = FramePacker(loop, full_size)
+        self._packer.add(first, duration_ms)
+        self.partial = Animation([ImageTk.PhotoImage(first)], full_size, 0, [duration_ms], [0],
+                                 (0, 0), full_size)
+        self._job = self.master.after_idle(self._slice)
+        return self.partial
+
+    def cancel(self):
+        """放弃解码；已经解完的不受影响"""
+        if self.done or self._frames is None:
+            return
+        self._close()
+        if self.on_cancel is not None:
+            self.on_cancel()
+
+    def _close(self):
+        if self._job is not None:
+            self.master.after_cancel(self._job)
+            self._job = None
+        if self._frames is not None:
+            self._frames.close()
+            self._frames = None
+        self._packer = None
+
+    def _slice(self):
+        self._job = None
+        partial = self.partial
+        deadline = time.perf_counter() + self.SLICE_BUDGET
+        finished = False
+        try:
+            while True:
+                item = next(self._frames, None)
+                if item is None:
+                    finished = True
+                    break
+                rgba, duration_ms = item
+                index = self._packer.add(rgba, duration_ms)
+                if index == len(partial.frames):       # 重复的停顿帧沿用已有的 PhotoImage
+                    partial.frames.append(ImageTk.PhotoImage(rgba))
+                # 先补时长再补播放序列：播放方按 len(sequence) 取时长
+                partial.durations.append(duration_ms)
+                partial.sequence.append(index)
+                if time.perf_counter() >= deadline:
+                    break
+        except Exception as e:
+            # 截断或损坏的 GIF：用已经解出的帧收尾
+            print(f"⚠️ GIF 解码中断: {self.gif_path}: {e}")
+            finished = True
+        for on_frames in tuple(self.on_frames):
+            on_frames()
+        if not finished:
+            self._job = self.master.after_idle(self._slice)
+            return
+        packer = self._packer
+        self._close()
+        self.done = True
+        if self.on_done is not None:
+            self.on_done(packer)
+
+# --- 1.2.1 磁盘精灵缓存 (Sprite Disk Cache) ---
+class SpriteDiskCache:
+    """解码后的 RGBA 帧和帧时长的磁盘缓存，一个 GIF 一个 .dgs 文件。
+
+    文件格式（小端）：文件头 | m 个 u32 帧时长 | m 个 u32 播放序列 | n 帧连续的 RGBA 原始字节
+    （n 为去重后的帧数，m 为播放序列长度）。
+    读取时整个文件 mmap，帧直接用 Image.frombuffer 引用映射内存，不经过 GIF 解码器。
+    文件头记录源文件的大小、mtime 和内容哈希：大小/mtime 一致直接信任，
+    不一致时再比对内容哈希（只被 touch 过的 GIF 不用重新解码）。
+    """
+    MAGIC = b'DGSC'
+    VERSION = 2
+    # magic, version, 保留, n, m, w, h, loop, 裁剪偏移 x/y, 原始 w/h, 源文件 size, mtime_ns, hash
+    HEADER = struct.Struct('<4sHHIIIIIiiIIQQ16s')
+    STAMP = struct.Struct('<QQ')                        # 文件头里的源文件 size, mtime_ns
+    STAMP_OFFSET = HEADER.size - STAMP.size - 16
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def content_hash(gif_path):
+        h = hashlib.blake2b(digest_size=16)
+        with ASSET_FS.open(gif_path) as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.digest()
+
+    def _file_for(self, gif_path, scale):
+        name = hashlib.blake2b(f"{os.path.abspath(gif_path)}|{scale}".encode('utf-8'),
+                               digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, name + '.dgs')
+
+    def load(self, gif_path, scale=1.0):
+        """命中返回帧为 RGBA 图像（引用映射内存）的 Animation，否则返回 None"""
+        try:
+            st = ASSET_FS.stat(gif_path)
+            with open(self._file_for(gif_path, scale), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        view = memoryview(mm)
+        try:
+            (magic, version, _, n, m, w, h, loop, off_x, off_y, full_w, full_h,
+             size, mtime_ns, digest) = self.HEADER.unpack_from(view, 0)
+            offset = self.HEADER.size
+            frame_bytes = w * h * 4
+            valid = (magic == self.MAGIC and version == self.VERSION
+                     and len(view) == offset + 8 * m + n * frame_bytes)
+            if valid and (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+                valid = self.content_hash(gif_path) == digest
+                if valid:
+                    self._restamp(gif_path, scale, st)
+        except struct.error:
+            valid = False
+        if not valid:
+            view.release()
+            mm.close()
+            self.misses += 1
+            return None
+        durations = list(struct.unpack_from(f'<{m}I', view, offset))
+        sequence = list(struct.unpack_from(f'<{m}I', view, offset + 4 * m))
+        offset += 8 * m
+        frames = [Image.frombuffer('RGBA', (w, h), view[offset + i * frame_bytes:offset + (i + 1) * frame_bytes],
+                                   'raw', 'RGBA', 0, 1)
+                  for i in range(n)]
+        self.hits += 1
+        return Animation(frames, (w, h), loop, durations, sequence, (off_x, off_y), (full_w, full_h))
+
+    def _restamp(self, gif_path, scale, st):
+        """内容没变：把文件头里的大小/mtime 改成源文件现在的值，以后不用每次启动都算哈希"""
+        try:
+            with open(self._file_for(gif_path, scale), 'r+b') as f:
+                f.seek(self.STAMP_OFFSET)
+                f.write(self.STAMP.pack(st.st_size, st.st_mtime_ns))
+        except OSError as e:
+            print(f"⚠️ 更新精灵缓存失败: {e}")
+
+    def store(self, gif_path, scale, anim):
+        """写入缓存（先写临时文件再替换，写失败只打印警告）"""
+        try:
+            st = ASSET_FS.stat(gif_path)
+            digest = self.content_hash(gif_path)
+            w, h = anim.size
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                m = len(anim.sequence)
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, len(anim), m, w, h, anim.loop,
+                                         anim.offset[0], anim.offset[1], *anim.full_size,
+                                         st.st_size, st.st_mtime_ns, digest))
+                f.write(struct.pack(f'<{m}I', *anim.durations))
+                f.write(struct.pack(f'<{m}I', *anim.sequence))
+                for frame in anim.frames:
+                    f.write(frame.tobytes())
+            os.replace(tmp, self._file_for(gif_path, scale))
+            self.writes += 1
+        except OSError as e:
+            print(f"⚠️ 写入精灵缓存失败: {e}")
+
+    def clear(self):
+        """删除全部缓存文件（--rebuild-cache）"""
+        for path in glob.glob(os.path.join(self.cache_dir, '*.dgs')):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"⚠️ 删除缓存失败: {e}")
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes}
+
+# --- 1.2.2 角色预览图 (Thumbnails) ---
+class ThumbnailLoader:
+    """右键菜单里的角色小图：后台线程取 idle GIF 的第一帧裁边缩小，PNG 缓存到磁盘；
+    Tk 线程只负责把结果转成 PhotoImage，打开菜单时不做任何解码。"""
+    SIZE = 24           # 预览图最长边（像素）
+    POLL_MS = 50
+
+    def __init__(self, master, cache_dir=None, on_ready=None):
+        self.master = master
+        self.cache_dir = cache_dir
+        self.on_ready = on_ready             # on_ready(角色名, PhotoImage)，在 Tk 线程调用
+        self.photos = {}                     # 角色名 -> PhotoImage
+        self._sources = {}                   # 角色名 -> (gif_path, mtime)，GIF 改了才重新生成
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._pending = 0
+        self._thread = None
+        self._poll_job = None
+
+    def get(self, name):
+        return self.photos.get(name)
+
+    def request(self, characters, mtime_of=None):
+        """为每个角色排队生成预览；已生成且 GIF 没改的跳过。
+
+        mtime_of(gif_path) 可以直接给出已知的 mtime（角色清单），返回 None 时才 stat。
+        """
+        for name, state_map in characters.items():
+            gif_path = state_map.get(PetState.IDLE.value) or next(iter(state_map.values()), None)
+            try:
+                mtime = mtime_of(gif_path) if mtime_of is not None else None
+                source = (gif_path, ASSET_FS.getmtime(gif_path) if mtime is None else mtime)
+            except (OSError, TypeError):
+                continue
+            if self._sources.get(name) == source:
+                continue
+            self._sources[name] = source
+            self._pending += 1
+            self._jobs.put((name, *source))
+        if self._pending:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+            if self._poll_job is None:
+                self._poll_job = self.master.after(self.POLL_MS, self._poll)
+
+    def _worker(self):
+        while True:
+            name, gif_path, mtime = self._jobs.get()
+            try:
+                image = self._thumbnail(gif_path, mtime)
+            except Exception as e:
+                print(f"⚠️ 生成预览图失败: {gif_path}: {e}")
+                image = None
+            self._results.put((name, image))
+
+    def _thumbnail(self, gif_path, mtime):
+        cache_file = None
+        if self.cache_dir:
+            key = f"{os.path.abspath(gif_path)}|{mtime}|{self.SIZE}".encode('utf-8')
+            cache_file = os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest() + '.png')
+            try:
+                with Image.open(cache_file) as im:
+                    return im.convert('RGBA')
+            except OSError:
+                pass
+        with ASSET_FS.open(gif_path) as f, Image.open(f) as im:
+            frame = im.convert('RGBA')
+        bbox = frame.getbbox()
+        if bbox:
+            frame = frame.crop(bbox)
+        frame.thumbnail((self.SIZE, self.SIZE))
+        if cache_file:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    frame.save(f, 'PNG')
+                os.replace(tmp, cache_file)
+            except OSError as e:
+                print(f"⚠️ 写入预览图缓存失败: {e}")
+        return frame
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                name, image = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending -= 1
+            if image is None:
+                continue
+            photo = self.photos[name] = ImageTk.PhotoImage(image)
+            if self.on_ready is not None:
+                self.on_ready(name, photo)
+        if self._pending:
+            self._poll_job = self.master.after(self.POLL_MS, self._poll)
+
+# --- 1.2.3 角色索引 (Character Index) ---
+class CharacterIndex:
+    """按目录约定自动发现角色，结果记在磁盘清单里，下次启动不用重新扫描。
+
+    images/<角色名>/ 下的 GIF 按文件名对应状态：<状态名>.gif 直接对应该状态；
+    <角色名>1.gif 用于 idle/moving/falling/sleeping，2 用于 angry，3 用于 byebye；
+    目录里只有一个 GIF 时它用于全部基础状态。config.json 里写明的条目优先。
+
+    清单记录每个角色目录的 mtime 和每个 GIF 的 mtime、大小、帧数、尺寸；
+    重新验证时只对 mtime 变了的目录重新列目录、读 GIF 头，其余目录只需一次 stat。
+    """
+    VERSION = 1
+    NUMBERED_STATES = {
+        1: ('idle', 'moving', 'falling', 'sleeping'),
+        2: ('angry',),
+        3: ('byebye',),
+    }
+    BASE_STATES = NUMBERED_STATES[1]
+
+    def __init__(self, assets_dir, cache_dir=None):
+        self.assets_dir = assets_dir
+        root = os.path.abspath(assets_dir)
+        if cache_dir:
+            digest = hashlib.sha1(root.encode('utf-8')).hexdigest()[:12]
+            self.path = os.path.join(cache_dir, f'manifest-{digest}.json')
+        else:
+            self.path = os.path.join(assets_dir, '.deskgo-manifest.json')
+        self.entries = {}          # 角色名 -> {'mtime': 目录 mtime_ns, 'files': {...}, 'states': {...}}
+        self.explicit = {}         # 上一次合并时 config.json 中的角色
+        self._missing = set()      # 已提示过不存在的文件
+        self.scans = 0             # 重新扫描过的目录数（统计用）
+
+    def load(self):
+        """读取清单（不访问素材目录）；没有可用清单返回 False"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != self.VERSION or data.get('root') != os.path.abspath(self.assets_dir):
+            return False
+        self.entries = data.get('characters', {})
+        return True
+
+    def save(self):
+        data = {'version': self.VERSION, 'root': os.path.abspath(self.assets_dir), 'characters': self.entries}
+        try:
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ 写入角色清单失败: {e}")
+
+    def revalidate(self):
+        """对照目录 mtime 增量更新清单（可在后台线程运行）；有变化时写回磁盘并返回 True"""
+        entries = {}
+        try:
+            with os.scandir(self.assets_dir) as it:
+                dirs = sorted((e.name, e) for e in it if e.is_dir() and not e.name.startswith('.'))
+        except OSError:
+            dirs = []
+        for name, entry in dirs:
+            try:
+                mtime = entry.stat().st_mtime_ns
+            except OSError:
+                continue
+            old = self.entries.get(name)
+            if old is not None and old['mtime'] == mtime:
+                entries[name] = old
+                continue
+            # 没有可用 GIF 的目录也记下来，下次 mtime 不变就不再列目录
+            entries[name] = self._scan_dir(name, entry.path, mtime, old)
+        changed = entries != self.entries
+        self.entries = entries          # 整体替换，Tk 线程不会读到一半的字典
+        if changed:
+            self.save()
+        return changed
+
+    def _scan_dir(self, name, path, mtime, old):
+        self.scans += 1
+        old_files = old['files'] if old else {}
+        files = {}
+        try:
+            with os.scandir(path) as it:
+                gifs = [e for e in it if e.is_file() and e.name.lower().endswith('.gif')]
+        except OSError:
+            gifs = []
+        for e in gifs:
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            info = old_files.get(e.name)
+            if info is None or info['mtime'] != st.st_mtime or info['size'] != st.st_size:
+                info = {'mtime': st.st_mtime, 'size': st.st_size}
+                try:
+                    with Image.open(e.path) as im:
+                        info['width'], info['height'] = im.size
+                        info['frames'] = getattr(im, 'n_frames', 1)
+                except Exception as err:
+                    print(f"⚠️ 无法读取 {e.path}: {err}")
+                    continue
+            files[e.name] = info
+        return {'mtime': mtime, 'files': files, 'states': self.resolve_states(name, files)}
+
+    @classmethod
+    def resolve_states(cls, name, filenames):
+        """按命名约定把文件名对应到状态，返回 {状态: 文件名}"""
+        states = {}
+        numbered = {}
+        valid = {s.value for s in PetState}
+        pattern = re.compile(re.escape(name.lower()) + r'[-_ ]?(\d+)')
+        for filename in sorted(filenames):
+            stem = os.path.splitext(filename)[0].lower()
+            if stem in valid:
+                states[stem] = filename
+                continue
+            m = pattern.fullmatch(stem)
+            if m:
+                numbered.setdefault(int(m.group(1)), filename)
+        for n, filename in sorted(numbered.items()):
+            for state in cls.NUMBERED_STATES.get(n, ()):
+                states.setdefault(state, filename)
+        if not states and len(filenames) == 1:
+            only = next(iter(filenames))
+            states = dict.fromkeys(cls.BASE_STATES, only)
+        return states
+
+    def mtime(self, gif_path):
+        """清单里记录的 GIF mtime（不访问磁盘），不在清单里返回 None"""
+        try:
+            name, filename = os.path.split(os.path.relpath(gif_path, self.assets_dir))
+        except ValueError:          # Windows 上不同盘符
+            return None
+        info = self.entries.get(name, {}).get('files', {}).get(filename)
+        return info['mtime'] if info else None
+
+    def merge(self, explicit):
+        """合并出完整角色表，逐状态叠加：资源包 < 目录自动发现 < config.json。
+        config.json 中的角色排在最前；引用了不存在文件的状态被去掉（切换到该状态时沿用上一张图）"""
+        self.explicit = explicit
+        entries = self.entries          # 后台重新验证会整体替换 entries，这里只读一份
+        packed = ASSET_FS.characters()
+        merged = {}
+        for name in dict.fromkeys([*explicit, *packed, *(n for n, e in entries.items() if e['states'])]):
+            state_map = {**packed.get(name, {}), **self._paths(name, entries.get(name))}
+            if name in explicit:
+                state_map.update((st, p) for st, p in explicit[name].items() if self._exists(p))
+            merged[name] = state_map
+        return merged
+
+    def _paths(self, name, entry):
+        if entry is None:
+            return {}
+        return {state: os.path.join(self.assets_dir, name, filename) for state, filename in entry['states'].items()}
+
+    def _exists(self, gif_path):
+        # 清单里有的文件不再 stat；配置引用清单外的文件时才查一次
+        if self.mtime(gif_path) is not None or ASSET_FS.exists(gif_path):
+            return True
+        if gif_path not in self._missing:
+            self._missing.add(gif_path)
+            print(f"⚠️ 找不到 {gif_path}，该状态沿用上一张图")
+        return False
+
+# --- 1.2.4 资源包 (Asset Packs) ---
+def _zipfile():
+    import zipfile     # 只在配置了资源包或打包时才需要，不拖慢启动
+    return zipfile
+
+
+class AssetPack:
+    """一个资源包：zip 文件，根目录下是 config.json 和角色目录（与 images/ 相同的布局）。
+
+    整个文件只 mmap 一次，成员按中央目录里的偏移直接从映射内存切片读取，
+    不解压到磁盘；GIF 本身已经压缩，build_pack 用不压缩（STORED）方式写入，
+    读取时连解压都省了。包内成员对外的路径是 "<包路径>/<成员名>"。
+    """
+    LOCAL_HEADER = struct.Struct('<4s5H3L2H')     # zip 本地文件头（30 字节）
+    STORED, DEFLATED = 0, 8                       # zipfile.ZIP_STORED / ZIP_DEFLATED
+
+    def __init__(self, path):
+        self.path = path
+        st = os.stat(path)
+        self.mtime_ns = st.st_mtime_ns
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.members = {}          # 成员名 -> (数据偏移, 压缩后大小, 原始大小, 压缩方式, mtime)
+        with _zipfile().ZipFile(self._mm) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                header = self.LOCAL_HEADER.unpack_from(self._mm, info.header_offset)
+                offset = info.header_offset + self.LOCAL_HEADER.size + header[9] + header[10]
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                self.members[info.filename] = (offset, info.compress_size, info.file_size,
+                                               info.compress_type, mtime)
+
+    def read(self, member):
+        """成员内容：STORED 直接返回映射上的 memoryview（不复制），DEFLATED 解压成 bytes"""
+        offset, csize, _, method, _ = self.members[member]
+        data = memoryview(self._mm)[offset:offset + csize]
+        if method == self.DEFLATED:
+            data = zlib.decompress(data, -15)
+        elif method != self.STORED:
+            raise OSError(f"不支持的压缩方式 {method}: {member}")
+        return data
+
+    def stat(self, member):
+        _, _, size, _, mtime = self.members[member]
+        return types.SimpleNamespace(st_size=size, st_mtime=mtime, st_mtime_ns=int(mtime * 1e9))
+
+    def config(self):
+        """包内 config.json，没有时返回 {}"""
+        if 'config.json' not in self.members:
+            return {}
+        return json.loads(str(self.read('config.json'), 'utf-8'))
+
+    def characters(self):
+        """包内角色：目录约定发现的结果，再由包内 config.json 逐状态覆盖"""
+        by_dir = {}
+        for member in self.members:
+            name, sep, filename = member.partition('/')
+            if sep and '/' not in filename and filename.lower().endswith('.gif'):
+                by_dir.setdefault(name, []).append(filename)
+        chars = {}
+        for name, filenames in by_dir.items():
+            states = CharacterIndex.resolve_states(name, filenames)
+            if states:
+                chars[name] = {st: os.path.join(self.path, name, fn) for st, fn in states.items()}
+        for name, state_map in self.config().get('characters', {}).items():
+            chars[name] = dict(chars.get(name, {}),
+                               **{st.lower(): os.path.join(self.path, gif) for st, gif in state_map.items()})
+        return chars
+
+
+class _ViewReader(io.RawIOBase):
+    """只读、可 seek 的文件对象，按需从 memoryview 里取数据（包内成员不先整体复制一份）"""
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = (0, self._pos, len(self._view))[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        data = self._view[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self._view[self._pos:self._pos + len(buffer)]
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        return n
+
+
+class AssetFS:
+    """素材路径的统一入口：普通文件走文件系统，资源包成员走 AssetPack。
+
+    挂载的包按顺序叠加，后面的包覆盖前面的；images/ 下的散文件和 config.json
+    再覆盖所有包。没有挂载任何包时每次调用只多一次空字典判断。
+    """
+
+    def __init__(self):
+        self.packs = {}            # 包路径 -> AssetPack，按叠加顺序
+        self._prefixes = []        # [(规范化的包路径 + 分隔符, AssetPack)]
+
+    def mount(self, paths):
+        """换成 paths 这组包；已挂载且文件没变的直接复用，打不开的跳过并提示"""
+        packs = {}
+        for path in paths:
+            old = self.packs.get(path)
+            try:
+                if old is not None and os.stat(path).st_mtime_ns == old.mtime_ns:
+                    packs[path] = old
+                else:
+                    packs[path] = AssetPack(path)
+            except (OSError, ValueError, _zipfile().BadZipFile) as e:
+                print(f"⚠️ 无法打开资源包 {path}: {e}")
+        # 旧包的映射不主动关闭：后台线程可能还在读，没有引用后自然释放
+        self.packs = packs
+        self._prefixes = [(os.path.normpath(path) + os.sep, pack) for path, pack in packs.items()]
+
+    def _member(self, path):
+        if self._prefixes:
+            # config.json 里的 "包名/角色/文件.gif" 拼出的路径在 Windows 上混有 / 和 \，先规范化再比
+            path = os.path.normpath(path)
+            for prefix, pack in self._prefixes:
+                if path.startswith(prefix):
+                    return pack, path[len(prefix):].replace(os.sep, '/')
+        return None, None
+
+    def pack_of(self, path):
+        """path 所在的资源包路径，不在包内返回 None"""
+        pack, _ = self._member(path)
+        return pack.path if pack is not None else None
+
+    def stat(self, path):
+        pack, member = self._member(path)
+        if pack is None:
+            return os.stat(path)
+        try:
+            return pack.stat(member)
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def getmtime(self, path):
+        return self.stat(path).st_mtime
+
+    def exists(self, path):
+        try:
+            self.stat(path)
+        except OSError:
+            return False
+        return True
+
+    def open(self, path):
+        """以二进制只读方式打开（包内成员返回内存中的文件对象）"""
+        pack, member = self._member(path)
+        if pack is None:
+            return open(path, 'rb')
+        try:
+            return _ViewReader(pack.read(member))
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def settings(self):
+        """各包 config.json 里的 settings，按叠加顺序合并"""
+        merged = {}
+        for pack in self.packs.values():
+            merged.update(pack.config().get('settings', {}))
+        return merged
+
+    def characters(self):
+        """各包的角色，按叠加顺序逐状态覆盖"""
+        merged = {}
+        for pack in self.packs.values():
+            for name, state_map in pack.characters().items():
+                merged[name] = dict(merged.get(name, {}), **state_map)
+        return merged
+
+
+ASSET_FS = AssetFS()
+
+
+def build_pack(src_dir, out_path):
+    """把 images/ 这样的目录打成资源包，返回写入的成员数。
+
+    GIF 不再压缩（STORED），读取时直接切片；config.json 中的 asset_packs 设置去掉，
+    包不能再引用别的包。成员的时间戳取源文件 mtime，源文件没变时重打的包不会让缓存失效。
+    """
+    zipfile = _zipfile()
+    count = 0
+    tmp = out_path + '.tmp'
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED, strict_timestamps=False) as zf:
+        for dirpath, dirnames, filenames in os.walk(src_dir):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                member = os.path.relpath(path, src_dir).replace(os.sep, '/')
+                if member == 'config.json':
+                    with open(path, encoding='utf-8') as f:
+                        raw = json.load(f)
+                    raw.get('settings', {}).pop('asset_packs', None)
+                    stamp = max(time.localtime(os.path.getmtime(path))[:6], (1980, 1, 1, 0, 0, 0))
+                    zf.writestr(zipfile.ZipInfo('config.json', stamp),
+                                json.dumps(raw, ensure_ascii=False, indent=4), zipfile.ZIP_DEFLATED)
+                elif filename.lower().endswith('.gif'):
+                    zf.write(path, member)
+                else:
+                    continue
+                count += 1
+    os.replace(tmp, out_path)
+    return count
+
+# --- 1.3 定时器调度 (Scheduler) ---
+class TimerHandle:
+    """Scheduler.call_later 返回的句柄，可取消、可廉价地改期"""
+    __slots__ = ('scheduler', 'deadline', 'callback', 'args', 'owner', 'active', 'seq')
+
+    def __init__(self, scheduler, deadline, callback, args, owner):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.owner = owner
+        self.active = False
+        self.seq = 0
+
+    def cancel(self):
+        self.scheduler._cancel(self)
+
+    def rearm(self, delay_ms):
+        """改期（已触发/取消的句柄会被重新激活）；推迟不会触碰 Tcl"""
+        self.scheduler._rearm(self, delay_ms)
+
+    def rearm_at(self, deadline):
+        """按调度器时钟的绝对时刻改期（周期任务按上一次的截止时间累加，不会漂移）"""
+        self.scheduler._rearm(self, (deadline - self.scheduler.clock()) * 1000)
 
     @property
-    def GRAVITY(self):
-        return self.settings['gravity']
+    def remaining_ms(self):
+        if not self.active:
+            return None
+        return max(0.0, (self.deadline - self.scheduler.clock()) * 1000)
+
+
+class Scheduler:
+    """所有定时任务共用的截止时间堆，由一个 Tk after 任务驱动。
+
+    - call_later 返回 TimerHandle，可单独取消或 rearm
+    - owner 分组：cancel_owner(owner) 一次取消同组全部定时器（如"某状态下的所有定时器"）
+    - 推迟已有定时器只改堆内截止时间，Tk 定时器只在最早截止时间提前时才重设
+    - master 为 None 时不依赖 Tk：由 advance(until) 手动推进（配合 ManualClock，用于无界面模拟）
+    """
+    COMPACT_MIN = 64   # 堆中过期条目超过此数且多于有效条目时重建堆
+
+    def __init__(self, master, clock=time.monotonic):
+        self.master = master
+        self.clock = clock
+        self._heap = []              # (deadline, seq, handle)
+        self._seq = 0
+        self._owners = {}            # owner -> set(handle)
+        self._active = 0
+        self._tk_job = None
+        self._tk_deadline = None
+        self.tk_calls = 0            # after/after_cancel 调用次数
+        self.fired = 0
+        self.wakeups = 0             # Tk 定时器实际唤醒次数
+        self._rate_t0 = clock()
+        self._rate_n = 0
+        self._last_rate = 0.0
+        self.trace = None            # TraceRecorder：记录每次唤醒和触发的回调
+
+    def call_later(self, delay_ms, callback, *args, owner=None):
+        handle = TimerHandle(self, 0.0, callback, args, owner)
+        self._rearm(handle, delay_ms)
+        return handle
+
+    def handle(self, callback, *args, owner=None):
+        """创建一个未启动的句柄，之后用 rearm 启动"""
+        return TimerHandle(self, 0.0, callback, args, owner)
+
+    def cancel_owner(self, owner):
+        for handle in list(self._owners.get(owner, ())):
+            self._cancel(handle)
+
+    def pending(self, owner=None):
+        """待触发的定时器数量（可按 owner 统计）"""
+        if owner is None:
+            return self._active
+        return len(self._owners.get(owner, ()))
+
+    def __len__(self):
+        return self._active
+
+    def wakeup_rate(self):
+        """最近约一秒内每秒的唤醒次数"""
+        elapsed = self.clock() - self._rate_t0
+        if elapsed >= 1.0:
+            return self._rate_n / elapsed
+        return self._last_rate
+
+    def dispatch(self):
+        """立即处理到期的定时器（回放时在轨迹记录的唤醒时刻调用）"""
+        if self._tk_job is not None:
+            self.master.after_cancel(self._tk_job)
+            self.tk_calls += 1
+        self._dispatch()
+
+    def advance(self, until):
+        """无 Tk 模式：按截止时间顺序触发 until 之前到期的全部定时器，时钟随之前进"""
+        clock = self.clock
+        while True:
+            deadline = self._peek()
+            if deadline is None or deadline > until:
+                break
+            if deadline > clock.now:
+                clock.now = deadline
+            self._dispatch()
+        if until > clock.now:
+            clock.now = until
+
+    def stats(self):
+        return {'pending': self._active, 'heap': len(self._heap),
+                'fired': self.fired, 'tk_calls': self.tk_calls,
+                'wakeups': self.wakeups, 'wakeups_per_sec': round(self.wakeup_rate(), 2)}
+
+    # ---- 内部实现 ----
+    def _push(self, handle, delay_ms):
+        self._seq += 1
+        handle.seq = self._seq
+        handle.deadline = self.clock() + delay_ms / 1000.0
+        heapq.heappush(self._heap, (handle.deadline, self._seq, handle))
+        if self._tk_deadline is None or handle.deadline < self._tk_deadline:
+            self._arm()
+        elif len(self._heap) > self.COMPACT_MIN and len(self._heap) > 2 * self._active:
+            self._compact()
+
+    def _rearm(self, handle, delay_ms):
+        if not handle.active:
+            handle.active = True
+            self._active += 1
+            if handle.owner is not None:
+                self._owners.setdefault(handle.owner, set()).add(handle)
+        self._push(handle, delay_ms)
+
+    def _cancel(self, handle):
+        if not handle.active:
+            return
+        handle.active = False
+        self._active -= 1
+        group = self._owners.get(handle.owner)
+        if group is not None:
+            group.discard(handle)
+            if not group:
+                del self._owners[handle.owner]
+        # 堆里的条目留到弹出时再丢弃
+        if self._active == 0 and self._tk_job is not None:
+            self._heap.clear()
+            self.master.after_cancel(self._tk_job)
+            self.tk_calls += 1
+            self._tk_job = self._tk_deadline = None
+
+    def _compact(self):
+        self._heap = [e for e in self._heap if e[2].active and e[1] == e[2].seq]
+        heapq.heapify(self._heap)
+
+    def _peek(self):
+        """丢掉堆顶的过期条目，返回最早的有效截止时间"""
+        heap = self._heap
+        while heap:
+            deadline, seq, handle = heap[0]
+            if handle.active and seq == handle.seq:
+                return deadline
+            heapq.heappop(heap)
+        return None
+
+    def _arm(self):
+        deadline = self._peek()
+        if self._tk_job is not None:
+            self.master.after_cancel(self._tk_job)
+            self.tk_calls += 1
+            self._tk_job = None
+        self._tk_deadline = deadline
+        if deadline is None or self.master is None:
+            return
+        delay = max(0, math.ceil((deadline - self.clock()) * 1000))
+        self._tk_job = self.master.after(delay, self._dispatch)
+        self.tk_calls += 1
+
+    def _dispatch(self):
+        self._tk_job = self._tk_deadline = None
+        now = self.clock()
+        self.wakeups += 1
+        self._rate_n += 1
+        if now - self._rate_t0 >= 1.0:
+            self._last_rate = self._rate_n / (now - self._rate_t0)
+            self._rate_t0, self._rate_n = now, 0
+        trace = self.trace
+        if trace is not None:
+            trace.dispatch()
+        heap = self._heap
+        while heap:
+            deadline, seq, handle = heap[0]
+            if not handle.active or seq != handle.seq:
+                heapq.heappop(heap)
+                continue
+            if deadline > now:
+                break
+            heapq.heappop(heap)
+            self._cancel(handle)   # 先失活，回调里可以安全地 rearm
+            self.fired += 1
+            if trace is not None:
+                trace.timer(handle.callback)
+            try:
+                handle.callback(*handle.args)
+            except Exception:
+                if self.master is None:
+                    raise
+                self.master.report_callback_exception(*sys.exc_info())
+        if self._tk_job is None:
+            self._arm()
+
+# --- 1.4 窗口几何模型 (Window Geometry) ---
+class WindowGeometry:
+    """宠物窗口位置/尺寸和屏幕边界的本地权威模型。
+
+    运动代码只读写这里的数值，不再每帧向窗口系统查询 winfo_*；
+    只有取整后的位置真的变化时才调用一次 geometry()。
+    master 为 None 时是纯数值模型（无界面模拟），屏幕尺寸由 screen 给出。
+    """
+    MIN_SIZE = 64   # 窗口尚未映射时的保护尺寸
+
+    def __init__(self, master, screen=None):
+        self.master = master
+        self.tk_calls = 0            # 经本模型发出的 Tk 调用总数
+        self.last_tick_calls = 0     # 最近一个运动帧内的 Tk 调用数
+        self._recent_writes = deque(maxlen=8)
+        self.x = self.y = 0
+        self.w = self.h = 0
+        if master is None:
+            self.screen_w, self.screen_h = screen
+        else:
+            self.refresh_screen()
+
+    def refresh_screen(self):
+        if self.master is None:
+            return
+        self.screen_w = self.master.winfo_screenwidth()
+        self.screen_h = self.master.winfo_screenheight()
+        self.tk_calls += 2
 
     @property
-    def EDGE_SNAP_MARGIN(self):
-        return self.settings['edge_snap_margin']
+    def pet_w(self):
+        return self.w if self.w > 1 else self.MIN_SIZE
 
     @property
-    def SNAP_SPEED_THRESHOLD(self):
-        return self.settings['snap_speed_threshold']
+    def pet_h(self):
+        return self.h if self.h > 1 else self.MIN_SIZE
+
+    def set(self, x, y, w, h):
+        """一次性设置位置和尺寸"""
+        self.x, self.y, self.w, self.h = x, y, w, h
+        self._write(f"{w}x{h}+{round(x)}+{round(y)}", (round(x), round(y)))
+
+    def move_to(self, x, y):
+        self.x, self.y = x, y
+        pos = (round(x), round(y))
+        if self._recent_writes and self._recent_writes[-1] == pos:
+            return          # 取整后没变，不打扰窗口系统
+        self._write(f"+{pos[0]}+{pos[1]}", pos)
+
+    def resize(self, w, h):
+        if (w, h) == (self.w, self.h):
+            return
+        self.w, self.h = w, h
+        if self.master is None:
+            return
+        self.master.geometry(f"{w}x{h}")
+        self.tk_calls += 1
+
+    def _write(self, spec, pos):
+        self._recent_writes.append(pos)
+        if self.master is None:
+            return
+        self.master.geometry(spec)
+        self.tk_calls += 1
+
+    def on_configure(self, event):
+        """<Configure> 回调：只采纳不是自己写入回显的位置（窗口管理器等外部移动）"""
+        if event.widget is not self.master:
+            return
+        self.w, self.h = event.width, event.height
+        if (event.x, event.y) not in self._recent_writes:
+            self.x, self.y = event.x, event.y
+            self._recent_writes.append((event.x, event.y))
+            self.refresh_screen()
+
+    def near_edge(self, zone):
+        """窗口是否在距任一屏幕边 zone 像素以内"""
+        return ((self.y + self.pet_h) > self.screen_h - zone
+                or (self.x + self.pet_w) > self.screen_w - zone
+                or self.y < zone
+                or self.x < zone)
+
+# --- 1.5 指针跟踪 (Pointer Tracker) ---
+class PointerTracker:
+    """全局指针跟踪：把 <Motion> 事件合并成每帧至多一个样本。
+
+    事件回调只记下 event.x_root/y_root，不做任何 Tk 调用；样本在帧定时器里
+    统一处理，位置真的变化时才调用 on_move(x, y)。poll_ms > 0 时额外低频轮询
+    winfo_pointerxy，用来发现指针在宠物窗口之外的移动。
+    """
+
+    def __init__(self, master, scheduler, on_move, frame_ms, poll_ms=0, owner=None):
+        self.master = master
+        self.scheduler = scheduler
+        self.screen_h = master.winfo_screenheight()
+        self.on_move = on_move
+        self.read_pointer = master.winfo_pointerxy   # 回放时替换成轨迹里的读数
+        self.frame_ms = frame_ms
+        self.poll_ms = poll_ms
+        self.x = self.y = None
+        self.timestamp = 0.0         # 最近一次位置变化的时间（scheduler 时钟）
+        self.events = 0              # 收到的原始 <Motion> 事件数
+        self.samples = 0             # 实际处理的样本数
+        self._pending = None
+        self._flush_timer = scheduler.handle(self._flush, owner=owner)
+        self._poll_timer = scheduler.handle(self._poll, owner=owner)
+        if poll_ms > 0:
+            self._poll_timer.rearm(poll_ms)
 
     @property
-    def MOUSE_IDLE_TIME_BEFORE_ACTION(self):
-        return self.settings['mouse_idle_time_before_action']
+    def pos(self):
+        return self.x, self.y
+
+    def on_motion(self, event):
+        self.events += 1
+        self._pending = (event.x_root, event.y_root)
+        if not self._flush_timer.active:
+            self._flush_timer.rearm(self.frame_ms)
+
+    def sample_now(self, notify=False):
+        """立即读取一次真实指针位置（一次往返），默认只更新不通知"""
+        x, y = self.read_pointer()
+        self._accept(x, y, notify)
+        return self.pos
+
+    def configure(self, frame_ms, poll_ms):
+        """热更新帧间隔与轮询间隔"""
+        self.frame_ms = frame_ms
+        if poll_ms != self.poll_ms:
+            self.poll_ms = poll_ms
+            if poll_ms > 0:
+                self._poll_timer.rearm(poll_ms)
+            else:
+                self._poll_timer.cancel()
+
+    def _flush(self):
+        if self._pending is not None:
+            x, y = self._pending
+            self._pending = None
+            self._accept(x, y, True)
+
+    def _poll(self):
+        self.sample_now(notify=True)
+        self._poll_timer.rearm(self.poll_ms)
+
+    def _accept(self, x, y, notify):
+        # 多屏时指针可能超出主屏，限制在屏幕范围内
+        y = min(y, self.screen_h)
+        if (x, y) == (self.x, self.y):
+            return
+        self.x, self.y = x, y
+        self.timestamp = self.scheduler.clock()
+        self.samples += 1
+        if notify:
+            self.on_move(x, y)
+
+# --- 1.6 拖拽管线 (Drag Tracker) ---
+class DragTracker:
+    """拖拽管线：固定大小的环形缓冲记录带时间戳的指针样本，
+    每帧至多移动一次窗口，松手时根据最近样本估算释放速度。"""
+    CAPACITY = 16           # 环形缓冲大小
+    VELOCITY_WINDOW = 0.1   # 估算释放速度时使用最近多少秒的样本
+
+    def __init__(self, scheduler, geometry, frame_ms, owner=None):
+        self.scheduler = scheduler
+        self.geometry = geometry
+        self.frame_ms = frame_ms
+        self._xs = [0] * self.CAPACITY
+        self._ys = [0] * self.CAPACITY
+        self._ts = [0.0] * self.CAPACITY
+        self._head = 0          # 下一次写入位置
+        self._count = 0
+        self.start_pos = None   # 按下时指针的屏幕坐标
+        self.window_start = None
+        self.events = 0         # 收到的拖动事件数
+        self.moves = 0          # 实际移动窗口的次数
+        self._move_pending = False
+        self._move_timer = scheduler.handle(self.flush, owner=owner)
 
     @property
-    def MOUSE_FOLLOW_SPEED(self):
-        return self.settings['mouse_follow_speed']
+    def pressed(self):
+        return self.start_pos is not None
+
+    def begin(self, x_root, y_root):
+        self.start_pos = (x_root, y_root)
+        self.window_start = (self.geometry.x, self.geometry.y)
+        self._head = self._count = 0
+        self._move_pending = False
+        self.add_sample(x_root, y_root)
+
+    def add_sample(self, x_root, y_root):
+        i = self._head
+        self._xs[i], self._ys[i], self._ts[i] = x_root, y_root, self.scheduler.clock()
+        self._head = (i + 1) % self.CAPACITY
+        self._count = min(self._count + 1, self.CAPACITY)
+        self.events += 1
+
+    def distance(self):
+        """最新样本离按下点的距离"""
+        last = (self._head - 1) % self.CAPACITY
+        return math.hypot(self._xs[last] - self.start_pos[0], self._ys[last] - self.start_pos[1])
+
+    def request_move(self):
+        """窗口跟随最新样本；同一帧内的多次请求合并成一次 geometry"""
+        self._move_pending = True
+        if not self._move_timer.active:
+            self._move_timer.rearm(self.frame_ms)
+
+    def flush(self):
+        self._move_timer.cancel()
+        if not self._move_pending or not self.pressed:
+            return
+        self._move_pending = False
+        last = (self._head - 1) % self.CAPACITY
+        new_x = self.window_start[0] + (self._xs[last] - self.start_pos[0])
+        new_y = self.window_start[1] + (self._ys[last] - self.start_pos[1])
+        self.geometry.move_to(int(new_x), int(new_y))
+        self.moves += 1
+
+    def end(self):
+        self.flush()
+        self.start_pos = self.window_start = None
+
+    def velocity(self):
+        """最近 VELOCITY_WINDOW 秒内的平均速度 (vx, vy)，单位 像素/秒"""
+        if self._count < 2:
+            return 0.0, 0.0
+        last = (self._head - 1) % self.CAPACITY
+        t_last = self._ts[last]
+        first = last
+        for k in range(1, self._count):
+            i = (last - k) % self.CAPACITY
+            if t_last - self._ts[i] > self.VELOCITY_WINDOW:
+                break
+            first = i
+        dt = t_last - self._ts[first]
+        if dt <= 0.005:
+            return 0.0, 0.0
+        return (self._xs[last] - self._xs[first]) / dt, (self._ys[last] - self._ys[first]) / dt
+
+# --- 1.7 轨迹预计算 (Trajectory) ---
+def _path_points(start, target, dists, total):
+    """沿 start→target 的直线，按累计距离 dists 取坐标（保留小数），末尾补上 target"""
+    sx, sy = start
+    tx, ty = target
+    if np is not None:
+        r = np.asarray(dists, dtype=float) / total if total else np.zeros(len(dists))
+        return np.append(sx + (tx - sx) * r, tx), np.append(sy + (ty - sy) * r, ty)
+    xs = [sx + (tx - sx) * d / total for d in dists] + [tx]
+    ys = [sy + (ty - sy) * d / total for d in dists] + [ty]
+    return xs, ys
+
+
+class Trajectory:
+    """一段运动按时间采样的全部坐标：运动开始时一次算好，每个 tick 按流逝的帧数前进下标。
+
+    第 k 个点是开始后 (k+1)·frame_s 秒的位置，最后一个点就是终点，走到它时 done=True。
+    坐标保留小数，窗口位置在写入时才取整，低速时也不会因为每帧取整而丢掉移动。
+    """
+    __slots__ = ('xs', 'ys', 'index', 'target', 'kind')
+
+    def __init__(self, xs, ys, target, kind):
+        self.xs = xs
+        self.ys = ys
+        self.index = 0
+        self.target = target
+        self.kind = kind
+
+    def __len__(self):
+        return len(self.xs)
+
+    def step(self, frames=1):
+        """前进 frames 帧（至少 1），返回 (x, y, done)"""
+        last = len(self.xs) - 1
+        i = min(self.index + frames - 1, last)
+        self.index = min(i + 1, last)
+        return float(self.xs[i]), float(self.ys[i]), i >= last
+
+    @classmethod
+    def linear(cls, start, target, speed, frame_s, kind=None):
+        """匀速直线：speed 像素/秒，按 frame_s 秒采样，不足一步时直接落到终点"""
+        total = math.hypot(target[0] - start[0], target[1] - start[1])
+        per_frame = speed * frame_s
+        steps = min(int(total // per_frame), 100000) if per_frame > 0 else 0
+        if np is not None:
+            dists = np.arange(1, steps + 1, dtype=float) * per_frame
+        else:
+            dists = [k * per_frame for k in range(1, steps + 1)]
+        return cls(*_path_points(start, target, dists, total), target, kind)
+
+    @classmethod
+    def fall(cls, start, target, velocity, gravity, max_speed, margin, frame_s, kind=None):
+        """匀加速（像素/秒²，有速度上限）冲向 target，剩余距离小于 margin 时吸附。
+
+        位移按解析式 s(t) 在各采样时刻取值，结果与采样间隔无关。
+        """
+        total = math.hypot(target[0] - start[0], target[1] - start[1])
+        velocity = min(velocity, max_speed)
+        if total < margin or (velocity <= 0 and gravity <= 0):
+            return cls(*_path_points(start, target, [], total), target, kind)
+        # 加速到上限的时刻 t1 及其位移
+        t1 = (max_speed - velocity) / gravity if gravity > 0 else math.inf
+        s1 = velocity * t1 + gravity * t1 * t1 / 2 if t1 != math.inf else math.inf
+        # 需要走 total - margin 才算落地，求出所需时间得到采样数
+        need = max(total - margin, 0.0)
+        if need <= s1:
+            t_land = ((-velocity + math.sqrt(velocity * velocity + 2 * gravity * need)) / gravity
+                      if gravity > 0 else need / velocity)
+        else:
+            t_land = t1 + (need - s1) / max_speed
+        steps = min(max(1, math.ceil(t_land / frame_s - 1e-9)), 100000)
+        if np is not None:
+            t = np.arange(1, steps + 1, dtype=float) * frame_s
+            tc = np.minimum(t, t1)
+            dists = np.minimum(velocity * tc + gravity * tc * tc / 2 + max_speed * (t - tc), total)
+        else:
+            dists = []
+            for k in range(1, steps + 1):
+                t = k * frame_s
+                tc = min(t, t1)
+                dists.append(min(velocity * tc + gravity * tc * tc / 2 + max_speed * (t - tc), total))
+        return cls(*_path_points(start, target, dists, total), target, kind)
+
+
+class TrajectoryBatch:
+    """把多只宠物的轨迹拼成一个大数组，一次数组运算推进全部宠物"""
+
+    def __init__(self):
+        self._trajs = ()
+        self._xs = self._ys = self._offsets = self._last = None
+
+    def step(self, trajs, frames=1):
+        """对每条轨迹前进 frames 帧，返回 [(x, y, done), ...]"""
+        if np is None or len(trajs) < 2:
+            return [t.step(frames) for t in trajs]
+        if len(trajs) != len(self._trajs) or not all(map(operator.is_, trajs, self._trajs)):
+            self._rebuild(trajs)
+        idx = np.fromiter((t.index for t in trajs), dtype=np.int64, count=len(trajs))
+        idx = np.minimum(idx + (frames - 1), self._last)
+        flat = self._offsets + idx
+        done = idx >= self._last
+        for t, i in zip(trajs, np.minimum(idx + 1, self._last).tolist()):
+            t.index = i
+        return list(zip(self._xs[flat].tolist(), self._ys[flat].tolist(), done.tolist()))
+
+    def _rebuild(self, trajs):
+        # 只在参与的轨迹集合变化时重新拼接（开始/结束运动、跟随目标变化）
+        self._trajs = tuple(trajs)
+        lengths = np.fromiter((len(t) for t in trajs), dtype=np.int64, count=len(trajs))
+        self._xs = np.concatenate([np.asarray(t.xs, dtype=float) for t in trajs])
+        self._ys = np.concatenate([np.asarray(t.ys, dtype=float) for t in trajs])
+        self._offsets = np.cumsum(lengths) - lengths
+        self._last = lengths - 1
+
+# --- 1.8 热更新 (Hot Reload) ---
+class HotReloader:
+    """低频轮询 config.json、资源包、素材根目录以及正在显示的角色的目录和 GIF 的 mtime。
+
+    每次检查只是若干次 os.stat，与角色总数无关；文件变化交给 PetWorld.hot_reload，
+    由它原地应用新设置、只重新解码改动过的 GIF；目录变化（增删角色或 GIF）
+    交给 PetWorld.rescan_characters 在后台重新验证角色清单。
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.checks = 0
+        self.reloads = 0
+        self._dirs = set()
+        self._mtimes = self._snapshot()
+        self._timer = world.scheduler.handle(self._check, owner=self)
+        if world.config.HOT_RELOAD_MS > 0:
+            self._timer.rearm(world.config.HOT_RELOAD_MS)
+
+    def _watched(self):
+        """返回 (文件集合, 目录集合)"""
+        world = self.world
+        files = {Config.config_path(), *ASSET_FS.packs}
+        dirs = {Config.ASSETS_DIR}
+        for name in {pet.character_names[pet.current_char_idx] for pet in world.pets}:
+            # 包内成员和包内"目录"在磁盘上不存在，由上面的包文件本身代为监视
+            gifs = [p for p in world.characters.get(name, {}).values() if ASSET_FS.pack_of(p) is None]
+            files.update(gifs)
+            dirs.update(os.path.dirname(p) for p in gifs)
+        return files, dirs
+
+    def _snapshot(self):
+        mtimes = {}
+        files, self._dirs = self._watched()
+        for path in files | self._dirs:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None      # 暂时不存在，出现时也算变化
+        return mtimes
+
+    def _check(self):
+        self.checks += 1
+        snap = self._snapshot()
+        # 新加入监视的路径（宠物换了角色）只记下基准，不算变化
+        changed = {p for p, m in snap.items() if p in self._mtimes and self._mtimes[p] != m}
+        if changed:
+            self.reloads += 1
+            dirs = changed & self._dirs
+            if dirs:
+                self.world.rescan_characters()
+            if changed - dirs:
+                self.world.hot_reload(changed - dirs)
+            # 配置可能引用了新的 GIF，重新记一次
+            snap = self._snapshot()
+        self._mtimes = snap
+        if self.world.config.HOT_RELOAD_MS > 0:
+            self._timer.rearm(self.world.config.HOT_RELOAD_MS)
+
+# --- 1.9 运行指标 (Metrics) ---
+class Histogram:
+    """固定桶的耗时直方图（毫秒）"""
+    __slots__ = ('counts', 'count', 'total', 'max')
+    BOUNDS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 133)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def snapshot(self):
+        labels = [f"<={b}" for b in self.BOUNDS] + [f">{self.BOUNDS[-1]}"]
+        return {'count': self.count,
+                'mean': round(self.total / self.count, 3) if self.count else 0.0,
+                'max': round(self.max, 3),
+                'buckets': dict(zip(labels, self.counts))}
+
+
+class Metrics:
+    """运行指标：tick 耗时直方图、迟到 tick、load_animation 耗时、状态切换计数等。
+
+    关闭时 PetWorld.metrics 为 None，埋点处只多一次 None 判断。开启后每隔
+    interval_ms 在 Tk 线程生成一次 JSON 快照：写入 dump_path（若设置），
+    并由 127.0.0.1:port 上的 HTTP 服务（若设置）原样返回，服务线程从不碰 Tk 或宠物状态。
+    """
+
+    def __init__(self, world, port=0, dump_path='', interval_ms=5000):
+        self.world = world
+        self.port = port
+        self.dump_path = dump_path
+        self.interval_ms = interval_ms
+        self.started = time.monotonic()
+        self.motion_tick = Histogram()
+        self.animation_tick = Histogram()
+        self.load_animation = Histogram()
+        self.late_motion = 0
+        self.late_animation = 0
+        self.transitions = Counter()     # (旧状态, 新状态) -> 次数
+        self.snapshot_json = '{}'
+        self._server = None
+        self._timer = world.scheduler.handle(self._refresh, owner=self)
+        self._refresh()
+        if port:
+            self._start_server(port)
 
     @property
-    def begin_fall_velocity(self):
-        return self.settings['begin_fall_velocity']
+    def settings(self):
+        return self.port, self.dump_path, self.interval_ms
+
+    def observe_tick(self, hist, timer, interval_ms, started):
+        """tick 结束时调用；started 是 tick 开始的 perf_counter，timer 的截止时间还是本次触发的那次"""
+        hist.observe((time.perf_counter() - started) * 1000)
+        late = (self.world.scheduler.clock() - timer.deadline) * 1000 > interval_ms
+        if late:
+            if hist is self.motion_tick:
+                self.late_motion += 1
+            else:
+                self.late_animation += 1
+
+    def snapshot(self):
+        world = self.world
+        photos = set()
+        for anim in world.frame_cache.animations():
+            photos.update(map(id, anim.images()))
+        for pet in world.pets:
+            photos.update(map(id, pet.animation.images()))
+        return {
+            'uptime_s': round(time.monotonic() - self.started, 1),
+            'pets': len(world.pets),
+            'motion_tick_ms': self.motion_tick.snapshot(),
+            'animation_tick_ms': self.animation_tick.snapshot(),
+            'late_ticks': {'motion': self.late_motion, 'animation': self.late_animation},
+            'load_animation_ms': self.load_animation.snapshot(),
+            'transitions': {f"{a}->{b}": n for (a, b), n in sorted(self.transitions.items())},
+            'dropped_frames': world.dropped_frames,
+            'photo_images': len(photos),
+            'scheduler': world.scheduler.stats(),
+            'window_tk_calls': {'total': sum(pet.geometry.tk_calls for pet in world.pets),
+                                'last_tick_max': max((pet.geometry.last_tick_calls for pet in world.pets),
+                                                     default=0)},
+            'frame_cache': world.frame_cache.stats(),
+            'memory': world.memory.footprint(detail=False),
+            'sprite_cache': world.sprite_cache.stats() if world.sprite_cache else None,
+            'asset_loader_pending': world.asset_loader.pending,
+        }
+
+    def _refresh(self):
+        self.snapshot_json = json.dumps(self.snapshot(), ensure_ascii=False)
+        if self.dump_path:
+            try:
+                tmp = self.dump_path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write(self.snapshot_json)
+                os.replace(tmp, self.dump_path)
+            except OSError as e:
+                print(f"⚠️ 写入指标文件失败: {e}")
+                self.dump_path = ''
+        self._timer.rearm(self.interval_ms)
+
+    def _start_server(self, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.snapshot_json.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        except OSError as e:
+            print(f"⚠️ 指标服务启动失败: {e}")
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"✅ 指标服务: http://127.0.0.1:{port}/")
+
+    def close(self):
+        self._timer.cancel()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+# --- 1.10 操作轨迹 (Trace Recorder) ---
+class ManualClock:
+    """手动推进的时钟，代替 time.monotonic 注入 Scheduler（回放/模拟用）"""
+    __slots__ = ('now',)
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TraceRecorder:
+    """紧凑的二进制操作轨迹：输入事件、定时器触发、随机抽样和状态切换。
+
+    文件格式（小端）：'DGTR' | u16 版本 | u32 元数据长度 | 元数据 JSON | 记录...
+    每条记录是 (f64 相对时间, u8 类型, u16 宠物编号) 加类型相关的负载；字符串
+    （角色名、回调名）第一次出现时用一条 STRING 记录定义，之后只写编号。
+    最近 capacity 条记录同时保存在内存环形缓冲里，可随时 dump 成独立的轨迹文件。
+    """
+    MAGIC = b'DGTR'
+    VERSION = 1
+    HEAD = struct.Struct('<dBH')
+    # 记录类型
+    STRING, PET, PRESS, MOTION, RELEASE, RCLICK, POINTER, SAMPLE, \
+        DISPATCH, TIMER, RANDOM, BITS, STATE, MENU, END = range(15)
+    INPUTS = frozenset({PRESS, MOTION, RELEASE, RCLICK, POINTER, SAMPLE})
+    PAYLOAD = {PET: struct.Struct('<Hii'), TIMER: struct.Struct('<H'), RANDOM: struct.Struct('<d'),
+               STATE: struct.Struct('<BB'), MENU: struct.Struct('<HH')}
+    XY = struct.Struct('<ii')
+    FLUSH_MS = 1000       # 文件缓冲的刷新间隔
+    STATES = None         # PetState 成员列表，定义状态机之后填入
+
+    def __init__(self, path=None, capacity=100000):
+        self.path = path
+        self.ring = deque(maxlen=capacity)
+        self.records = 0
+        self.clock = None
+        self._t0 = 0.0
+        self._strings = {}
+        self._file = None
+        self._master = None
+        self._meta = {}
+
+    def attach(self, world):
+        """PetWorld 建好调度器后调用：确定时间基准，写文件头"""
+        self.clock = world.scheduler.clock
+        self._t0 = self.clock()
+        self._master = world.root
+        self._meta = {'version': self.VERSION, 'settings': world.config.settings,
+                      'screen': list(world.screen)}
+        if self.path:
+            self._file = open(self.path, 'wb')
+            self._file.write(self._header())
+            self._master.after(self.FLUSH_MS, self._flush)
+
+    def _header(self):
+        meta = json.dumps(self._meta, ensure_ascii=False).encode('utf-8')
+        return self.MAGIC + struct.pack('<HI', self.VERSION, len(meta)) + meta
+
+    # ---- 记录 ----
+    def _write(self, kind, pet, payload=b''):
+        rec = self.HEAD.pack(self.clock() - self._t0, kind, pet) + payload
+        self.records += 1
+        if kind != self.STRING:
+            self.ring.append(rec)
+        if self._file is not None:
+            self._file.write(rec)
+
+    def _sid(self, text):
+        sid = self._strings.get(text)
+        if sid is None:
+            sid = self._strings[text] = len(self._strings)
+            self._write(self.STRING, 0, self._string_payload(text))
+        return sid
+
+    @staticmethod
+    def _string_payload(text):
+        data = text.encode('utf-8')
+        return struct.pack('<H', len(data)) + data
 
     @property
-    def fall_zoom_size(self):
-        return self.settings['fall_zoom_size']
+    def strings(self):
+        """按编号排列的字符串表"""
+        return list(self._strings)
+
+    def pet(self, pet):
+        name = pet.character_names[pet.current_char_idx]
+        self._write(self.PET, pet.trace_id,
+                    self.PAYLOAD[self.PET].pack(self._sid(name), round(pet.geometry.x), round(pet.geometry.y)))
+
+    def input(self, kind, pet_id, x, y):
+        self._write(kind, pet_id, self.XY.pack(x, y))
+
+    def dispatch(self):
+        self._write(self.DISPATCH, 0)
+
+    def timer(self, callback):
+        owner = getattr(callback, '__self__', None)
+        if hasattr(callback, '__func__'):
+            # 绑定方法按实例的类命名：方法挪到 PetCore 后 DesktopPet 的轨迹名不变
+            name = f"{type(owner).__name__}.{callback.__name__}"
+        else:
+            name = getattr(callback, '__qualname__', None) or repr(callback)
+        self._write(self.TIMER, getattr(owner, 'trace_id', 0),
+                    self.PAYLOAD[self.TIMER].pack(self._sid(name)))
+
+    def random(self, value):
+        self._write(self.RANDOM, 0, self.PAYLOAD[self.RANDOM].pack(value))
+
+    def bits(self, k, value):
+        self._write(self.BITS, 0, struct.pack('<H', k) + value.to_bytes((k + 7) // 8, 'little'))
+
+    def state(self, pet, old, new):
+        states = self.STATES
+        self._write(self.STATE, pet.trace_id, self.PAYLOAD[self.STATE].pack(states.index(old), states.index(new)))
+
+    def menu(self, pet, action, arg=''):
+        self._write(self.MENU, pet.trace_id, self.PAYLOAD[self.MENU].pack(self._sid(action), self._sid(arg)))
+
+    def traced_sampler(self, read_pointer):
+        """包装 winfo_pointerxy：真实指针读数也是回放需要的输入"""
+        def sample():
+            x, y = read_pointer()
+            self.input(self.SAMPLE, 0, x, y)
+            return x, y
+        return sample
+
+    # ---- 输出 ----
+    def _flush(self):
+        if self._file is not None:
+            self._file.flush()
+            self._master.after(self.FLUSH_MS, self._flush)
+
+    def close(self):
+        if self.clock is not None:
+            self._write(self.END, 0)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def dump(self, path):
+        """把环形缓冲里最近的记录写成独立的轨迹文件（事后排查用，不一定能从头回放）"""
+        with open(path, 'wb') as f:
+            f.write(self._header())
+            for text in self._strings:
+                f.write(self.HEAD.pack(0.0, self.STRING, 0) + self._string_payload(text))
+            for rec in self.ring:
+                f.write(rec)
 
     @classmethod
-    def load_characters(cls):
-        """返回 dict: {角色名: {状态: gif绝对路径}}"""
-        path = os.path.join(cls.ASSETS_DIR, cls.CONFIG_FILE)
-        if not os.path.exists(path):
-            return {}
-        with open(path, encoding="utf-8") as f:
-            raw = json.load(f)
-        chars = {}
-        for char, state_map in raw.get("characters", {}).items():
-            chars[char] = {st.lower(): os.path.join(cls.ASSETS_DIR, gif)
-                           for st, gif in state_map.items()}
-        return chars
+    def read(cls, path):
+        """解析轨迹文件，返回 (元数据, [(t, 类型, 宠物编号, 负载元组), ...])。
+
+        进程崩溃或被强杀时留下的轨迹没有 END 记录，最后一条还可能只写了一半：
+        读到不完整的尾部就停下并提示，元数据里的 truncated 记为 True。
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:4] != cls.MAGIC:
+            raise ValueError(f"不是 DeskGo 轨迹文件: {path}")
+        try:
+            version, meta_len = struct.unpack_from('<HI', data, 4)
+        except struct.error:
+            raise ValueError(f"轨迹文件头不完整: {path}") from None
+        if version != cls.VERSION:
+            raise ValueError(f"不支持的轨迹版本: {version}")
+        pos = 10 + meta_len
+        meta = json.loads(data[10:pos].decode('utf-8'))
+        records, end = cls._parse(data[pos:], [])
+        meta['truncated'] = not records or records[-1][1] != cls.END
+        if end < len(data) - pos:
+            print(f"⚠️ 轨迹末尾不完整，只读取了前 {len(records)} 条记录: {path}")
+        elif meta['truncated']:
+            print(f"⚠️ 轨迹没有正常结束（共 {len(records)} 条记录）: {path}")
+        return meta, records
+
+    @classmethod
+    def read_records(cls, data, strings=None):
+        """解析一段记录字节流；strings 为已知的字符串表（会被就地追加）"""
+        return cls._parse(data, [] if strings is None else strings)[0]
+
+    @classmethod
+    def _parse(cls, data, strings):
+        """返回 (记录列表, 已解析的字节数)；遇到不完整的记录就停在它前面"""
+        records = []
+        head = cls.HEAD
+        pos = 0
+        while pos + head.size <= len(data):
+            start = pos
+            try:
+                t, kind, pet, payload, pos = cls._parse_one(data, pos, strings)
+            except (struct.error, IndexError, UnicodeDecodeError):
+                return records, start
+            if kind is not None:
+                records.append((t, kind, pet, payload))
+        return records, pos
+
+    @classmethod
+    def _parse_one(cls, data, pos, strings):
+        """解析 pos 处的一条记录，返回 (t, 类型, 宠物编号, 负载, 下一条的位置)；
+        STRING 记录只追加字符串表，类型返回 None"""
+        head = cls.HEAD
+        t, kind, pet = head.unpack_from(data, pos)
+        pos += head.size
+        if kind == cls.STRING:
+            (n,) = struct.unpack_from('<H', data, pos)
+            if pos + 2 + n > len(data):
+                raise struct.error("字符串记录不完整")
+            strings.append(data[pos + 2:pos + 2 + n].decode('utf-8'))
+            return t, None, pet, (), pos + 2 + n
+        if kind in cls.INPUTS:
+            payload = cls.XY.unpack_from(data, pos)
+            pos += cls.XY.size
+        elif kind == cls.BITS:
+            (k,) = struct.unpack_from('<H', data, pos)
+            n = (k + 7) // 8
+            if pos + 2 + n > len(data):
+                raise struct.error("随机位记录不完整")
+            payload = (k, int.from_bytes(data[pos + 2:pos + 2 + n], 'little'))
+            pos += 2 + n
+        elif kind in cls.PAYLOAD:
+            fmt = cls.PAYLOAD[kind]
+            payload = fmt.unpack_from(data, pos)
+            pos += fmt.size
+            if kind == cls.PET:
+                payload = (strings[payload[0]],) + payload[1:]
+            elif kind == cls.TIMER:
+                payload = (strings[payload[0]],)
+            elif kind == cls.MENU:
+                payload = (strings[payload[0]], strings[payload[1]])
+            elif kind == cls.STATE:
+                payload = tuple(cls.STATES[i] for i in payload)
+        else:
+            payload = ()
+        return t, kind, pet, payload, pos
+
+
+class RecordingRandom(random.Random):
+    """把每次底层抽样（random / getrandbits）写进轨迹的随机数发生器"""
+
+    def __init__(self, trace, seed=None):
+        self.trace = trace
+        super().__init__(seed)
+
+    def random(self):
+        value = super().random()
+        self.trace.random(value)
+        return value
+
+    def getrandbits(self, k):
+        value = super().getrandbits(k)
+        self.trace.bits(k, value)
+        return value
+
+
+class ReplayRandom(random.Random):
+    """按轨迹中的顺序返回记录下来的抽样结果；抽样种类对不上说明回放已偏离"""
+
+    def __init__(self, draws):
+        self._draws = deque(draws)    # [(类型, 值)]
+        super().__init__(0)
+
+    def _next(self, kind):
+        if not self._draws or self._draws[0][0] != kind:
+            raise ValueError("回放偏离：随机抽样与轨迹不一致")
+        return self._draws.popleft()[1]
+
+    def random(self):
+        return self._next(TraceRecorder.RANDOM)
+
+    def getrandbits(self, k):
+        return self._next(TraceRecorder.BITS)
+
+# --- 1.11 渲染后端 (Renderer) ---
+class LabelView:
+    """每帧一个 PhotoImage，换帧时给 Label 换图"""
+
+    def __init__(self, master, bg):
+        self.widget = tk.Label(master, bg=bg)
+        self.widget.pack()
+
+    def show(self, anim, frame):
+        self.widget.config(image=anim.frames[frame])
+
+
+class CanvasView:
+    """整段动画一张图集，Canvas 只露出当前帧那一格。
+
+    换帧只移动图集在视口里的位置（一次 coords），控件的图片和尺寸都不变；
+    只有换动画时才换图集、改视口大小。渐进解码中的动画还没有图集，逐帧换图。
+    """
+
+    def __init__(self, master, bg):
+        self.widget = tk.Canvas(master, bg=bg, highlightthickness=0, bd=0, width=1, height=1)
+        self.widget.pack()
+        self.item = None
+        self.atlas = None         # 当前显示的图集（或渐进解码中的单帧图）
+        self._size = None
+
+    def show(self, anim, frame):
+        image = anim.atlas if anim.atlas is not None else anim.frames[frame]
+        if image is not self.atlas:
+            if anim.size != self._size:
+                self._size = anim.size
+                self.widget.config(width=anim.size[0], height=anim.size[1])
+            self.atlas = image
+            if self.item is None:
+                self.item = self.widget.create_image(0, 0, anchor='nw', image=image)
+            else:
+                self.widget.itemconfig(self.item, image=image)
+        x, y = anim.frames[frame] if anim.atlas is not None else (0, 0)
+        self.widget.coords(self.item, -x, -y)
+
+
+RENDERERS = {'label': LabelView, 'canvas': CanvasView}
 
 # --- 2. 状态机 (State Machine) ---
 class PetState(Enum):
@@ -126,89 +2720,96 @@ class PetState(Enum):
     BYEBYE = "byebye"   # 新增
     FOLLOWING_MOUSE = "following_mouse"
 
-# --- 3. 核心类：桌面宠物 ---
-class DesktopPet:
+# 需要逐帧移动窗口的状态；其余状态下运动循环完全挂起
+MOTION_STATES = frozenset({PetState.MOVING, PetState.FALLING, PetState.FOLLOWING_MOUSE})
+TraceRecorder.STATES = list(PetState)
 
-    def __init__(self, master):
-        self.master = master
-        self.config = Config()  # 现在会自动加载 settings
-        self._setup_window()
-        self.characters = Config.load_characters()   # 所有角色
-        if not self.characters:
-            messagebox.showerror("配置错误", "config.json 中没有定义任何角色！")
-            sys.exit(1)
-        self.character_names = list(self.characters.keys())
+# --- 3. 宠物逻辑核心 (Pet Core) ---
+class PetCore:
+    """一只宠物的全部行为逻辑：位置、状态机、定时器、拖拽和随机动作。
+
+    不碰 Tk：位置写进 WindowGeometry 模型，定时器挂在共享 Scheduler 上，随机数
+    取自 world.rng。配上无 Tk 的 SimWorld 和手动时钟就能以远快于实时的速度模拟；
+    DesktopPet 在它上面只加窗口、控件和动画帧。
+    """
+
+    def __init__(self, world, geometry, char_name=None):
+        self.world = world
+        self.config = world.config  # 现在会自动加载 settings
+        self.trace_id = world.new_pet_id()
+        self.geometry = geometry
+        # 多只宠物错开出生位置
+        offset = (len(world.pets) % 10 - 5) * 60 if world.pets else 0
+        geometry.set(geometry.screen_w // 2 - 50 + offset, geometry.screen_h // 2 - 50, 100, 100)
+        self.characters = world.characters      # 所有角色
+        self.character_names = world.character_names
         self.current_char_idx = 0                    # 默认第一个角色
-        self.state_map = self.characters[self.character_names[0]]
+        if char_name in self.character_names:
+            self.current_char_idx = self.character_names.index(char_name)
+        self.state_map = self.characters[self.character_names[self.current_char_idx]]
         # 原 self.state 改名
         self.behavior_state = PetState.IDLE
         # 新增拖动开关
         self.dragging_flag = False
-        self.drag_start_pos = None   # 记录起点
         self.drag_moved = False      # 是否已“正式”拖动
-        self.drag_start_pos = None
-        self.animation_frames = []
-        self.current_frame_index = 0
-        self.current_gif_path = None
+        self.release_velocity = (0.0, 0.0)   # 松手时的速度（像素/秒）
+        # 调度器和指针跟踪由 world 在所有宠物间共享
+        self.scheduler = world.scheduler
+        self.pointer = world.pointer
         self.action_manager = ActionManager(self)
-        # 初始化鼠标位置（初始值不重要，后面会刷新）
-        self.last_mouse_pos = (0, 0)
-        self.mouse_idle_timer = None
+        # 拖拽样本与窗口移动
+        self.drag = DragTracker(self.scheduler, self.geometry, self.config.MOTION_INTERVAL_MS, owner=self)
+        self.mouse_idle_timer = self.scheduler.handle(self._on_mouse_idle, owner=self)
         self.is_following_mouse = False
         self.click_counter = 0          # 连点次数
-        self.click_reset_job = None     # 用于 1 秒内未点击就清零
-        self._setup_ui()
-        self._bind_events()
-        self._ensure_assets_dir()
-        self.load_animation()          # 这句原来就有
-        self.change_gif_by_state()     # 新增：第一次套壳
-        self._start_animation_loop()
-        self._start_update_loop()
-        self.action_manager.schedule_next_action()
-
+        self.click_reset_job = self.scheduler.handle(self._reset_click_counter, owner=self)  # 用于 1 秒内未点击就清零
         # >>> 新增：拖动计时器 <<<
-        self.drag_timer_job = None
+        self.drag_timer_job = self.scheduler.handle(self._on_long_drag, owner=self)
         self.long_drag_detected = False  # 是否已判定为长时间拖动
 
-    @property
-    def state(self):
-        """兼容老代码：外部仍可用 self.state 读取行为状态"""
-        return self.behavior_state
-
-    @state.setter
-    def state(self, value):
-        self.behavior_state = value
+    def start(self):
+        """开始运动/随机动作并登记到 world"""
+        self._resume_motion()
+        self.action_manager.schedule_next_action()
+        self.world.attach(self)
 
-    def _setup_window(self):
-        self.master.overrideredirect(True)
-        self.master.attributes("-topmost", True)
-        
-        try:
-            self.master.wm_attributes("-transparentcolor", "white")
-        except tk.TclError:
-            self.master.attributes("-transparent", True)
-            bg_color = 'systemTransparent' if sys.platform == "darwin" else 'white'
-            self.master.config(bg=bg_color)
-        
-        screen_width = self.master.winfo_screenwidth()
-        screen_height = self.master.winfo_screenheight()
-        self.master.geometry(f"100x100+{screen_width//2-50}+{screen_height//2-50}")
+    @property
+    def state(self):
+        """兼容老代码：外部仍可用 self.state 读取行为状态"""
+        return self.behavior_state
+
+    @state.setter
+    def state(self, value):
+        self.behavior_state = value
 
-    # --------------- DesktopPet 新增方法 ---------------
     def change_gif_by_state(self):
-        """按当前状态切换 GIF，找不到就保持原样"""
-        gif_path = self.state_map.get(self.state.value)
-        if gif_path and os.path.exists(gif_path):
-            self.load_animation(gif_path)
-        # 找不到就什么都不做，继续用上一张
+        """换图钩子：逻辑核心没有画面，由 DesktopPet 覆盖"""
+        return False
 
     def set_state(self, new_state: PetState):
-        """安全地切换状态并换图"""
+        """安全地切换状态并换图；离开某状态时取消挂在该状态下的定时器"""
         if self.state == new_state:
             return
+        self.scheduler.cancel_owner(self._state_owner(self.state))
+        if self.world.metrics is not None:
+            self.world.metrics.transitions[self.state.value, new_state.value] += 1
+        if self.world.trace is not None:
+            self.world.trace.state(self, self.state, new_state)
         self.state = new_state
         #print("[dbg]:",new_state)
         self.change_gif_by_state()
+        self._resume_motion()
+
+    def _state_owner(self, state):
+        """只在 state 期间有效的定时器分组"""
+        return (self, state)
+
+    def cancel_timers(self):
+        """取消这只宠物名下的全部定时器（移除宠物时调用）"""
+        self.scheduler.cancel_owner(self)
+        self.scheduler.cancel_owner((self, 'switch'))
+        for state in PetState:
+            self.scheduler.cancel_owner(self._state_owner(state))
 
     # 新增：切角色
     def switch_to_character(self, char_name: str):
@@ -218,10 +2819,12 @@ class DesktopPet:
         print(f"{self.current_char_idx}:ByeBye")
         # 保存目标
         self._pending_char = char_name
-        # 1. 立即进入 BYEBYE
+        # 1. 立即进入 BYEBYE，同时让目标角色的 idle 帧插队解码
         self.set_state(PetState.BYEBYE)
-        # 2. 2 秒后真正执行
-        self.master.after(2000, self._do_switch_character)
+        self.world.prefetch_character(char_name)
+        # 2. 2 秒后真正执行（拖拽打断告别也不影响切换）
+        self.scheduler.cancel_owner((self, 'switch'))
+        self.scheduler.call_later(2000, self._do_switch_character, owner=(self, 'switch'))
 
     def _do_switch_character(self):
         # 取出目标角色
@@ -229,59 +2832,34 @@ class DesktopPet:
         if target not in self.character_names:
             self.set_state(PetState.IDLE)          # 异常兜底
             return
+        # 帧还没解码完就等它就绪，不在 Tk 线程里同步解码
+        if not self.world.character_ready(target, self._do_switch_character):
+            return
         # 真正切换
         self.current_char_idx = self.character_names.index(target)
         self.state_map = self.characters[target]
         print(f"切换角色 -> {target}")
         self.set_state(PetState.IDLE)
 
-    def _setup_ui(self):
-        bg_color = 'systemTransparent' if sys.platform == "darwin" and 'systemTransparent' in self.master.config('bg') else 'white'
-        self.pet_label = tk.Label(self.master, bg=bg_color)
-        self.pet_label.pack()
-
-    def _bind_events(self):
-        self.pet_label.bind("<Button-1>", self._on_drag_start)
-        self.pet_label.bind("<ButtonRelease-1>", self._on_drag_release)
-        self.pet_label.bind("<B1-Motion>", self._on_drag_motion)
-        self.pet_label.bind("<Button-3>", self._show_context_menu)
-        # ↓↓↓ 新增：单独监听左键按下（触发连点计数）
-        self.pet_label.bind("<Button-1>", self._on_left_click, add="+")
-        # ✅ 使用 bind_all 确保全屏捕获鼠标移动
-        self.master.bind_all("<Motion>", self._on_mouse_move)
-
-    def _on_mouse_move(self, event):
-        # ✅ 使用 pointerx/pointery 获取屏幕绝对坐标
-        current_mouse_x = self.master.winfo_pointerx()
-        current_mouse_y = self.master.winfo_pointery()
-        screen_h = self.master.winfo_screenheight()
-
-        if current_mouse_y > screen_h:
-            current_mouse_y = screen_h
-
-        if (current_mouse_x, current_mouse_y) != self.last_mouse_pos:
-            self.last_mouse_pos = (current_mouse_x, current_mouse_y)
-            self._reset_mouse_idle_timer()
-            if self.is_following_mouse:
-                print("Mouse moved, stopping follow.")
-                self.is_following_mouse = False
-                if self.state == PetState.FOLLOWING_MOUSE:
-                    self.set_state(PetState.IDLE)
-                self.action_manager.schedule_next_action()
+    def _on_mouse_move(self, x, y):
+        """PointerTracker 回调（经 PetWorld 分发）：每帧至多一次，且位置确实变化"""
+        self._reset_mouse_idle_timer()
+        if self.is_following_mouse:
+            print("Mouse moved, stopping follow.")
+            self.is_following_mouse = False
+            if self.state == PetState.FOLLOWING_MOUSE:
+                self.set_state(PetState.IDLE)
+            self.action_manager.schedule_next_action()
 
     def _reset_mouse_idle_timer(self):
-        if self.mouse_idle_timer:
-            self.master.after_cancel(self.mouse_idle_timer)
-        self.mouse_idle_timer = self.master.after(self.config.MOUSE_IDLE_TIME_BEFORE_ACTION, self._on_mouse_idle)
+        # 只改截止时间，不重建 Tcl 定时器
+        self.mouse_idle_timer.rearm(self.config.MOUSE_IDLE_TIME_BEFORE_ACTION)
 
     def _on_mouse_idle(self):
         print("Follow")
         if self.state not in [PetState.DRAGGING, PetState.FALLING]:
             # ✅ 强制刷新为当前真实鼠标位置
-            current_mouse_x = self.master.winfo_pointerx()
-            current_mouse_y = self.master.winfo_pointery()
-            self.last_mouse_pos = (current_mouse_x, current_mouse_y)
-            
+            self.pointer.sample_now()
             self.is_following_mouse = True
             self.action_manager.follow_mouse()
 
@@ -295,9 +2873,7 @@ class DesktopPet:
             return
         self.click_counter += 1
         # 1 秒内无新点击就清零
-        if self.click_reset_job:
-            self.master.after_cancel(self.click_reset_job)
-        self.click_reset_job = self.master.after(1000, self._reset_click_counter)
+        self.click_reset_job.rearm(1000)
         # 达到 3 次 → 愤怒
         if self.click_counter >= 3:
             self._enter_angry()
@@ -309,142 +2885,85 @@ class DesktopPet:
         self.click_counter = 0
         self.action_manager.cancel_next_action()          # 取消之前排队的动作
         self.set_state(PetState.ANGRY)                     # 换图（走已有逻辑）
-        # 3 秒后自动退出
-        self.master.after(2000, lambda: self.set_state(PetState.IDLE))
-
-    def _ensure_assets_dir(self):
-        if not os.path.exists(self.config.ASSETS_DIR):
-            os.makedirs(self.config.ASSETS_DIR)
-            messagebox.showinfo("提示", f"已创建'{self.config.ASSETS_DIR}'文件夹，请将GIF文件放入其中。")
+        self._schedule_angry_recovery()
 
-    def _start_update_loop(self):
-        self.action_manager.update()
-        self.master.after(30, self._start_update_loop)
-
-    def _start_animation_loop(self):
-        if self.animation_frames:
-            self.current_frame_index = (self.current_frame_index + 1) % len(self.animation_frames)
-            current_frame_image = self.animation_frames[self.current_frame_index]
-            self.pet_label.config(image=current_frame_image)
-        self.master.after(self.config.DEFAULT_ANIMATION_SPEED, self._start_animation_loop)
-
-    def load_animation(self, gif_path=None):
-        if gif_path is None:
-            gif_files = glob.glob(os.path.join(self.config.ASSETS_DIR, '*.gif'))
-            if not gif_files:
-                self._create_default_pet_image()
-                return
-            gif_path = random.choice(gif_files)
-        try:
-            self.animation_frames = []
-            pil_image = Image.open(gif_path)
-            frame_one = pil_image.copy().convert('RGBA')
-            w, h = frame_one.size
-            self.master.geometry(f"{w}x{h}")
-            for frame in ImageSequence.Iterator(pil_image):
-                frame_image = ImageTk.PhotoImage(frame.copy().convert('RGBA'))
-                self.animation_frames.append(frame_image)
-            self.current_gif_path = gif_path
-            self.current_frame_index = 0
-            if self.animation_frames:
-                self.pet_label.config(image=self.animation_frames[0])
-        except Exception as e:
-            messagebox.showerror("加载错误", f"无法加载GIF文件 '{os.path.basename(gif_path)}'.\n错误: {e}")
-            self._create_default_pet_image()
+    def _schedule_angry_recovery(self):
+        """2 秒后回到 IDLE；提前离开 ANGRY 时由 set_state 一并取消"""
+        owner = self._state_owner(PetState.ANGRY)
+        self.scheduler.cancel_owner(owner)
+        self.scheduler.call_later(2000, self.set_state, PetState.IDLE, owner=owner)
 
-    def _create_default_pet_image(self):
-        w, h = 64, 64
-        self.master.geometry(f"{w}x{h}")
-        bg_color = 'systemTransparent' if sys.platform == "darwin" and 'systemTransparent' in self.master.config('bg') else 'white'
-        img = tk.PhotoImage(width=w, height=h)
-        if bg_color == 'white':
-            img.put(bg_color, to=(0, 0, w, h))
-        for x in range(w):
-            for y in range(h):
-                if (x-w/2)**2 + (y-h/2)**2 <= (w/2-2)**2:
-                    img.put("#ffcc00", (x, y))
-        self.animation_frames = [img]
-        self.pet_label.config(image=self.animation_frames[0])
+    def _resume_motion(self):
+        """进入运动状态时唤醒共享运动 tick；静止状态下它会自行挂起"""
+        if self.state in MOTION_STATES:
+            self.world.wake_motion()
 
     def _on_drag_start(self, event):
         # 记录拖动开始时鼠标的全局位置与窗口左上角的偏移
-        self.drag_start_pos = (event.x_root, event.y_root)
-        self.window_start_pos = (self.master.winfo_x(), self.master.winfo_y())
+        self.drag.begin(event.x_root, event.y_root)
         self.dragging_flag = False
         self.drag_moved = False
-        self.last_mouse_pos = (event.x_root, event.y_root)  # 用于速度计算
-        self.release_velocity = 0  # 初始释放速度为0
+        self.release_velocity = (0.0, 0.0)  # 初始释放速度为0
         self._reset_mouse_idle_timer() # 重置计时器
 
-        # >>> 新增：启动 3 秒计时器 <<<
+        # >>> 新增：启动 1 秒计时器 <<<
         self.long_drag_detected = False
-        self.drag_timer_job = self.master.after(1000, self._on_long_drag)
+        self.drag_timer_job.rearm(1000)
 
     def _on_drag_motion(self, event):
-        if self.drag_start_pos is None:
+        if not self.drag.pressed:
             return
-        # 当前鼠标全局位置
-        x_root, y_root = event.x_root, event.y_root
+        # 只记录样本，窗口在帧定时器里统一移动
+        self.drag.add_sample(event.x_root, event.y_root)
 
         # 首次超过阈值 → 正式进入拖动模式
-        dx_total = x_root - self.drag_start_pos[0]
-        dy_total = y_root - self.drag_start_pos[1]
-        dist = math.hypot(dx_total, dy_total)
-
-        if not self.dragging_flag and dist >= self.config.DRAG_THRESHOLD:
+        if not self.dragging_flag and self.drag.distance() >= self.config.DRAG_THRESHOLD:
             self.dragging_flag = True
             self.drag_moved = True
             self.action_manager.cancel_next_action()
 
         if self.dragging_flag:
-            # 计算新窗口位置（基于初始窗口位置 + 鼠标移动差）
-            new_x = self.window_start_pos[0] + (x_root - self.drag_start_pos[0])
-            new_y = self.window_start_pos[1] + (y_root - self.drag_start_pos[1])
-            self.master.geometry(f'+{int(new_x)}+{int(new_y)}')
-
-            # 更新最后位置用于速度估算
-            self.last_mouse_pos = (x_root, y_root)
+            self.drag.request_move()
 
     def _on_drag_release(self, event):
+        # 松手后长拖计时器不再有意义，避免它在下一次拖动中误触发
+        self.drag_timer_job.cancel()
         if not self.dragging_flag and not self.drag_moved:
             # 纯点击，不做任何事
-            self.drag_start_pos = None
-            self.window_start_pos = None
+            self.drag.end()
             return
 
+        # 松手点也算一个样本：停住再松手时速度自然趋近 0
+        self.drag.add_sample(event.x_root, event.y_root)
+        self.drag.request_move()
+        self.drag.end()
+        self.release_velocity = self.drag.velocity()
+
         # 标记结束拖动
         self.dragging_flag = False
         self.drag_moved = False
 
-        # 只有向下速度快或靠近底部边缘才触发掉落
-        current_x = self.master.winfo_x()
-        current_y = self.master.winfo_y()
-        pet_h = self.master.winfo_height()
-        pet_w = self.master.winfo_width()
-        screen_h = self.master.winfo_screenheight()
-        screen_w = self.master.winfo_screenwidth()
-
-        near_bottom = ((current_y + pet_h) > screen_h - self.config.fall_zoom_size) \
-                    or ((current_x + pet_w) > screen_w - self.config.fall_zoom_size) \
-                    or (current_y < self.config.fall_zoom_size) \
-                    or (current_x < self.config.fall_zoom_size)    # 距离边300像素内
-        
+        # 甩得够快或靠近屏幕边缘才触发掉落
+        near_bottom = self.geometry.near_edge(self.config.fall_zoom_size)    # 距离边 fall_zoom_size 像素内
+        # 释放速度（像素/秒）与 snap_speed_threshold、fall_velocity 同一单位
+        vx, vy = self.release_velocity
+        release_speed = math.hypot(vx, vy)
+        flung = release_speed >= self.config.SNAP_SPEED_THRESHOLD
+
         # >>> 判断是否为长时间拖动，决定是否愤怒 <<<
         if self.long_drag_detected:
             self._enter_angry_on_release()
         else:
-            # 否则按原逻辑判断是否掉落
-            if near_bottom:
-                self.set_state(PetState.FALLING)
-                # 初始下落速度设为释放时的垂直速度（归一化）
-                self.action_manager.fall_velocity = self.config.begin_fall_velocity
+            if flung:
+                # 朝甩出的方向掉落，初速度取释放速度
+                self.action_manager.start_fall(release_speed, (vx, vy))
+            elif near_bottom:
+                self.action_manager.start_fall(self.config.begin_fall_velocity)
             else:
                 if self.state != PetState.ANGRY and self.state != PetState.BYEBYE:
                     self.set_state(PetState.IDLE)
                     self.action_manager.schedule_next_action()
 
-        self.drag_start_pos = None
-        self.window_start_pos = None
         self._reset_mouse_idle_timer() # 重置计时器
 
     def _on_long_drag(self):
@@ -458,56 +2977,466 @@ class DesktopPet:
         self.set_state(PetState.ANGRY)
         print("宠物生气了！被拖太久！")
         # 2秒后恢复
-        self.master.after(2000, lambda: self.set_state(PetState.IDLE))
+        self._schedule_angry_recovery()
+
+    def _menu(self, action, arg=''):
+        """菜单命令统一从这里执行，便于记录和回放"""
+        if self.world.trace is not None:
+            self.world.trace.menu(self, action, arg)
+        if action == 'switch':
+            self.switch_to_character(arg)
+        elif action == 'add':
+            self.world.add_pet(arg)
+        elif action == 'remove':
+            self.world.remove_pet(self)
+
+# --- 3.1 桌面宠物窗口 (Tk Renderer) ---
+class DesktopPet(PetCore):
+    """PetCore 的 Tk 外壳：无边框置顶窗口、显示动画帧的 Label、事件绑定和右键菜单"""
+
+    def __init__(self, master, world=None, char_name=None):
+        self.master = master
+        # 单宠物模式下自己建一个共享上下文；多宠物模式由 PetWorld.add_pet 传入
+        world = world if world is not None else PetWorld(master)
+        self._setup_window()
+        PetCore.__init__(self, world, WindowGeometry(master), char_name)
+        self.animation = Animation([], (0, 0))
+        self.animation_frames = []
+        self.animation_sequence = []
+        self.sprite_offset = (0, 0)   # 当前帧裁剪区域在原画布中的偏移
+        self.current_frame_index = 0
+        self.current_gif_path = None
+        # 帧缓存、后台加载器由 PetWorld 在所有宠物间共享
+        self.frame_cache = world.frame_cache
+        self.asset_loader = world.asset_loader
+        # 动画由 PetWorld 的共享时钟驱动，静止时不唤醒
+        self.animation_loop = 0
+        self._loops_done = 0
+        self._animating = False
+        self._frame_s = []            # 每个播放位置的时长（秒）
+        self._loop_s = 0.0
+        self._next_frame_at = 0.0     # 下一帧的截止时间（调度器时钟）
+        self._wake_due = None         # 在 PetWorld 动画堆里登记的截止时间
+        self._decode = None           # 进行中的 ProgressiveDecode
+        self._decode_hooks = ()       # 交给它的 (on_frames, on_done)，退订时用
+        self._partial = None          # 正在显示的渐进解码中的动画，解完后换成缓存里的成品
+        self._setup_ui()
+        self._bind_events()
+        # 外部移动/缩放窗口时同步本地几何模型
+        self.master.bind("<Configure>", self.geometry.on_configure, add="+")
+        _startup_mark("窗口与控件")
+        # 直接加载当前状态的 GIF；没有可用资源时才画占位图（工作线程正在解码时等它，不闪占位图）
+        if self.change_gif_by_state() is False and not self.animation_frames:
+            self._create_default_pet_image()
+        _startup_mark("首帧解码")
+        self.start()
+
+    def _setup_window(self):
+        self.master.overrideredirect(True)
+        self.master.attributes("-topmost", True)
+        
+        try:
+            self.master.wm_attributes("-transparentcolor", "white")
+        except tk.TclError:
+            self.master.attributes("-transparent", True)
+            bg_color = 'systemTransparent' if sys.platform == "darwin" else 'white'
+            self.master.config(bg=bg_color)
+
+    # --------------- DesktopPet 新增方法 ---------------
+    def change_gif_by_state(self):
+        """按当前状态切换 GIF，没有对应的图就保持原样。
+        返回 True 表示换了图，None 表示帧还在解码、就绪后自动换上，False 表示没有可用的图"""
+        # 角色表里只有确认存在的文件（见 CharacterIndex.merge），这里不再逐次 stat
+        gif_path = self.state_map.get(self.state.value)
+        if gif_path:
+            return self.load_animation(gif_path)
+        # 没有就什么都不做，继续用上一张
+        return False
+
+    def reload_animation(self):
+        """热更新后重新加载当前 GIF；等后台解码完再换帧，不在 Tk 线程里同步解码"""
+        gif_path = self.state_map.get(self.state.value) or self.current_gif_path
+        if gif_path and ASSET_FS.exists(gif_path):
+            self.asset_loader.request(gif_path, priority=0, callback=self._refresh_animation)
+
+    def _refresh_animation(self):
+        if self not in self.world.pets:
+            return
+        gif_path = self.state_map.get(self.state.value) or self.current_gif_path
+        if gif_path and ASSET_FS.exists(gif_path):
+            self.load_animation(gif_path)
+
+    def _setup_ui(self):
+        bg_color = 'systemTransparent' if sys.platform == "darwin" and 'systemTransparent' in self.master.config('bg') else 'white'
+        self.view = RENDERERS[self.config.RENDERER](self.master, bg_color)
+        self.pet_label = self.view.widget
+
+    def rebuild_view(self):
+        """renderer 设置变了：换掉显示控件并重新绑定事件，帧由调用方重新加载"""
+        self.pet_label.destroy()
+        self._setup_ui()
+        self._bind_events()
+
+    def _bind_events(self):
+        T = TraceRecorder
+        self.pet_label.bind("<Button-1>", self._traced(T.PRESS, self._on_drag_start))
+        self.pet_label.bind("<ButtonRelease-1>", self._traced(T.RELEASE, self._on_drag_release))
+        self.pet_label.bind("<B1-Motion>", self._traced(T.MOTION, self._on_drag_motion))
+        self.pet_label.bind("<Button-3>", self._traced(T.RCLICK, self._show_context_menu))
+        # ↓↓↓ 新增：单独监听左键按下（触发连点计数）
+        self.pet_label.bind("<Button-1>", self._on_left_click, add="+")
+
+    def _advance_frame(self, now):
+        """共享动画时钟的一拍：换到 now 时刻应显示的帧，返回下一帧的截止时间；不再需要拍子时返回 None。
+
+        截止时间由上一帧的截止时间加上帧时长得到，tick 迟到不会让动画越放越慢；
+        落后时直接跳到此刻应显示的帧，跳过的帧计入 world.dropped_frames。
+        """
+        if not self._animating:
+            return None
+        due = self._next_frame_at
+        if now < due:
+            return due
+        sequence = self.animation_sequence
+        frame_s = self._frame_s
+        n = len(sequence)
+        index = self.current_frame_index
+        previous = sequence[index]
+        steps = 0
+        if not self.animation_loop and now - due > self._loop_s:
+            # 落后超过一整圈（如系统休眠）：整圈跳过，不逐帧追赶
+            loops = int((now - due) // self._loop_s)
+            due += loops * self._loop_s
+            steps += loops * n
+        while due <= now:
+            index += 1
+            if index == n:
+                self._loops_done += 1
+                if self.animation_loop and self._loops_done >= self.animation_loop:
+                    index = n - 1     # 有限循环的 GIF 播完后停在最后一帧
+                    self._animating = False
+                    break
+                index = 0
+            due += frame_s[index]
+            steps += 1
+        self.current_frame_index = index
+        self._next_frame_at = due
+        if steps > 1:
+            self.world.dropped_frames += steps - 1
+        if sequence[index] != previous:     # 去重后的停顿帧不用重设图片
+            self.view.show(self.animation, sequence[index])
+        return due if self._animating else None
+
+    def _resume_animation(self):
+        """换图后重新开始计帧；只有一张不同画面时不需要动画时钟"""
+        self._loops_done = 0
+        self._animating = len(self.animation_frames) > 1
+        if self._animating:
+            self._frame_s = self._sequence_seconds()
+            self._loop_s = sum(self._frame_s)
+            self._next_frame_at = self.world.scheduler.clock() + self._frame_s[self.current_frame_index]
+            self.world.wake_animation(self, self._next_frame_at)
+
+    def retime_animation(self):
+        """animation_speed 变了：重算帧时长，当前帧不变，下一帧从这一帧显示的时刻起按新时长算"""
+        if not self._animating:
+            return
+        frame_s = self._sequence_seconds()
+        if frame_s == self._frame_s:
+            return
+        index = self.current_frame_index
+        shown_at = self._next_frame_at - self._frame_s[index]
+        self._frame_s = frame_s
+        self._loop_s = sum(frame_s)
+        self._next_frame_at = shown_at + frame_s[index]
+        self.world.wake_animation(self, self._next_frame_at)
+
+    def _sequence_seconds(self):
+        durations = self.animation.durations
+        if len(durations) != len(self.animation_sequence):
+            durations = [0] * len(self.animation_sequence)
+        return self._frame_seconds(durations)
+
+    def _frame_seconds(self, durations):
+        # GIF 没写帧时长或不超过 10 ms 时按 animation_speed 处理（与浏览器的做法一致）
+        fallback = self.config.DEFAULT_ANIMATION_SPEED
+        return [(ms if ms > 10 else fallback) / 1000 for ms in durations]
+
+    def load_animation(self, gif_path):
+        """显示 gif_path 的动画（优先取帧缓存，未命中时先显示第一帧、其余边解边放）。
+        成功返回 True；工作线程正在解码它、就绪后由 _refresh_animation 换上时返回 None；失败返回 False"""
+        metrics = self.world.metrics
+        started = time.perf_counter() if metrics is not None else 0.0
+        try:
+            scale = self.config.SPRITE_SCALE
+            key = FrameCache.make_key(gif_path, scale)
+            anim = self.frame_cache.get(key)
+            decode = self._decode
+            if decode is not None and (anim is not None or decode.key != key):
+                self._stop_decode()           # 新的状态用不到它了
+                decode = None
+            if anim is None:
+                anim = decode.partial if decode is not None else self._decode_gif(gif_path, key, scale)
+                if anim is None:
+                    return None               # 工作线程正在解码，就绪后由 _refresh_animation 换上
+            self._partial = self._decode.partial if self._decode is not None else None
+            self._place_sprite(anim)
+            self.animation = anim
+            self.animation_frames = anim.frames
+            self.animation_sequence = anim.sequence
+            self.animation_loop = anim.loop
+            self.current_gif_path = gif_path
+            self.current_frame_index = 0
+            if self.animation_frames:
+                self.view.show(anim, self.animation_sequence[0])
+                self.world.report_first_frame()
+            self._resume_animation()
+            memory = self.world.memory
+            memory.note_use(self, gif_path)
+            memory.enforce()
+            if metrics is not None:
+                metrics.load_animation.observe((time.perf_counter() - started) * 1000)
+            return True
+        except Exception as e:
+            messagebox.showerror("加载错误", f"无法加载GIF文件 '{os.path.basename(gif_path)}'.\n错误: {e}")
+            self._create_default_pet_image()
+            return False
+
+    def swap_frames(self, anim):
+        """换上同一 GIF 的另一份帧（内存预算抽帧），播放位置和窗口都不变"""
+        self.animation = anim
+        self.animation_frames = anim.frames
+        self.animation_sequence = anim.sequence
+        if anim.frames:
+            self.current_frame_index %= len(anim.sequence)
+            self.view.show(anim, anim.sequence[self.current_frame_index])
+
+    def _place_sprite(self, anim):
+        """窗口只有裁剪后的大小；按裁剪偏移的变化平移窗口，让人物在屏幕上不跳动"""
+        ox, oy = anim.offset
+        px, py = self.sprite_offset
+        if (ox, oy) != (px, py):
+            geom = self.geometry
+            geom.set(geom.x + ox - px, geom.y + oy - py, *anim.size)
+        else:
+            self.geometry.resize(*anim.size)
+        self.sprite_offset = anim.offset
+
+    def _decode_gif(self, gif_path, key, scale=1.0):
+        """预加载未命中时的兜底：磁盘缓存命中就整段转换；否则渐进解码，先返回只有第 0 帧的动画。
+        录制轨迹和回放（asset_workers=0）时仍同步完整解码：渐进解码时窗口大小和动画定时器
+        取决于解码快慢，轨迹就无法逐条重放"""
+        loader = self.asset_loader
+        disk_cache = self.world.sprite_cache
+        anim = disk_cache.load(gif_path, scale) if disk_cache is not None else None
+        if anim is None and loader.workers and self.world.trace is None:
+            hooks = (lambda: self._on_frames(decode), lambda: self._on_decoded(decode))
+            decode = loader.stream(gif_path, *hooks)
+            if decode is None:
+                loader.request(gif_path, priority=0, callback=self._refresh_animation)
+                return None
+            self._decode, self._decode_hooks = decode, hooks
+            return decode.partial
+        if anim is None:
+            anim = load_gif_frames(gif_path, scale, disk_cache)
+        anim = tk_animation(anim, loader.atlas)
+        self.frame_cache.put(key, anim)
+        return anim
+
+    def _on_frames(self, decode):
+        """渐进解码追加了帧：在已有的帧里接着循环，第二帧到了才开始走动画时钟"""
+        if self.animation is not decode.partial:
+            return
+        if self._animating:
+            self._frame_s.extend(self._frame_seconds(decode.partial.durations[len(self._frame_s):]))
+            self._loop_s = sum(self._frame_s)
+        else:
+            self._resume_animation()
+
+    def _on_decoded(self, decode):
+        """成品帧已进缓存：还在显示这次解码的动画时换上去（带循环次数和裁边），播放位置不变"""
+        if self._decode is decode:
+            self._decode = None
+        if self._partial is not decode.partial or self not in self.world.pets:
+            return
+        self._partial = None
+        anim = self.frame_cache.get(decode.key)
+        if anim is None:
+            return
+        self._place_sprite(anim)
+        self.animation_loop = anim.loop
+        self._loops_done = 0
+        self.swap_frames(anim)
+
+    def _stop_decode(self):
+        """不再等这次渐进解码（别的宠物或等待者还要它时由 AssetLoader 继续解）"""
+        decode, self._decode = self._decode, None
+        if decode is not None:
+            self.asset_loader.release(decode, *self._decode_hooks)
+
+    def cancel_timers(self):
+        super().cancel_timers()
+        self._wake_due = None         # 动画堆里的旧登记随之作废
+        self._stop_decode()
+
+    def _create_default_pet_image(self):
+        w, h = 64, 64
+        self.geometry.resize(w, h)
+        bg_color = 'systemTransparent' if sys.platform == "darwin" and 'systemTransparent' in self.master.config('bg') else 'white'
+        # 用 PIL 一次画好整张图再转成 PhotoImage，不再逐像素 put
+        from PIL import ImageDraw
+        canvas = Image.new("RGBA", (w, h), (255, 255, 255, 255) if bg_color == 'white' else (0, 0, 0, 0))
+        ImageDraw.Draw(canvas).ellipse((2, 2, w - 2, h - 2), fill="#ffcc00")
+        self.animation = tk_animation(Animation([canvas], (w, h)), self.asset_loader.atlas)
+        self.animation_frames = self.animation.frames
+        self.animation_sequence = [0]
+        self.animation_loop = 0
+        self.current_frame_index = 0
+        self.view.show(self.animation, 0)
+        self._resume_animation()
+
+    def _traced(self, kind, handler):
+        """开启轨迹记录时给事件处理函数套一层记录；关闭时原样返回，没有额外开销"""
+        trace = self.world.trace
+        if trace is None:
+            return handler
+
+        def traced(event):
+            trace.input(kind, self.trace_id, event.x_root, event.y_root)
+            return handler(event)
+        return traced
 
     def _show_context_menu(self, event):
-        menu = Menu(self.master, tearoff=0)
-        # 新增子菜单：选择角色
-        char_menu = Menu(menu, tearoff=0)
-        for name in self.character_names:
-            # 命令里用 lambda 默认参数锁定当前名字
-            char_menu.add_command(label=name,
-                                command=lambda n=name: self.switch_to_character(n))
-        menu.add_cascade(label="选择角色", menu=char_menu)
-
-        menu.add_separator()
-        menu.add_command(label="退出", command=self.master.quit)
-        menu.post(event.x_root, event.y_root)
+        self.world.show_context_menu(self, event.x_root, event.y_root)
+
+    def _show_stats(self):
+        sched = self.scheduler.stats()
+        cache = self.frame_cache.stats()
+        geoms = [pet.geometry for pet in self.world.pets]
+        memory = self.world.memory.footprint()
+        budget = f"{memory['budget'] / 1048576:g} MB" if memory['budget'] else "不限"
+        top = sorted(((c['bytes'], name) for name, c in memory['characters'].items()), reverse=True)[:5]
+        details = "".join(f"\n  {name}: {nbytes / 1048576:.1f} MB" for nbytes, name in top)
+        messagebox.showinfo("运行状态",
+                            f"宠物数量: {len(self.world.pets)}\n"
+                            f"唤醒次数/秒: {sched['wakeups_per_sec']}\n"
+                            f"待触发定时器: {sched['pending']}\n"
+                            f"窗口 Tk 调用: {sum(g.tk_calls for g in geoms)}, "
+                            f"最近一帧最多 {max((g.last_tick_calls for g in geoms), default=0)}\n"
+                            f"动画丢帧: {self.world.dropped_frames}\n"
+                            f"帧缓存: {cache['entries']} 个 GIF, {cache['bytes'] / 1048576:.1f} MB, "
+                            f"命中 {cache['hits']} / 未命中 {cache['misses']}\n"
+                            f"已解码帧: {memory['bytes'] / 1048576:.1f} MB / 预算 {budget}, "
+                            f"淘汰 {memory['evictions']}, 抽帧 {memory['thinned']}{details}")
+
+# --- 3.2 右键菜单 (Context Menu) ---
+class ContextMenu:
+    """所有宠物共用的一个右键菜单：只创建一次，角色表变化时才重建角色子菜单。
+
+    菜单弹出前记下目标宠物，命令经 DesktopPet._menu 执行（便于记录和回放）。
+    角色多于 PAGE_SIZE 时按名单顺序分页成若干级联子菜单；每项带 ThumbnailLoader
+    在后台生成的小图，还没生成好的先只显示文字，生成后原地补上。
+    """
+    PAGE_SIZE = 25
+
+    def __init__(self, world):
+        self.world = world
+        self.target = None
+        self.builds = 0                 # 角色子菜单的重建次数
+        self._names = None              # 上次构建时的角色名单
+        self._entries = {}              # 角色名 -> [(菜单, 下标)]
+        self._pages = []                # 分页时创建的子菜单，重建时销毁
+        self.menu = Menu(world.root, tearoff=0)
+        self.switch_menu = Menu(self.menu, tearoff=0)
+        self.add_menu = Menu(self.menu, tearoff=0)
+        self.menu.add_cascade(label="选择角色", menu=self.switch_menu)
+        # 多宠物：同一进程里再开一个窗口，或移除当前这只
+        self.menu.add_cascade(label="添加角色", menu=self.add_menu)
+        self.menu.add_command(label="移除此角色", command=lambda: self._run('remove'))
+        self.menu.add_separator()
+        self.menu.add_command(label="运行状态", command=lambda: self._run('stats'))
+        self.menu.add_command(label="退出", command=world.root.quit)
+
+    def post(self, pet, x, y):
+        self.target = pet
+        if tuple(self.world.character_names) != self._names:
+            self._rebuild()
+        self.menu.post(x, y)
+
+    def set_thumbnail(self, name, photo):
+        for menu, index in self._entries.get(name, ()):
+            menu.entryconfigure(index, image=photo, compound='left')
+
+    def _run(self, action, arg=''):
+        pet = self.target
+        if pet is None or pet not in self.world.pets:
+            return
+        if action == 'stats':
+            pet._show_stats()
+        else:
+            pet._menu(action, arg)
+
+    def _rebuild(self):
+        names = self._names = tuple(self.world.character_names)
+        self.builds += 1
+        self._entries = {}
+        for page in self._pages:
+            page.destroy()
+        self._pages = []
+        for parent, action in ((self.switch_menu, 'switch'), (self.add_menu, 'add')):
+            parent.delete(0, 'end')
+            if len(names) <= self.PAGE_SIZE:
+                self._add_entries(parent, names, action)
+                continue
+            for i in range(0, len(names), self.PAGE_SIZE):
+                chunk = names[i:i + self.PAGE_SIZE]
+                page = Menu(parent, tearoff=0)
+                self._pages.append(page)
+                parent.add_cascade(label=f"{chunk[0]} … {chunk[-1]}", menu=page)
+                self._add_entries(page, chunk, action)
+
+    def _add_entries(self, menu, names, action):
+        thumbnails = self.world.thumbnails
+        for index, name in enumerate(names):
+            # 命令里用默认参数锁定当前名字
+            menu.add_command(label=name, command=lambda n=name: self._run(action, n))
+            self._entries.setdefault(name, []).append((menu, index))
+            photo = thumbnails.get(name)
+            if photo is not None:
+                menu.entryconfigure(index, image=photo, compound='left')
 
 # --- 4. 行为管理器 (Decoupled Action Manager) ---
 class ActionManager:
-    def __init__(self, pet:DesktopPet):
-        self.pet:DesktopPet = pet
-        self.master = pet.master
+
+    def __init__(self, pet:PetCore):
+        self.pet:PetCore = pet
+        self.geom = pet.geometry
+        self.rng = pet.world.rng   # 注入的随机数发生器，便于记录与回放
         self.target_pos = None
-        self.scheduled_action = None
-        self.fall_velocity = 0 # 用于计算掉落速度
+        self.scheduled_action = pet.scheduler.handle(self.perform_random_action, owner=pet)
+        self.fall_velocity = 0 # 掉落初速度（像素/秒）
+        self.fall_edge = None  # 甩出时指定的吸附边；None 表示最近的边
+        self.trajectory = None # 当前运动预先算好的逐帧坐标
+        self._last_step = None # 上一帧写入的位置，用来发现拖拽等外部移动
 
     def follow_mouse(self):
         self.cancel_next_action()
         self.pet.set_state(PetState.FOLLOWING_MOUSE)
         print("Pet is now following mouse.")
+        self.trajectory = None
         self._set_mouse_target_pos()
 
     def _set_mouse_target_pos(self):
         """计算宠物应该移动到的鼠标中心位置（终极加固版）"""
-        # ✅ 直接获取实时鼠标位置，不依赖 last_mouse_pos
-        mouse_x = self.pet.master.winfo_pointerx()
-        mouse_y = self.pet.master.winfo_pointery()
-        
-        self.master.update_idletasks()
-
-        pet_w = self.master.winfo_width()
-        pet_h = self.master.winfo_height()
-        screen_w = self.master.winfo_screenwidth()
-        screen_h = self.master.winfo_screenheight()
-
-        # 保护默认尺寸
-        if pet_w <= 1:
-            pet_w = 64
-        if pet_h <= 1:
-            pet_h = 64
+        # ✅ 使用 PointerTracker 的最新样本，不再每帧查询指针
+        mouse_x, mouse_y = self.pet.pointer.pos
+        if mouse_x is None:
+            mouse_x, mouse_y = self.pet.pointer.sample_now()
 
+        # 尺寸和屏幕边界来自本地模型（已带默认尺寸保护）
+        geom = self.geom
+        pet_w, pet_h = geom.pet_w, geom.pet_h
+        screen_w, screen_h = geom.screen_w, geom.screen_h
 
         # 限制坐标在屏幕范围内
         mouse_x = max(0, min(mouse_x, screen_w))
@@ -524,43 +3453,28 @@ class ActionManager:
 
         self.target_pos = (target_x, target_y)
 
-    def _move_to_mouse_target(self):
-        """使宠物移动到鼠标目标位置"""
-        # ✅ 每次都重新计算目标位置（实时跟随）
-        self._set_mouse_target_pos()
-        if not self.target_pos:
-            return
-
-        current_x = self.master.winfo_x()
-        current_y = self.master.winfo_y()
-
-        dx = self.target_pos[0] - current_x
-        dy = self.target_pos[1] - current_y
-        distance = math.hypot(dx, dy)
-
-        if distance < self.pet.config.MOUSE_FOLLOW_SPEED:
-            self.master.geometry(f"+{self.target_pos[0]}+{self.target_pos[1]}")
-            self.pet.set_state(PetState.IDLE)
-            print("✅ 宠物已到达鼠标位置，停止跟随。")
-        else:
-            angle = math.atan2(dy, dx)
-            move_x = self.pet.config.MOUSE_FOLLOW_SPEED * math.cos(angle)
-            move_y = self.pet.config.MOUSE_FOLLOW_SPEED * math.sin(angle)
-            new_x = round(current_x + move_x)
-            new_y = round(current_y + move_y)
-            self.master.geometry(f"+{new_x}+{new_y}")
+    def start_fall(self, velocity, direction=None):
+        """进入掉落；direction=(vx, vy) 时朝该方向的主轴边缘吸附"""
+        self.pet.set_state(PetState.FALLING)
+        self.fall_velocity = velocity
+        self.fall_edge = None
+        self.trajectory = None
+        if direction is not None:
+            vx, vy = direction
+            if abs(vx) > abs(vy):
+                self.fall_edge = 'right' if vx > 0 else 'left'
+            else:
+                self.fall_edge = 'bottom' if vy > 0 else 'top'
 
     def schedule_next_action(self):
         if self.pet.is_following_mouse:
             return
         self.cancel_next_action()
-        interval = random.randint(self.pet.config.ACTION_INTERVAL_MIN, self.pet.config.ACTION_INTERVAL_MAX)
-        self.scheduled_action = self.master.after(interval, self.perform_random_action)
+        interval = self.rng.randint(self.pet.config.ACTION_INTERVAL_MIN, self.pet.config.ACTION_INTERVAL_MAX)
+        self.scheduled_action.rearm(interval)
 
     def cancel_next_action(self):
-        if self.scheduled_action:
-            self.master.after_cancel(self.scheduled_action)
-            self.scheduled_action = None
+        self.scheduled_action.cancel()
 
     def perform_random_action(self):
         # 只要正在拖动，就不执行任何随机行为
@@ -577,19 +3491,72 @@ class ActionManager:
         # 确保在安全的状态下执行随机行为
         if self.pet.state not in [PetState.DRAGGING, PetState.FALLING]:
             actions = {self.idle: 0.6, self.wander: 0.4}
-            chosen_action = random.choices(list(actions.keys()), weights=list(actions.values()), k=1)[0]
+            chosen_action = self.rng.choices(list(actions.keys()), weights=list(actions.values()), k=1)[0]
             chosen_action()
         
         self.schedule_next_action()
 
-    def update(self):
-        """在主循环中被调用，用于更新需要持续进行的行为"""
-        if self.pet.state == PetState.MOVING:
-            self._move_towards_target()
-        elif self.pet.state == PetState.FALLING:
-            self._apply_gravity()
-        elif self.pet.state == PetState.FOLLOWING_MOUSE:
-            self._move_to_mouse_target()
+    def update(self, frames=1):
+        """单只宠物的一帧：准备轨迹并前进 frames 步（PetWorld 里由 TrajectoryBatch 批量推进）"""
+        traj = self.prepare_tick()
+        if traj is not None:
+            self.apply_step(*traj.step(frames))
+
+    def prepare_tick(self):
+        """返回本帧要推进的轨迹；刚开始运动、跟随目标变化或窗口被外部移动时才重新预计算"""
+        state = self.pet.state
+        if state not in MOTION_STATES:
+            return None
+        traj = self.trajectory
+        if state == PetState.FOLLOWING_MOUSE:
+            self._set_mouse_target_pos()
+            if traj is not None and traj.target != self.target_pos:
+                traj = None
+        if traj is not None and (traj.kind is not state
+                                 or self._last_step != (round(self.geom.x), round(self.geom.y))):
+            traj = None
+        if traj is None:
+            if state == PetState.MOVING and not self.target_pos:
+                self.pet.set_state(PetState.IDLE)
+                return None
+            traj = self._build_trajectory(state)
+        self.trajectory = traj
+        return traj
+
+    def _build_trajectory(self, state):
+        cfg = self.pet.config
+        frame_s = cfg.MOTION_INTERVAL_MS / 1000
+        start = (self.geom.x, self.geom.y)   # 从带小数的模型位置继续，不丢掉上一段的亚像素余量
+        if state == PetState.MOVING:
+            return Trajectory.linear(start, self.target_pos, cfg.DEFAULT_MOVEMENT_SPEED, frame_s, state)
+        if state == PetState.FOLLOWING_MOUSE:
+            return Trajectory.linear(start, self.target_pos, cfg.MOUSE_FOLLOW_SPEED, frame_s, state)
+        return Trajectory.fall(start, self._snap_target(), self.fall_velocity, cfg.GRAVITY,
+                               cfg.MAX_FALL_SPEED, cfg.EDGE_SNAP_MARGIN, frame_s, state)
+
+    def apply_step(self, x, y, done):
+        geom = self.geom
+        calls = geom.tk_calls
+        geom.move_to(x, y)
+        geom.last_tick_calls = geom.tk_calls - calls
+        self._last_step = (round(x), round(y))
+        if done:
+            self._finish_trajectory()
+
+    def _finish_trajectory(self):
+        kind = self.trajectory.kind
+        self.trajectory = None
+        if kind == PetState.MOVING:
+            self.idle()
+        elif kind == PetState.FALLING:
+            # 已贴边→结束
+            self.pet.set_state(PetState.IDLE)
+            self.schedule_next_action()
+            self.fall_velocity = 0
+            self.fall_edge = None
+        else:
+            self.pet.set_state(PetState.IDLE)
+            print("✅ 宠物已到达鼠标位置，停止跟随。")
 
     def idle(self):
         print("Action: Idle")
@@ -599,34 +3566,17 @@ class ActionManager:
     def wander(self):
         print("Action: Wander")
         self.pet.set_state(PetState.MOVING)
-        screen_w, screen_h = self.master.winfo_screenwidth(), self.master.winfo_screenheight()
-        pet_w, pet_h = self.master.winfo_width(), self.master.winfo_height()
-        self.target_pos = (random.randint(0, screen_w - pet_w), random.randint(0, screen_h - pet_h))
+        screen_w, screen_h = self.geom.screen_w, self.geom.screen_h
+        pet_w, pet_h = self.geom.w, self.geom.h
+        self.target_pos = (self.rng.randint(0, screen_w - pet_w), self.rng.randint(0, screen_h - pet_h))
+        self.trajectory = None
 
-    def _move_towards_target(self):
-        if not self.target_pos:
-            self.pet.set_state(PetState.IDLE)
-            return
-        current_pos = (self.master.winfo_x(), self.master.winfo_y())
-        dx, dy = self.target_pos[0] - current_pos[0], self.target_pos[1] - current_pos[1]
-        distance = math.hypot(dx, dy)
-        if distance < self.pet.config.DEFAULT_MOVEMENT_SPEED:
-            self.master.geometry(f"+{self.target_pos[0]}+{self.target_pos[1]}")
-            self.idle()
-        else:
-            angle = math.atan2(dy, dx)
-            move_x = self.pet.config.DEFAULT_MOVEMENT_SPEED * math.cos(angle)
-            move_y = self.pet.config.DEFAULT_MOVEMENT_SPEED * math.sin(angle)
-            new_pos = (round(current_pos[0] + move_x), round(current_pos[1] + move_y))
-            self.master.geometry(f"+{new_pos[0]}+{new_pos[1]}")
-            
-    def _apply_gravity(self):
-        """重力→吸附到最近屏幕边缘"""
-        screen_w = self.master.winfo_screenwidth()
-        screen_h = self.master.winfo_screenheight()
-        pet_w = self.master.winfo_width()
-        pet_h = self.master.winfo_height()
-        x, y = self.master.winfo_x(), self.master.winfo_y()
+    def _snap_target(self):
+        """掉落开始时确定吸附点：甩出方向的边，否则最近的屏幕边"""
+        geom = self.geom
+        screen_w, screen_h = geom.screen_w, geom.screen_h
+        pet_w, pet_h = geom.w, geom.h
+        x, y = round(geom.x), round(geom.y)
 
         # 1. 计算到四条边的距离
         dist_left = x
@@ -639,48 +3589,782 @@ class ActionManager:
             (dist_top, 'top'),
             (dist_bottom, 'bottom')
         )
+        if self.fall_edge is not None:
+            edge = self.fall_edge
 
         # 2. 目标吸附坐标
         if edge == 'left':
-            target_x, target_y = 0, y
+            return 0, y
         elif edge == 'right':
-            target_x, target_y = screen_w - pet_w, y
+            return screen_w - pet_w, y
         elif edge == 'top':
-            target_x, target_y = x, 0
+            return x, 0
         else:  # bottom
-            target_x, target_y = x, screen_h - pet_h
+            return x, screen_h - pet_h
 
-        # 3. 水平/垂直方向速度（统一用 fall_velocity 变量）
-        dx = target_x - x
-        dy = target_y - y
-        distance = math.hypot(dx, dy)
 
-        if distance < self.pet.config.EDGE_SNAP_MARGIN:
-            # 已贴边→结束
-            self.master.geometry(f"+{target_x}+{target_y}")
-            self.pet.set_state(PetState.IDLE)
-            self.schedule_next_action()
-            self.fall_velocity = 0
+# --- 5. 多宠物共享上下文 (Pet World) ---
+class SimPointer:
+    """无界面模拟用的指针：位置由驱动脚本直接设置"""
+
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+    @property
+    def pos(self):
+        return self.x, self.y
+
+    def sample_now(self, notify=False):
+        return self.pos
+
+
+class SimWorld:
+    """宠物逻辑的共享上下文：调度器、随机数、指针和共享运动 tick，不依赖 Tk。
+
+    直接使用时宠物是纯 PetCore，调度器由 Scheduler.advance 手动推进；
+    PetWorld 在此基础上加上窗口、素材加载、动画时钟、热更新和指标。
+    """
+    MAX_CATCHUP_MS = 250   # tick 迟到时最多补走这么久的运动，再长的卡顿（如系统休眠）直接跳过
+
+    def __init__(self, config, characters, scheduler, rng=None, trace=None, screen=(1920, 1080)):
+        self.config = config
+        self.characters = characters
+        self.character_names = list(characters.keys())
+        self.screen = screen
+        self.pets = []
+        self.pet_seq = 0                 # 宠物编号（轨迹里用来区分宠物）
+        self.scheduler = scheduler
+        # 操作轨迹：开启时 ActionManager 的随机抽样也要经过记录
+        self.trace = trace
+        if trace is not None:
+            scheduler.trace = trace
+        self.rng = rng if rng is not None else RecordingRandom(trace) if trace is not None else random.Random()
+        self.pointer = SimPointer(screen[0] // 2, screen[1] // 2)
+        self.metrics = None
+        self.trajectories = TrajectoryBatch()
+        self.motion_timer = scheduler.handle(self._motion_tick, owner=self)
+        self._motion_last = 0.0     # 上一个运动 tick 的时刻
+        self._motion_carry = 0.0    # 不足一帧的剩余时间（帧）
+
+    def add_pet(self, char_name=None):
+        pet = PetCore(self, WindowGeometry(None, self.screen), char_name)
+        pet.start()
+        return pet
+
+    def new_pet_id(self):
+        self.pet_seq += 1
+        return self.pet_seq
+
+    def attach(self, pet):
+        """宠物初始化完成后登记到共享时钟"""
+        self.pets.append(pet)
+        if self.trace is not None:
+            self.trace.pet(pet)
+
+    def remove_pet(self, pet):
+        if pet not in self.pets:
+            return
+        pet.cancel_timers()
+        self.pets.remove(pet)
+
+    def prefetch_character(self, name):
+        """即将切换到 name：有素材加载器时让它的帧插队解码"""
+
+    def character_ready(self, name, retry):
+        """name 的帧是否可以立即显示；否则安排就绪后调用 retry 并返回 False"""
+        return True
+
+    def _on_pointer_move(self, x, y):
+        for pet in tuple(self.pets):
+            pet._on_mouse_move(x, y)
+
+    # ---- 共享运动 tick ----
+    def wake_motion(self):
+        if not self.motion_timer.active:
+            self._motion_last = self.scheduler.clock()
+            self._motion_carry = 0.0
+            self.motion_timer.rearm(self.config.MOTION_INTERVAL_MS)
+
+    def reset_trajectories(self):
+        """帧间隔变化后按新的采样间隔重新规划运动（从当前位置继续）"""
+        for pet in self.pets:
+            pet.action_manager.trajectory = None
+
+    def _elapsed_frames(self):
+        """距上一个 tick 实际流逝了几帧：迟到时补走，最多补 MAX_CATCHUP_MS，余数留给下一帧"""
+        now = self.scheduler.clock()
+        interval = self.config.MOTION_INTERVAL_MS
+        elapsed_ms = min((now - self._motion_last) * 1000, self.MAX_CATCHUP_MS)
+        self._motion_last = now
+        frames = elapsed_ms / interval + self._motion_carry
+        whole = int(frames + 1e-6)    # 浮点误差不应让准点的 tick 少走一帧
+        self._motion_carry = frames - whole
+        return whole
+
+    def _motion_tick(self):
+        metrics = self.metrics
+        started = time.perf_counter() if metrics is not None else 0.0
+        frames = self._elapsed_frames()
+        movers, trajs = [], []
+        for pet in self.pets:
+            if pet.state in MOTION_STATES:
+                traj = pet.action_manager.prepare_tick()
+                if traj is not None:
+                    movers.append(pet)
+                    trajs.append(traj)
+        # 所有宠物的下一帧坐标一次数组运算取出；tick 提前到达（不足一帧）时这次不动
+        if frames:
+            for pet, step in zip(movers, self.trajectories.step(trajs, frames)):
+                pet.action_manager.apply_step(*step)
+        # 没有宠物在动就挂起，进入运动状态时由 set_state 唤醒
+        if metrics is not None:
+            metrics.observe_tick(metrics.motion_tick, self.motion_timer, self.config.MOTION_INTERVAL_MS, started)
+        if any(pet.state in MOTION_STATES for pet in self.pets):
+            self.motion_timer.rearm(self.config.MOTION_INTERVAL_MS)
+
+
+class PetWorld(SimWorld):
+    """同一进程内所有宠物共享的资源。
+
+    一个 Tk 解释器、一个调度器、一个运动 tick、一个动画时钟、一个指针跟踪器和一份
+    已解码帧缓存；每只宠物只是一个窗口加上自己的状态机，单只宠物的开销基本恒定。
+    """
+
+    STARTUP_BUDGET_MS = 500   # 首帧耗时预算，--profile-startup 时超出会提示
+    RESCAN_POLL_MS = 100      # 等待后台角色目录验证结果的间隔
+    ANIMATION_SLACK_S = 0.005  # 动画时钟一次唤醒里顺带换掉的提前量
+
+    def __init__(self, root, rebuild_cache=False, profile_startup=False, clock=None, rng=None,
+                 trace=None, settings=None, asset_workers=2):
+        self.root = root
+        self.profile_startup = profile_startup
+        config, characters, self.index = Config.load_with_index(settings)   # config.json 只解析一次
+        _startup_mark("读取配置")
+        if not characters:
+            messagebox.showerror("配置错误", "config.json 中没有定义任何角色！")
+            sys.exit(1)
+        scheduler = Scheduler(root) if clock is None else Scheduler(root, clock)
+        super().__init__(config, characters, scheduler, rng=rng, trace=trace,
+                         screen=(root.winfo_screenwidth(), root.winfo_screenheight()))
+        if trace is not None:
+            trace.attach(self)
+        self._ensure_assets_dir()
+        self.first_frame_ms = None
+        self.sprite_cache = self._open_sprite_cache(rebuild_cache)
+        _startup_mark("打开磁盘缓存")
+        self.frame_cache = FrameCache(self.config.FRAME_CACHE_ENTRIES, self.config.FRAME_CACHE_BYTES)
+        self.memory = MemoryGovernor(self)
+        self.asset_loader = AssetLoader(root, self.frame_cache, self.config.SPRITE_SCALE,
+                                        workers=asset_workers, disk_cache=self.sprite_cache,
+                                        atlas=self.config.RENDERER == 'canvas')
+        self.asset_loader.has_room = self.memory.has_room
+        self.pointer = PointerTracker(root, self.scheduler, self._on_pointer_move,
+                                      self.config.MOTION_INTERVAL_MS, self.config.POINTER_POLL_MS, owner=self)
+        # ✅ 使用 bind_all 确保全屏捕获鼠标移动（由 PointerTracker 合并到每帧一次）
+        if trace is not None:
+            self.pointer.read_pointer = trace.traced_sampler(self.pointer.read_pointer)
+            root.bind_all("<Motion>", self._traced_motion)
+        else:
+            root.bind_all("<Motion>", self.pointer.on_motion)
+        self.animation_timer = self.scheduler.handle(self._animation_tick, owner=self)
+        self._animation_heap = []         # (下一帧截止时间, 序号, 宠物)，每拍只弹出到期的
+        self._animation_seq = 0
+        self.dropped_frames = 0           # 动画时钟落后时跳过的帧数
+        thumbs_dir = os.path.join(self.sprite_cache.cache_dir, 'thumbs') if self.sprite_cache else None
+        self.thumbnails = ThumbnailLoader(root, thumbs_dir, on_ready=self._on_thumbnail)
+        self.context_menu = None          # 第一次右键时创建
+        self._rescan = None               # 后台重新验证角色清单的线程
+        self._rescan_again = False
+        self.hot_reloader = HotReloader(self)
+        self._configure_metrics()
+        _startup_mark("共享服务")
+
+    def _ensure_assets_dir(self):
+        if not os.path.exists(self.config.ASSETS_DIR):
+            os.makedirs(self.config.ASSETS_DIR)
+            messagebox.showinfo("提示", f"已创建'{self.config.ASSETS_DIR}'文件夹，请将GIF文件放入其中。")
+
+    def _open_sprite_cache(self, rebuild):
+        cache_dir = self.config.SPRITE_CACHE_DIR
+        if cache_dir is None:
+            return None
+        try:
+            cache = SpriteDiskCache(cache_dir)
+        except OSError as e:
+            print(f"⚠️ 精灵缓存不可用: {e}")
+            return None
+        if rebuild:
+            cache.clear()
+        return cache
+
+    def report_first_frame(self):
+        """第一次显示真实帧时报告启动耗时"""
+        if self.first_frame_ms is None:
+            self.first_frame_ms = (time.perf_counter() - _START_TIME) * 1000
+            print(f"首帧耗时: {self.first_frame_ms:.0f} ms")
+            if self.profile_startup:
+                # 等 Tk 处理完挂起的绘制再出报告
+                self.root.after_idle(self._print_startup_profile)
+
+    def _print_startup_profile(self):
+        _startup_mark("首次空闲")
+        print("启动阶段耗时:")
+        for (_, prev), (phase, t) in zip(_STARTUP_MARKS, _STARTUP_MARKS[1:]):
+            print(f"  {(t - prev) * 1000:8.1f} ms  {phase}")
+        total = (_STARTUP_MARKS[-1][1] - _START_TIME) * 1000
+        print(f"  {total:8.1f} ms  合计")
+        if self.first_frame_ms > self.STARTUP_BUDGET_MS:
+            print(f"⚠️ 首帧耗时超出预算 {self.STARTUP_BUDGET_MS} ms")
+
+    def add_pet(self, char_name=None):
+        """新开一个 Toplevel 宠物窗口"""
+        return DesktopPet(tk.Toplevel(self.root), world=self, char_name=char_name)
+
+    def _traced_motion(self, event):
+        self.trace.input(TraceRecorder.POINTER, 0, event.x_root, event.y_root)
+        self.pointer.on_motion(event)
+
+    def attach(self, pet):
+        """DesktopPet 初始化完成后登记到共享时钟"""
+        super().attach(pet)
+        self.memory.enforce()       # 登记前显示的第一张动画还没算进总账
+        if len(self.pets) == 1:
+            # 首帧显示后再在后台预解码全部角色、导入 NumPy
+            self.asset_loader.preload(self.characters, pet.character_names[pet.current_char_idx])
+            self.thumbnails.request(self.characters, self.index.mtime)
+            self.rescan_characters()
+            if np is None:
+                threading.Thread(target=_import_numpy, daemon=True).start()
+
+    def remove_pet(self, pet):
+        if pet not in self.pets:
+            return
+        super().remove_pet(pet)
+        if pet.master is self.root:
+            self.root.withdraw()     # 根窗口还承载着解释器，只隐藏
+        else:
+            pet.master.destroy()
+        if not self.pets:
+            self.root.quit()
+
+    def show_context_menu(self, pet, x, y):
+        if self.context_menu is None:
+            self.context_menu = ContextMenu(self)
+        self.context_menu.post(pet, x, y)
+
+    def _on_thumbnail(self, name, photo):
+        if self.context_menu is not None:
+            self.context_menu.set_thumbnail(name, photo)
+
+    def prefetch_character(self, name):
+        self.asset_loader.request_character(name)
+
+    def character_ready(self, name, retry):
+        if self.asset_loader.is_ready(name, PetState.IDLE.value):
+            return True
+        self.asset_loader.when_ready(name, PetState.IDLE.value, retry)
+        return False
+
+    # ---- 热更新 ----
+    def hot_reload(self, changed):
+        """changed 为 mtime 变化过的文件；设置原地生效，只重新解码改动过的 GIF"""
+        config_path = Config.config_path()
+        # 资源包被替换时随配置一起重新挂载；成员 mtime 在缓存键里，没变的成员照样命中
+        packs = changed & ASSET_FS.packs.keys()
+        gifs = changed - {config_path} - packs
+        stale = self._reload_config() if config_path in changed or packs else set()
+        for gif_path in gifs:
+            self.asset_loader.invalidate(gif_path)
+        for pet in self.pets:
+            if pet in stale or pet.current_gif_path in gifs \
+                    or (packs and ASSET_FS.pack_of(pet.current_gif_path or '') in packs):
+                pet.reload_animation()
+        # 不在屏幕上的改动也在后台重新解码，之后切换状态直接命中缓存
+        for gif_path in gifs:
+            if ASSET_FS.exists(gif_path):
+                self.asset_loader.request(gif_path, priority=5)
+        self.thumbnails.request(self.characters, self.index.mtime)
+        print(f"✅ 已热更新: {', '.join(sorted(os.path.basename(p) for p in changed))}")
+
+    def _reload_config(self):
+        """重新读取 config.json，返回需要换图的宠物"""
+        try:
+            raw = Config.read_raw()
+        except Exception as e:
+            print(f"⚠️ 读取配置失败: {e}，保留当前配置")
+            return set()
+        if raw is None:
+            return set()
+        # 先在新对象上校验、编译，成功后再整体换上；任何一步失败都保留当前配置
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError("顶层不是一个对象")
+            Config.validate(raw.get('settings', {}))
+            Config.mount_packs(raw)
+            merged = Config.merge_settings(raw)
+            Config.validate(merged)
+            config = Config(merged)
+        except (TypeError, ValueError) as e:
+            print(f"⚠️ 配置无效: {e}，保留当前配置")
+            Config.mount_packs({'settings': self.config.settings})   # 换回原来的资源包
+            return set()
+        old_scale = self.config.SPRITE_SCALE
+        self.config.replace_with(config)
+        self._apply_settings()
+        stale = set()
+        if self.config.SPRITE_SCALE != old_scale:
+            # 缩放变了，所有旧帧都用不上了
+            self.asset_loader.scale = self.config.SPRITE_SCALE
+            self.frame_cache.clear()
+            stale.update(self.pets)
+        if self.apply_renderer():
+            stale.update(self.pets)
+        characters = self.index.merge(Config.parse_characters(raw))
+        if not characters:
+            print("⚠️ 没有找到任何角色，保留当前角色表")
+            return stale
+        return stale | self._set_characters(characters)
+
+    def _set_characters(self, characters):
+        """原地换上新的角色表（所有宠物共享同一个 dict / list），返回需要换图的宠物"""
+        stale = set()
+        current = {pet: pet.character_names[pet.current_char_idx] for pet in self.pets}
+        self.characters.clear()
+        self.characters.update(characters)
+        self.character_names[:] = list(characters)
+        for pet, name in current.items():
+            if name not in characters:
+                print(f"⚠️ 角色 {name} 已被移除")
+                pet.current_char_idx = 0
+                pet.switch_to_character(self.character_names[0])
+                continue
+            pet.current_char_idx = self.character_names.index(name)
+            state_map = characters[name]
+            if state_map.get(pet.state.value) != pet.state_map.get(pet.state.value):
+                stale.add(pet)
+            pet.state_map = state_map
+        if self.pets:
+            self.asset_loader.preload(self.characters, self.character_names[self.pets[0].current_char_idx])
+        return stale
+
+    # ---- 角色目录 ----
+    def rescan_characters(self):
+        """在后台线程对照目录 mtime 重新验证角色清单；已在验证时排到它结束后再来一次"""
+        if self._rescan is not None:
+            self._rescan_again = True
+            return
+        self._rescan = threading.Thread(target=self.index.revalidate, daemon=True)
+        self._rescan.start()
+        self.root.after(self.RESCAN_POLL_MS, self._poll_rescan)
+
+    def _poll_rescan(self):
+        if self._rescan.is_alive():
+            self.root.after(self.RESCAN_POLL_MS, self._poll_rescan)
+            return
+        self._rescan = None
+        characters = self.index.merge(self.index.explicit)
+        if characters and characters != self.characters:
+            added = len(characters.keys() - self.characters.keys())
+            removed = len(self.characters.keys() - characters.keys())
+            for pet in self._set_characters(characters):
+                pet.reload_animation()
+            self.thumbnails.request(self.characters, self.index.mtime)
+            print(f"✅ 角色目录已更新: 新增 {added}，移除 {removed}，共 {len(characters)} 个角色")
+        if self._rescan_again:
+            self._rescan_again = False
+            self.rescan_characters()
+
+    def apply_renderer(self):
+        """renderer 设置变化时换掉所有宠物的显示控件；帧的形式不同，缓存也要清空。返回是否变化"""
+        atlas = self.config.RENDERER == 'canvas'
+        if atlas == self.asset_loader.atlas:
+            return False
+        self.asset_loader.atlas = atlas
+        self.frame_cache.clear()
+        for pet in self.pets:
+            pet.rebuild_view()
+        return True
+
+    def _apply_settings(self):
+        cfg = self.config
+        self.frame_cache.resize(cfg.FRAME_CACHE_ENTRIES, cfg.FRAME_CACHE_BYTES)
+        self.memory.enforce()
+        self.pointer.configure(cfg.MOTION_INTERVAL_MS, cfg.POINTER_POLL_MS)
+        for pet in self.pets:
+            pet.drag.frame_ms = cfg.MOTION_INTERVAL_MS
+            pet.retime_animation()
+        self.reset_trajectories()
+        self._configure_metrics()
+
+    def _configure_metrics(self):
+        """按设置开关运行指标；没有配置端口和文件时保持 None，埋点零开销"""
+        cfg = self.config
+        wanted = (cfg.METRICS_PORT, cfg.METRICS_FILE, cfg.METRICS_INTERVAL_MS)
+        if self.metrics is not None:
+            if self.metrics.settings == wanted:
+                return
+            self.metrics.close()
+            self.metrics = None
+        if cfg.METRICS_PORT or cfg.METRICS_FILE:
+            self.metrics = Metrics(self, *wanted)
+
+    # ---- 共享动画时钟 ----
+    def wake_animation(self, pet, due):
+        """pet 的下一帧在 due 时刻：登记进动画堆，时钟没在走或定得更晚时按 due 重新定时"""
+        if pet._wake_due == due:
             return
+        # 旧登记不删，弹出时对不上 _wake_due 就跳过
+        pet._wake_due = due
+        self._animation_seq += 1
+        heapq.heappush(self._animation_heap, (due, self._animation_seq, pet))
+        timer = self.animation_timer
+        if not timer.active or timer.deadline > due:
+            timer.rearm_at(due)
 
-        # 4. 加速度朝向边缘
-        self.fall_velocity += self.pet.config.GRAVITY
-        # 在 apply_gravity 中增加最大速度限制
-        MAX_FALL_SPEED = 20
-        self.fall_velocity = min(self.fall_velocity, MAX_FALL_SPEED)
-        move = min(self.fall_velocity, distance)  # 不要冲过边缘
-        ratio = move / distance
-        new_x = round(x + dx * ratio)
-        new_y = round(y + dy * ratio)
+    def _animation_tick(self):
+        metrics = self.metrics
+        started = time.perf_counter() if metrics is not None else 0.0
+        # 几毫秒内就到期的帧一起换，多只宠物、不同帧时长时不至于各自唤醒一次
+        now = self.scheduler.clock() + self.ANIMATION_SLACK_S
+        heap = self._animation_heap
+        due_pets = []
+        while heap and heap[0][0] <= now:
+            due, _, pet = heapq.heappop(heap)
+            if pet._wake_due == due:      # 只处理到期的宠物，其余的不碰
+                pet._wake_due = None
+                due_pets.append(pet)
+        for pet in due_pets:
+            due = pet._advance_frame(now)
+            if due is not None:
+                self._animation_seq += 1
+                pet._wake_due = due
+                heapq.heappush(heap, (due, self._animation_seq, pet))
+        if metrics is not None:
+            metrics.observe_tick(metrics.animation_tick, self.animation_timer,
+                                 self.config.DEFAULT_ANIMATION_SPEED, started)
+        while heap and heap[0][2]._wake_due != heap[0][0]:
+            heapq.heappop(heap)
+        if heap:
+            self.animation_timer.rearm_at(heap[0][0])
 
-        self.master.geometry(f"+{new_x}+{new_y}")
+# --- 5.1 轨迹回放 (Replay) ---
+def _comparable(records):
+    """回放比对用的记录：定时器触发和状态切换（指标刷新除外）"""
+    T = TraceRecorder
+    return [(kind, pet, payload) for _, kind, pet, payload in records
+            if kind == T.STATE or kind == T.TIMER and payload[0] != 'Metrics._refresh']
 
 
-# --- 5. 程序入口 ---
-def main():
+def replay_trace(path, root, overrides=None):
+    """用注入的时钟和随机数按轨迹重放一次会话，返回统计信息。
+
+    输入事件、调度器唤醒、随机抽样和指针读数都取自轨迹，素材同步解码，
+    因此同一份轨迹每次回放的定时器触发顺序和状态切换完全一致；回放过程
+    同样被记录下来，与原轨迹逐条比对，第一处不一致记为偏离。
+    """
+    T = TraceRecorder
+    meta, records = T.read(path)
+    draws = [(kind, payload[0] if kind == T.RANDOM else payload[1])
+             for _, kind, _, payload in records if kind in (T.RANDOM, T.BITS)]
+    samples = deque(payload for _, kind, _, payload in records if kind == T.SAMPLE)
+    expected = _comparable(records)
+
+    clock = ManualClock()
+    check = TraceRecorder(capacity=None)
+    # 回放时不开指标服务，避免和正在运行的实例抢端口/文件（指标定时器也不参与比对）
+    settings = dict(Config.DEFAULTS, **meta.get('settings', {}))
+    settings.update(metrics_port=0, metrics_file='')
+    settings.update(overrides or {})
+    world = PetWorld(root, clock=clock, rng=ReplayRandom(draws), trace=check,
+                     settings=settings, asset_workers=0)
+    world.pointer.read_pointer = lambda: samples.popleft() if samples else world.pointer.pos
+    screen_w, screen_h = meta.get('screen', (world.root.winfo_screenwidth(), world.root.winfo_screenheight()))
+    world.pointer.screen_h = screen_h
+    root.withdraw()
+    pets = {}
+
+    def pet_of(pet_id):
+        pet = pets.get(pet_id)
+        if pet is None:
+            pet = next((p for p in world.pets if p.trace_id == pet_id), None)
+            pets[pet_id] = pet
+        return pet
+
+    started = time.perf_counter()
+    error = None
+    try:
+        for t, kind, pet_id, payload in records:
+            clock.now = max(clock.now, t)
+            if kind == T.DISPATCH:
+                world.scheduler.dispatch()
+            elif kind == T.PET:
+                pet = pet_of(pet_id) or world.add_pet(payload[0])
+                pet.master.withdraw()
+                pet.geometry.screen_w, pet.geometry.screen_h = screen_w, screen_h
+                pet.geometry.set(payload[1], payload[2], pet.geometry.w, pet.geometry.h)
+                pets[pet_id] = pet
+            elif kind == T.POINTER:
+                world.pointer.on_motion(types.SimpleNamespace(x_root=payload[0], y_root=payload[1]))
+            elif kind in (T.PRESS, T.MOTION, T.RELEASE):
+                pet = pet_of(pet_id)
+                if pet is None or pet not in world.pets:
+                    continue
+                event = types.SimpleNamespace(x_root=payload[0], y_root=payload[1])
+                if kind == T.PRESS:
+                    pet._on_drag_start(event)
+                    pet._on_left_click(event)
+                elif kind == T.MOTION:
+                    pet._on_drag_motion(event)
+                else:
+                    pet._on_drag_release(event)
+            elif kind == T.MENU:
+                pet = pet_of(pet_id)
+                if pet is not None and pet in world.pets:
+                    pet._menu(*payload)
+    except ValueError as e:
+        error = str(e)
+    elapsed = time.perf_counter() - started
+
+    actual = _comparable(T.read_records(b''.join(check.ring), check.strings))
+    diverged = next((i for i, (a, b) in enumerate(zip(expected, actual)) if a != b), None)
+    # 没有正常结束的轨迹只比对已记录的部分：回放在最后一条记录之后多出的不算偏离
+    if diverged is None and len(expected) != len(actual) and not (
+            meta['truncated'] and len(actual) > len(expected)):
+        diverged = min(len(expected), len(actual))
+    return {'records': len(records), 'timers': sum(1 for k, _, _ in actual if k == T.TIMER),
+            'states': sum(1 for k, _, _ in actual if k == T.STATE), 'elapsed_s': round(elapsed, 4),
+            'session_s': round(records[-1][0], 3) if records else 0.0,
+            'diverged_at': diverged, 'error': error, 'truncated': meta['truncated']}
+
+# --- 5.2 无界面模拟 (Headless Simulation) ---
+class _SimUser:
+    """模拟用户：每隔一段随机时间做一个手势（移动指针、甩出、连点、长拖）。
+
+    用自己的随机数发生器，不影响宠物行为的随机序列；手势的每一步都挂在
+    调度器上，和真实事件一样穿插在宠物的定时器之间。
+    """
+    GESTURES = ('point', 'fling', 'clicks', 'hold')
+    WEIGHTS = (4, 3, 2, 1)
+
+    def __init__(self, world, rng, interval_s):
+        self.world = world
+        self.rng = rng
+        self.interval_ms = interval_s * 1000
+        self.gestures = Counter()
+        if interval_s > 0:
+            self._schedule()
+
+    def _schedule(self):
+        delay = self.rng.expovariate(1 / self.interval_ms)
+        self.world.scheduler.call_later(delay, self._act, owner=self)
+
+    def _act(self):
+        world = self.world
+        gesture = self.rng.choices(self.GESTURES, weights=self.WEIGHTS, k=1)[0]
+        self.gestures[gesture] += 1
+        pet = self.rng.choice(world.pets)
+        geom = pet.geometry
+        x, y = geom.x + geom.pet_w // 2, geom.y + geom.pet_h // 2
+        if gesture == 'point':
+            world.pointer.x = self.rng.randint(0, geom.screen_w)
+            world.pointer.y = self.rng.randint(0, geom.screen_h)
+            world._on_pointer_move(*world.pointer.pos)
+        elif gesture == 'clicks':
+            for i in range(3):
+                self._later(i * 150, self._press, pet, x, y)
+                self._later(i * 150 + 60, pet._on_drag_release, self._event(x, y))
+        else:
+            # 甩出：短促拖动后带速度松手；长拖：按住超过 1 秒慢慢挪动
+            frames, frame_ms = (6, world.config.MOTION_INTERVAL_MS) if gesture == 'fling' else (12, 120)
+            speed = self.rng.uniform(20, 60) if gesture == 'fling' else 4
+            angle = self.rng.uniform(0, 2 * math.pi)
+            dx, dy = speed * math.cos(angle), speed * math.sin(angle)
+            self._press(pet, x, y)
+            for i in range(1, frames + 1):
+                self._later(i * frame_ms, pet._on_drag_motion, self._event(x + dx * i, y + dy * i))
+            self._later(frames * frame_ms + 1, pet._on_drag_release,
+                        self._event(x + dx * frames, y + dy * frames))
+        self._schedule()
+
+    def _press(self, pet, x, y):
+        event = self._event(x, y)
+        pet._on_drag_start(event)
+        pet._on_left_click(event)
+
+    def _later(self, delay_ms, callback, *args):
+        self.world.scheduler.call_later(delay_ms, callback, *args, owner=self)
+
+    @staticmethod
+    def _event(x, y):
+        return types.SimpleNamespace(x_root=round(x), y_root=round(y))
+
+
+def simulate(seed, seconds=3600.0, settings=None, pets=1, user_interval_s=30.0):
+    """用固定步长把 PetCore 跑 seconds 秒（模拟时间），返回行为统计。
+
+    不创建 Tk：SimWorld + 手动时钟 + 以 seed 播种的随机数，同一组参数的结果
+    完全一致。每步推进一个运动帧，步末采样各宠物的状态和位置。
+    """
+    config = Config(dict(Config.DEFAULTS, **(settings or {})))
+    clock = ManualClock()
+    world = SimWorld(config, {'sim': {}}, Scheduler(None, clock), rng=random.Random(seed))
+    started = time.perf_counter()
+    state_s = Counter()
+    transitions = falls = 0
+    distance = 0.0
+    # 行为里的 print 在长时间模拟中没有意义
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        for _ in range(pets):
+            world.add_pet()
+        user = _SimUser(world, random.Random(f"user-{seed}"), user_interval_s)
+        last = [(pet.state, pet.geometry.x, pet.geometry.y) for pet in world.pets]
+        dt = config.MOTION_INTERVAL_MS / 1000
+        for step in range(1, int(seconds / dt) + 1):
+            world.scheduler.advance(step * dt)
+            for i, pet in enumerate(world.pets):
+                state, x, y = last[i]
+                geom = pet.geometry
+                if pet.state is not state:
+                    transitions += 1
+                    falls += pet.state is PetState.FALLING
+                if geom.x != x or geom.y != y:
+                    distance += math.hypot(geom.x - x, geom.y - y)
+                state_s[pet.state.value] += dt
+                last[i] = (pet.state, geom.x, geom.y)
+    return {'seed': seed, 'sim_s': round(clock.now, 3), 'elapsed_s': round(time.perf_counter() - started, 3),
+            'state_s': {k: round(v, 3) for k, v in state_s.items()},
+            'transitions': transitions, 'falls': falls, 'distance_px': round(distance, 1),
+            'gestures': dict(user.gestures), 'timers': world.scheduler.fired}
+
+
+def simulate_many(seeds, seconds=3600.0, settings=None, pets=1, user_interval_s=30.0, jobs=None):
+    """在进程池里按 seed 并行模拟；jobs=1 时在当前进程里顺序执行"""
+    run = functools.partial(simulate, seconds=seconds, settings=settings, pets=pets,
+                            user_interval_s=user_interval_s)
+    seeds = list(seeds)
+    if jobs == 1:
+        return [run(seed) for seed in seeds]
+    workers = jobs or os.cpu_count() or 1
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, seeds, chunksize=max(1, len(seeds) // (4 * workers))))
+
+
+def summarize_simulation(results):
+    """汇总多个 seed 的结果：各状态时间占比，以及每小时的切换/掉落/移动距离"""
+    hours = sum(r['sim_s'] for r in results) / 3600 or 1.0
+    total = sum(sum(r['state_s'].values()) for r in results) or 1.0
+    state_s = Counter()
+    for r in results:
+        state_s.update(r['state_s'])
+    return {'runs': len(results), 'sim_hours': round(hours, 3),
+            'cpu_s': round(sum(r['elapsed_s'] for r in results), 3),
+            'state_share': {k: round(v / total, 4) for k, v in state_s.most_common()},
+            'transitions_per_hour': round(sum(r['transitions'] for r in results) / hours, 1),
+            'falls_per_hour': round(sum(r['falls'] for r in results) / hours, 1),
+            'distance_px_per_hour': round(sum(r['distance_px'] for r in results) / hours, 1)}
+
+
+def _parse_setting(text):
+    """--set key=value：value 按 JSON 解析，解析不了就当字符串"""
+    import argparse
+    key, sep, value = text.partition('=')
+    if not sep or key not in Config.DEFAULTS:
+        raise argparse.ArgumentTypeError(f"未知设置: {text}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+# --- 6. 程序入口 ---
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="DeskGo 桌面角色")
+    parser.add_argument("--pets", nargs="+", metavar="NAME",
+                        help="多宠物模式：在同一进程里按名单启动多个角色（名字可重复）")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="清空磁盘精灵缓存，重新解码全部 GIF")
+    parser.add_argument("--memory-report", action="store_true",
+                        help="打印每个角色去重/裁边前后的帧内存占用后退出")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="首帧显示后打印各启动阶段的耗时")
+    parser.add_argument("--record", metavar="FILE",
+                        help="把输入事件、定时器、随机抽样和状态切换记录到二进制轨迹文件")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="按轨迹文件快速重放一次会话并检查是否与原记录一致，然后退出")
+    parser.add_argument("--simulate", type=int, metavar="N",
+                        help="不开窗口，用 N 个随机种子在进程池里模拟宠物行为，打印汇总后退出")
+    parser.add_argument("--sim-hours", type=float, default=1.0, metavar="H",
+                        help="每个种子模拟的时长（小时，默认 1）")
+    parser.add_argument("--sim-pets", type=int, default=1, metavar="K", help="每次模拟的宠物数量")
+    parser.add_argument("--set", type=_parse_setting, action="append", default=[], metavar="KEY=VALUE",
+                        help="模拟时覆盖 config.json 里的设置，可重复，如 --set gravity=3")
+    parser.add_argument("--jobs", type=int, metavar="J", help="模拟用的进程数（默认 CPU 核数）")
+    parser.add_argument("--build-pack", metavar="OUT",
+                        help="把素材目录（默认 images/）打成一个资源包文件后退出")
+    parser.add_argument("--pack-from", metavar="DIR", help="--build-pack 的来源目录")
+    args = parser.parse_args(argv)
+
+    if args.build_pack:
+        src = args.pack_from or Config.ASSETS_DIR
+        count = build_pack(src, args.build_pack)
+        size = os.path.getsize(args.build_pack)
+        print(f"✅ 已生成资源包 {args.build_pack}: {count} 个文件，{size / 1048576:.2f} MB")
+        return
+
+    if args.memory_report:
+        config, characters = Config.load()
+        for name, (before, after) in memory_report(characters, config.SPRITE_SCALE).items():
+            saved = 100 * (1 - after / before) if before else 0
+            print(f"{name:<12} {before / 1048576:8.2f} MB -> {after / 1048576:8.2f} MB  (-{saved:.0f}%)")
+        return
+
+    if args.simulate:
+        config, _ = Config.load()
+        settings = dict(config.settings, **dict(args.set))
+        started = time.perf_counter()
+        results = simulate_many(range(args.simulate), args.sim_hours * 3600, settings,
+                                pets=args.sim_pets, jobs=args.jobs)
+        summary = summarize_simulation(results)
+        summary['wall_s'] = round(time.perf_counter() - started, 3)
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+
+    if args.replay:
+        try:
+            result = replay_trace(args.replay, tk.Tk())
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 无法读取轨迹: {e}")
+            sys.exit(1)
+        print(json.dumps(result, ensure_ascii=False))
+        if result['error'] or result['diverged_at'] is not None:
+            print(f"⚠️ 回放与原记录不一致（第 {result['diverged_at']} 条）: {result['error'] or ''}")
+            sys.exit(1)
+        print(f"✅ 回放一致：{result['session_s']} 秒的会话用时 {result['elapsed_s']} 秒")
+        return
+
+    _startup_mark("解析参数")
     root = tk.Tk()
-    app = DesktopPet(root)
-    root.mainloop()
+    _startup_mark("创建 Tk")
+    trace = TraceRecorder(args.record) if args.record else None
+    world = PetWorld(root, rebuild_cache=args.rebuild_cache, profile_startup=args.profile_startup, trace=trace)
+    if args.pets:
+        root.withdraw()              # 根窗口只承载解释器，宠物都是 Toplevel
+        for name in args.pets:
+            if name not in world.characters:
+                print(f"⚠️ 未知角色: {name}")
+                continue
+            world.add_pet(name)
+        if not world.pets:
+            world.add_pet()
+    else:
+        DesktopPet(root, world=world)
+    try:
+        root.mainloop()
+    finally:
+        # 异常退出时也把已缓冲的记录写出去，轨迹至少能回放到出错之前
+        if trace is not None:
+            trace.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file